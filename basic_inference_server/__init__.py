@@ -2,6 +2,7 @@ try:
   from .logger import Logger, DotDict, SBLogger
 except ModuleNotFoundError:
   from .public_logger import Logger, DotDict
+from .public_logger import SlimLogger
 
 from .generic_obj import BaseObject
 
@@ -10,9 +11,16 @@ from .lib_ver import __VER__ as LIB_VER
 from .plugins_manager_mixin import _PluginsManagerMixin
 from .config_handler_mixin import _ConfigHandlerMixin
 
-from .model_server.gateway import FlaskGateway, get_packages
 from .model_server import FlaskModelServer
 from .model_server import FlaskWorker
 
 
+def __getattr__(name):
+  # see `model_server.__getattr__`: the gateways are imported on first use
+  if name in ['FlaskGateway', 'get_packages', 'AsyncGateway']:
+    from . import model_server
+    return getattr(model_server, name)
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
 
@@ -23,9 +23,12 @@ import textwrap
 import numpy as np
 import traceback
 import socket
+import atexit
+import queue
 import threading
 
 from time import time as tm
+from time import monotonic
 from time import strftime, localtime
 from collections import OrderedDict
 from datetime import datetime as dt
@@ -54,6 +57,122 @@ COLORS = {
 
 _LOGGER_LOCK_ID = '_logger_print_lock' 
 
+_LOG_WRITER_MAX_QUEUE = 50_000
+_LOG_WRITER_FLUSH_LINES = 200
+_LOG_WRITER_FLUSH_INTERVAL = 1.0
+_LOG_WRITER_FLUSH_TIMEOUT = 5
+
+
+class LogWriter(object):
+  """
+  Background writer for the log files. Logging threads only enqueue the new lines
+  (no file I/O) and a daemon thread appends them to the log files in chunks, either when
+  `flush_lines` lines are buffered or every `flush_interval` seconds.
+  In HTML mode the whole log is written in reverse order so only the latest snapshot
+  of each file is written.
+  """
+  def __init__(self, 
+               max_queue=_LOG_WRITER_MAX_QUEUE, 
+               flush_lines=_LOG_WRITER_FLUSH_LINES, 
+               flush_interval=_LOG_WRITER_FLUSH_INTERVAL,
+               ):
+    self._queue = queue.Queue(maxsize=max_queue)
+    self._flush_lines = flush_lines
+    self._flush_interval = flush_interval
+    self._lock = threading.Lock()
+    self._nr_dropped = 0
+    self._thread = threading.Thread(target=self._run, name='LogWriter', daemon=True)
+    self._thread.start()
+    return
+
+  def _put(self, item):
+    try:
+      self._queue.put_nowait(item)
+    except queue.Full:
+      with self._lock:
+        self._nr_dropped += 1
+    return
+
+  def write(self, log_file, line):
+    self._put(('line', log_file, line))
+    return
+
+  def write_html(self, log_file, lines):
+    self._put(('html', log_file, lines))
+    return
+
+  def flush(self, timeout=_LOG_WRITER_FLUSH_TIMEOUT):
+    """
+    Blocks until all the lines enqueued so far are written (or `timeout` expires)
+    """
+    if not self._thread.is_alive():
+      return False
+    done = threading.Event()
+    try:
+      self._queue.put(('flush', None, done), timeout=timeout)
+    except queue.Full:
+      return False
+    return done.wait(timeout)
+
+  def _write(self, buffers, html_snapshots):
+    with self._lock:
+      nr_dropped = self._nr_dropped
+      self._nr_dropped = 0
+    if nr_dropped > 0 and len(buffers) > 0:
+      last_file = list(buffers.keys())[-1]
+      buffers[last_file].append("[LogWriter] {} log lines dropped due to full queue".format(nr_dropped))
+    for log_file, lines in buffers.items():
+      try:
+        with codecs.open(log_file, "a", "utf-8") as fh:
+          fh.write("".join(["{}\n".format(x) for x in lines]))
+      except:
+        pass
+    for log_file, lines in html_snapshots.items():
+      try:
+        with codecs.open(log_file, "w", "utf-8") as fh:
+          fh.write(_HTML_START)
+          fh.write("".join(["{}\n".format(x) for x in reversed(lines)]))
+          fh.write(_HTML_END)
+      except:
+        pass
+    return
+
+  def _run(self):
+    buffers, html_snapshots = OrderedDict(), {}
+    nr_buffered = 0
+    last_flush = monotonic()
+    while True:
+      timeout = max(self._flush_interval - (monotonic() - last_flush), 0.01)
+      flush_event = None
+      try:
+        kind, log_file, payload = self._queue.get(timeout=timeout)
+        if kind == 'line':
+          buffers.setdefault(log_file, []).append(payload)
+          nr_buffered += 1
+        elif kind == 'html':
+          html_snapshots[log_file] = payload
+          nr_buffered += 1
+        elif kind == 'flush':
+          flush_event = payload
+      except queue.Empty:
+        pass
+      if (
+        flush_event is not None or
+        nr_buffered >= self._flush_lines or
+        (monotonic() - last_flush) >= self._flush_interval
+        ):
+        if nr_buffered > 0:
+          self._write(buffers, html_snapshots)
+          buffers, html_snapshots = OrderedDict(), {}
+          nr_buffered = 0
+        last_flush = monotonic()
+        if flush_event is not None:
+          flush_event.set()
+      #endif
+    #endwhile
+    return
+
+
 class BaseLogger(object):
 
   def __init__(self, lib_name="",
@@ -103,6 +222,11 @@ class BaseLogger(object):
 
     self.last_time = tm()
     self.app_log = list()
+    self._nr_saved_lines = 0
+    self._log_writer = None
+    if not self.no_folders_no_save:
+      self._log_writer = LogWriter()
+      atexit.register(self.flush_log)
     self.split_part = 1
     self.config_data = None
     self.MACHINE_NAME = None
@@ -256,8 +380,9 @@ class BaseLogger(object):
       command ="sysctl -n machdep.cpu.brand_string"
       self.processor_platform = subprocess.check_output(command, shell=True).strip().decode('utf-8')
     elif str_system == "Linux":
-      command = "cat /proc/cpuinfo"
-      all_info = subprocess.check_output(command, shell=True).decode().strip()
+      # read directly: a `cat` shell for each logger adds up in the server processes
+      with open('/proc/cpuinfo', 'rt') as fh:
+        all_info = fh.read().strip()
       for line in all_info.split("\n"):
         if "model name" in line:
           self.processor_platform = re.sub( ".*model name.*:", "", line,1)    
@@ -470,37 +595,32 @@ class BaseLogger(object):
     return
 
   def _save_log(self, DEBUG_ERRORS=False):
+    """
+    Hands the lines added since the last call to the background `LogWriter` - 
+    no file I/O is done in the calling thread
+    """
     if self.no_folders_no_save:
       return
-    nowtime = dt.now()
-    strnowtime = nowtime.strftime("[{}][%Y-%m-%d %H:%M:%S] ".format(self.__lib__))
-    stage = 0
-    try:
-      log_output = codecs.open(self.log_file, "w", "utf-8")  # open(self.log_file, 'w+')
-      stage += 1
-      if self.HTML:
-        log_output.write(_HTML_START)
-        stage += 1
-        iter_list = reversed(self.app_log)
-      else:
-        iter_list = self.app_log
-      for log_item in iter_list:
-        # if self.HTML:
-        #  log_output.write("%s<BR>\n" % log_item)
-        # else:
-        log_output.write("{}\n".format(log_item))
-        stage += 1
-      if self.HTML:
-        log_output.write(_HTML_END)
-        stage += 1
-      log_output.close()
-      stage += 1
-    except:
-      if DEBUG_ERRORS:
-        print(strnowtime + "LogWErr S: {} [{}]".format(stage,
-                                                       sys.exc_info()[0]), flush=True)
+    log_file = getattr(self, 'log_file', None)
+    if log_file is None:
+      # log path not yet generated, lines will be saved at next call
+      return
+    if self.HTML:
+      self._log_writer.write_html(log_file, list(self.app_log))
+    else:
+      for log_item in self.app_log[self._nr_saved_lines:]:
+        self._log_writer.write(log_file, log_item)
+    self._nr_saved_lines = len(self.app_log)
     return
 
+  def flush_log(self, timeout=_LOG_WRITER_FLUSH_TIMEOUT):
+    """
+    Waits until all the log lines are written to the log file
+    """
+    if self._log_writer is None:
+      return False
+    return self._log_writer.flush(timeout=timeout)
+
   def _check_log_size(self):
     if self.max_lines is None:
       return
@@ -509,6 +629,7 @@ class BaseLogger(object):
       self._add_log("Ending log part {}".format(self.split_part))
       self._save_log()
       self.app_log = []
+      self._nr_saved_lines = 0
       self.split_part += 1
       self._generate_log_path()
       self._add_log("Starting log part {}".format(self.split_part))
@@ -14,11 +14,15 @@ written permission from the author.
 
 """
 
-from collections import deque
+from random import random
+from time import time
 import traceback
 
 
 from .public_logger import Logger
+from .notifications import (
+  LazyMessage, NotificationBuffer, get_notification_level, LEVEL_LOG, LEVEL_WARNING,
+)
   
 
 class BaseObject(object):
@@ -42,6 +46,7 @@ class BaseObject(object):
                show_prefixes=False,
                prefix_log=None,
                maxlen_notifications=None,
+               notifications=None,
                log_at_startup=False,
                **kwargs):
 
@@ -57,7 +62,11 @@ class BaseObject(object):
     self.DEBUG = DEBUG
     self.log_at_startup = log_at_startup
 
-    self._messages = deque(maxlen=maxlen_notifications)
+    # a `NotificationBuffer` can be shared by several objects (e.g. a server and its workers)
+    self._notifications = notifications if notifications is not None else NotificationBuffer(maxlen=maxlen_notifications)
+    self._notif_level = LEVEL_LOG
+    self._notif_sampling = {}
+    self._request_notifs = True
 
     if not hasattr(self, '__name__'):
       self.__name__ = self.__class__.__name__
@@ -166,7 +175,47 @@ class BaseObject(object):
       tn = '{}__{}'.format(self.__class__.__name__, name)
     return tn
 
-  def _create_notification(self, notif, msg, info=None, stream_name=None, autocomplete_info=False, **kwargs):
+  def setup_notifications(self, level=None, sampling=None, request_notifications=None):
+    """
+    Parameters:
+    -----------
+    level: str or int, optional
+      Notifications below this level ('debug', 'log', 'warning', 'exception' or 'off') are dropped
+      The default is None ('log')
+
+    sampling: dict, optional
+      Fraction of the notifications of each type that are kept, e.g. `{"log" : 0.01}`
+      The default is None (all are kept)
+
+    request_notifications: bool, optional
+      If False the notifications of a request below the 'warning' level are dropped
+      The default is None (True)
+    """
+    self._notif_level = get_notification_level(level if level is not None else LEVEL_LOG)
+    self._notif_sampling = dict(sampling or {})
+    self._request_notifs = request_notifications if request_notifications is not None else True
+    return
+
+  def _is_notification_enabled(self, notif, level=None, per_request=False):
+    level = get_notification_level(level if level is not None else notif)
+    if level < self._notif_level:
+      return False
+    if per_request and not self._request_notifs and level < LEVEL_WARNING:
+      return False
+    rate = self._notif_sampling.get(notif)
+    if rate is not None and random() >= rate:
+      return False
+    return True
+
+  def _create_notification(self, notif, msg, info=None, stream_name=None, autocomplete_info=False,
+                           msg_args=None, level=None, per_request=False, **kwargs):
+    """
+    Records a notification that is returned by `get_notifications`. When `msg_args` is given
+    `msg` is a format string that is only formatted when the notifications are read.
+    """
+    if not self._is_notification_enabled(notif, level=level, per_request=per_request):
+      return
+
     body = {
       'MODULE': self.__class__.__name__
     }
@@ -181,19 +230,28 @@ class BaseObject(object):
       )
     #endif
 
+    if msg_args is not None:
+      if isinstance(msg, tuple):
+        # `(call_id, message)` notifications of a request
+        msg = (msg[0], LazyMessage(msg[1], msg_args))
+      else:
+        msg = LazyMessage(msg, msg_args)
+    #endif
     body['NOTIFICATION_TYPE'] = notif
-    body['NOTIFICATION'] = msg[:255]
+    body['NOTIFICATION'] = msg
     body['INFO'] = info
     body['STREAM_NAME'] = stream_name
-    body['TIMESTAMP'] = self.log.now_str(nice_print=True, short=False)
+    body['TIMESTAMP'] = time()
     body = {**body, **kwargs}
-    self._messages.append(body)
+    self._notifications.append(body)
     return
 
-  def get_notifications(self):
-    lst = []
-    while len(self._messages) > 0:
-      lst.append(self._messages.popleft())
+  def get_notifications(self, since=0):
+    """
+    Returns the rendered notifications with a sequence id (`SEQ`) above `since`. Reading does not
+    remove them, see `NotificationBuffer.get_since`
+    """
+    lst, _, _ = self._notifications.get_since(since)
     return lst
   
   
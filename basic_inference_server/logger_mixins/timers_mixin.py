@@ -2,6 +2,8 @@
 import numpy as np
 
 from collections import OrderedDict, deque
+from math import log2
+from threading import Lock, current_thread, local
 from time import perf_counter, time
 
 
@@ -13,6 +15,172 @@ ZERO_THRESHOLD = 5e-4
 
 OBSOLETE_SECTION_TIME = 3600 # sections older than 1 hour are archived
 
+HIST_MIN_VALUE = 1e-6 # laps below 1 microsecond share the first bucket
+HIST_BUCKETS_PER_OCTAVE = 16 # percentiles within ~4.4% of the actual lap
+PERCENTILES = (50, 90, 99, 99.9)
+RETIRE_THREADS_EVERY = 64 # finished threads are merged every N new threads (or on read)
+
+
+class LapHistogram(object):
+  """
+  HDR-like histogram of the laps of a timer: log-linear buckets so `add` is O(1), the memory does
+  not depend on the number of laps and the percentiles have a bounded relative error
+  """
+  __slots__ = ('counts', 'count', 'total', 'max', 'last')
+
+  def __init__(self):
+    self.counts = {}
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+    self.last = 0.0
+    return
+
+  @staticmethod
+  def _bucket(value):
+    if value <= HIST_MIN_VALUE:
+      return 0
+    return int(log2(value / HIST_MIN_VALUE) * HIST_BUCKETS_PER_OCTAVE) + 1
+
+  @staticmethod
+  def _bucket_value(idx):
+    if idx == 0:
+      return HIST_MIN_VALUE
+    # geometric middle of the bucket
+    return HIST_MIN_VALUE * 2 ** ((idx - 0.5) / HIST_BUCKETS_PER_OCTAVE)
+
+  def add(self, value):
+    idx = self._bucket(value)
+    self.counts[idx] = self.counts.get(idx, 0) + 1
+    self.count += 1
+    self.total += value
+    self.last = value
+    if value > self.max:
+      self.max = value
+    return
+
+  def merge(self, other):
+    # `other` may be updated meanwhile by its thread so its buckets are copied first
+    for idx, count in dict(other.counts).items():
+      self.counts[idx] = self.counts.get(idx, 0) + count
+    self.count += other.count
+    self.total += other.total
+    self.max = max(self.max, other.max)
+    self.last = other.last
+    return self
+
+  @property
+  def mean(self):
+    return self.total / self.count if self.count > 0 else -1
+
+  def percentile(self, q):
+    if self.count == 0:
+      return -1
+    rank = q / 100 * self.count
+    cumulative = 0
+    for idx in sorted(self.counts):
+      cumulative += self.counts[idx]
+      if cumulative >= rank:
+        return min(self._bucket_value(idx), self.max)
+    return self.max
+
+  def percentiles(self, lst_q=PERCENTILES):
+    return {'P{}'.format(str(q).replace('.', '')) : self.percentile(q) for q in lst_q}
+
+
+class _ThreadTimers(object):
+  __slots__ = ('thread', 'started', 'laps')
+
+  def __init__(self, thread):
+    self.thread = thread
+    self.started = {}
+    self.laps = {}
+    return
+
+
+class ConcurrentTimers(object):
+  """
+  Timers for any thread (Flask request threads, workers): each thread records its laps in its
+  own accumulators so `start`/`end` take no lock. The accumulators are merged when the timers are
+  read and those of finished threads are folded into a shared one.
+  """
+  def __init__(self):
+    self._local = local()
+    # only taken by new threads and by readers
+    self._lock = Lock()
+    self._threads = []
+    self._retired = {}
+    self._nr_new_threads = 0
+    return
+
+  def _get_thread_timers(self):
+    thread_timers = getattr(self._local, 'timers', None)
+    if thread_timers is None:
+      thread_timers = _ThreadTimers(current_thread())
+      self._local.timers = thread_timers
+      with self._lock:
+        self._threads.append(thread_timers)
+        self._nr_new_threads += 1
+        if self._nr_new_threads % RETIRE_THREADS_EVERY == 0:
+          self._retire_finished_threads()
+      #endwith
+    return thread_timers
+
+  def _retire_finished_threads(self):
+    alive = []
+    for thread_timers in self._threads:
+      if thread_timers.thread.is_alive():
+        alive.append(thread_timers)
+        continue
+      for key, hist in thread_timers.laps.items():
+        self._retired.setdefault(key, LapHistogram()).merge(hist)
+    #endfor
+    self._threads = alive
+    return
+
+  def start(self, sname, section):
+    start = perf_counter()
+    self._get_thread_timers().started[(section, sname)] = start
+    return start
+
+  def end(self, sname, section):
+    end = perf_counter()
+    thread_timers = self._get_thread_timers()
+    key = (section, sname)
+    start = thread_timers.started.pop(key, None)
+    if start is None:
+      return 0
+    hist = thread_timers.laps.get(key)
+    if hist is None:
+      hist = LapHistogram()
+      thread_timers.laps[key] = hist
+    hist.add(end - start)
+    return end - start
+
+  def get_histograms(self):
+    """
+    Returns the merged histograms of all threads as {(section, sname) : LapHistogram}
+    """
+    with self._lock:
+      self._retire_finished_threads()
+      merged = {key : LapHistogram().merge(hist) for key, hist in self._retired.items()}
+      for thread_timers in self._threads:
+        for key, hist in list(thread_timers.laps.items()):
+          merged.setdefault(key, LapHistogram()).merge(hist)
+      #endfor
+    #endwith
+    return merged
+
+  def get_histogram(self, sname, section):
+    return self.get_histograms().get((section, sname))
+
+  def reset(self):
+    with self._lock:
+      for thread_timers in self._threads:
+        thread_timers.laps = {}
+      self._retired = {}
+    return
+
 class _TimersMixin(object):
   """
   Mixin for timers functionalities that are attached to `libraries.logger.Logger`.
@@ -32,6 +200,7 @@ class _TimersMixin(object):
     self.timers_graph = None
     self._timer_error = None
     self.default_timers_section = DEFAULT_SECTION
+    self._concurrent_timers = ConcurrentTimers()
 
     self.reset_timers()
     return
@@ -56,6 +225,7 @@ class _TimersMixin(object):
     self.opened_timers = {}
     self.timers_graph = {}
     self._timer_error = {}
+    self._concurrent_timers.reset()
 
     self._maybe_create_timers_section()
     return
@@ -75,6 +245,7 @@ class _TimersMixin(object):
       'STOP_COUNT': 0,
       
       'LAPS' : deque(maxlen=MAX_LAPS),
+      'HIST' : LapHistogram(),
     }
 
   def restart_timer(self, sname, section=None):
@@ -91,10 +262,18 @@ class _TimersMixin(object):
     self.timers_graph[section][sname]["FAST"] = OrderedDict() ## there is no ordered set, so we use OrderedDict with no values
     return
 
+  def _is_thread_timer(self, section):
+    # threads used to be allowed only with their own section: these timers keep the timers graph
+    return section == self.default_timers_section and not self.is_main_thread
+
   def start_timer(self, sname, section=None):
+    """
+    Starts a timer. A timer of the default section outside the main thread is recorded by the
+    concurrent backend (per-thread laps merged on read, no timers graph and no `skip_first_timing`)
+    """
     section = section or self.default_timers_section
-    if section == self.default_timers_section:
-      assert self.is_main_thread, "Attempted to run threaded timer '{}' without section".format(sname)
+    if self._is_thread_timer(section):
+      return self._concurrent_timers.start(sname, section) if self.DEBUG else -1
 
     self._maybe_create_timers_section(section)
 
@@ -154,7 +333,9 @@ class _TimersMixin(object):
 
   def end_timer(self, sname, skip_first_timing=False, section=None):
     section = section or self.default_timers_section
-    if sname not in self.timers[section]:
+    if self._is_thread_timer(section):
+      return self._concurrent_timers.end(sname, section) if self.DEBUG else 0
+    if sname not in self.timers.get(section, {}):
       return
     result = 0
     self.sections_last_used[section] = time()
@@ -176,6 +357,7 @@ class _TimersMixin(object):
         return result  # do not record first timing in average nor the max
 
       ctimer['MAX'] = max(ctimer['MAX'], result)
+      ctimer['HIST'].add(result)
 
       ctimer['COUNT'] = _count + 1
       avg += result
@@ -203,6 +385,7 @@ class _TimersMixin(object):
                    div=None,
                    threshold_no_show=None,
                    max_key_size=30,
+                   show_percentiles=False,
                    ):
 
     if threshold_no_show is None:
@@ -265,8 +448,35 @@ class _TimersMixin(object):
       msg += ", c: {}/L:{:.0f}%".format(count, laps_low_prc)
     if div is not None:
       msg += ", itr(B{}): {:.4f}s".format(div, mean_time / div)
+    if show_percentiles and 'HIST' in ctimer:
+      msg += ", " + self._format_percentiles(ctimer['HIST'])
     return msg
 
+  @staticmethod
+  def _format_percentiles(hist):
+    return ", ".join("{}: {:.4f}s".format(k.lower(), v) for k, v in hist.percentiles().items())
+
+  def _format_thread_timers(self, selected_sections=None, threshold_no_show=0, max_key_size=30):
+    dct_sections = {}
+    for (section, sname), hist in self._concurrent_timers.get_histograms().items():
+      if selected_sections is not None and section not in selected_sections:
+        continue
+      if hist.count == 0 or hist.mean < threshold_no_show:
+        continue
+      dct_sections.setdefault(section, []).append((sname, hist))
+    #endfor
+
+    lst_logs = []
+    # the default section first, as for the main thread timers
+    for section in sorted(dct_sections, key=lambda x: (x != self.default_timers_section, x)):
+      lst_logs.append("Section '{}' (threads)".format(section))
+      for sname, hist in dct_sections[section]:
+        lst_logs.append(" {} = {:.4f}s, {}, max: {:.4f}s, lst: {:.4f}s, c: {}".format(
+          sname[:max_key_size], hist.mean, self._format_percentiles(hist), hist.max, hist.last, hist.count,
+        ))
+    #endfor
+    return lst_logs
+
   def show_timers(self, **kwargs):
     color = kwargs.pop('color', 'n')
     lst_logs = self.format_timers(**kwargs)
@@ -287,6 +497,7 @@ class _TimersMixin(object):
                   div=None,
                   threshold_no_show=None,
                   selected_sections=None,
+                  show_percentiles=False,
                   ):
 
     if selected_sections is not None:
@@ -310,7 +521,8 @@ class _TimersMixin(object):
           summary=summary,
           show_levels=show_levels, show_last=show_last,
           show_max=show_max, show_count=show_count, div=div,
-          threshold_no_show=threshold_no_show
+          threshold_no_show=threshold_no_show,
+          show_percentiles=show_percentiles,
         )
         if formatted_node is not None:
           logs.append(formatted_node)
@@ -336,7 +548,8 @@ class _TimersMixin(object):
       ## SORTING sections and keeping the default section the first one ..
       keys = list(self.timers.keys())
       if selected_sections is not None:
-        keys = selected_sections
+        # sections only used by other threads are shown with the thread timers
+        keys = [x for x in selected_sections if x in self.timers]
 
       add_back_default_section = False
       if self.default_timers_section in keys:
@@ -363,6 +576,11 @@ class _TimersMixin(object):
         lst_logs.append("Archived sections older than {:.1f} hrs: {}".format(
           OBSOLETE_SECTION_TIME / 3600, len(old_sections)
         ))
+      # timers of the other threads always show their percentiles
+      lst_logs += self._format_thread_timers(
+        selected_sections=selected_sections,
+        threshold_no_show=threshold_no_show,
+      )
     else:
       self.verbose_log("DEBUG not activated!")
     return lst_logs
@@ -384,13 +602,40 @@ class _TimersMixin(object):
   def get_timer_mean(self, skey, section=None):
     tmr = self.get_timer(skey, section=section)
     laps = tmr.get('LAPS', [])
+    hist = self._concurrent_timers.get_histogram(skey, section or self.default_timers_section)
+    if hist is not None and hist.count > 0:
+      # the other threads only keep all-time totals so the main thread laps are taken from its
+      # histogram as well (not from the last `MAX_LAPS` laps)
+      return self.get_timer_histogram(skey, section=section).mean
     result = np.mean(laps) if len(laps) > 0 else -1
     return result
 
+  def get_timer_histogram(self, skey, section=None):
+    """
+    Returns the `LapHistogram` of all the laps of the timer, from the main thread and from the other threads
+    """
+    section = section or self.default_timers_section
+    hist = LapHistogram()
+    tmr = self.get_timer(skey, section=section)
+    if 'HIST' in tmr:
+      hist.merge(tmr['HIST'])
+    thread_hist = self._concurrent_timers.get_histogram(skey, section)
+    if thread_hist is not None:
+      hist.merge(thread_hist)
+    return hist
+
+  def get_timer_percentiles(self, skey, section=None):
+    """
+    Returns the p50/p90/p99/p999 of the timer laps as {'P50' : ..., 'P90' : ..., 'P99' : ..., 'P999' : ...}
+    """
+    return self.get_timer_histogram(skey, section=section).percentiles()
 
   def get_timer_count(self, skey, section=None):
     tmr = self.get_timer(skey, section=section)
     result = tmr.get('COUNT', 0)
+    hist = self._concurrent_timers.get_histogram(skey, section or self.default_timers_section)
+    if hist is not None:
+      result += hist.count
     return result
   
   def import_timers_section(self, dct_timers, dct_timers_graph, section, overwrite=False):
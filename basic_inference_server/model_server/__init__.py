@@ -1,5 +1,20 @@
-
-from .gateway import FlaskGateway, get_packages
 from .server import FlaskModelServer
 from .worker import FlaskWorker
+from .tensor_codec import encode_tensors, decode_tensors, CONTENT_TYPE_TENSOR
 from . import run_server as run_server_module
+
+
+def __getattr__(name):
+  # the gateways (requests, psutil and aiohttp for the async one) are imported on first use so
+  # the model server processes, that import this package, do not pay for them at startup
+  if name in ['FlaskGateway', 'get_packages']:
+    from . import gateway
+    return getattr(gateway, name)
+  if name == 'AsyncGateway':
+    try:
+      from .gateway_async import AsyncGateway
+    except ModuleNotFoundError:
+      # aiohttp is only needed for the async gateway
+      AsyncGateway = None
+    return AsyncGateway
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,132 @@
+from math import ceil
+from threading import Lock
+from time import time
+
+RETRY_AFTER_OVERLOAD = 1
+
+
+class AdmissionRejected(Exception):
+  """
+  Raised when a request is not admitted: 429 if the queue is full, 503 if no worker became
+  available within `MAX_WAIT_MS`
+  """
+  def __init__(self, message, status_code, retry_after=RETRY_AFTER_OVERLOAD):
+    super(AdmissionRejected, self).__init__(message)
+    self.status_code = status_code
+    self.retry_after = retry_after
+    return
+
+
+class DeadlineExceeded(AdmissionRejected):
+  """
+  Raised (504) when the deadline of the request passed before its answer was ready
+  """
+  def __init__(self, message="Deadline exceeded"):
+    super(DeadlineExceeded, self).__init__(message, status_code=504, retry_after=None)
+    return
+
+
+def get_remaining_time(deadline):
+  """
+  Returns the seconds left until the (absolute, `time()` based) deadline or None if there is no deadline
+  """
+  if deadline is None:
+    return None
+  return deadline - time()
+
+
+def is_expired(deadline):
+  return deadline is not None and time() >= deadline
+
+
+class AdmissionController(object):
+  """
+  Bounds the number of requests that wait for a worker inside a `FlaskModelServer`.
+
+  A request is admitted while the requests in flight do not exceed the capacity of the
+  workers (`get_capacity()`) plus `max_queue`, otherwise it is rejected before it takes any
+  memory or worker time.
+  """
+  def __init__(self, get_capacity, max_queue=None, max_wait_ms=None):
+    """
+    Parameters:
+    -----------
+    get_capacity: callable, mandatory
+      Returns how many requests the workers can execute concurrently
+
+    max_queue: int, optional
+      Max number of requests waiting for a worker. The default is None (unbounded)
+
+    max_wait_ms: int, optional
+      Max time a request waits for a worker. The default is None (unbounded)
+    """
+    self._get_capacity = get_capacity
+    self._max_queue = max_queue
+    self._max_wait_ms = max_wait_ms
+
+    self._lock = Lock()
+    self._in_flight = 0
+    self._max_queue_depth = 0
+
+    self._nr_admitted = 0
+    self._nr_rejected_full = 0
+    self._nr_rejected_timeout = 0
+    return
+
+  @property
+  def wait_timeout(self):
+    return self._max_wait_ms / 1000 if self._max_wait_ms is not None else None
+
+  @property
+  def queue_depth(self):
+    return max(self._in_flight - self._get_capacity(), 0)
+
+  def enter(self):
+    """
+    Admits a request or raises `AdmissionRejected`. Admitted requests must call `leave()`
+    """
+    with self._lock:
+      capacity = self._get_capacity()
+      if self._max_queue is not None and self._in_flight >= capacity + self._max_queue:
+        self._nr_rejected_full += 1
+        raise AdmissionRejected(
+          message="Server overloaded: {} requests queued (MAX_QUEUE={})".format(
+            self._in_flight - capacity, self._max_queue
+          ),
+          status_code=429,
+        )
+      self._in_flight += 1
+      self._nr_admitted += 1
+      self._max_queue_depth = max(self._max_queue_depth, self._in_flight - capacity)
+    return
+
+  def leave(self):
+    with self._lock:
+      self._in_flight -= 1
+    return
+
+  def wait_timed_out(self):
+    """
+    Returns the exception for a request that did not get a worker in time
+    """
+    with self._lock:
+      self._nr_rejected_timeout += 1
+    return AdmissionRejected(
+      message="Server overloaded: no worker available in {}ms (MAX_WAIT_MS)".format(self._max_wait_ms),
+      status_code=503,
+      retry_after=max(RETRY_AFTER_OVERLOAD, ceil(self._max_wait_ms / 1000)),
+    )
+
+  def get_status(self):
+    with self._lock:
+      return {
+        'max_queue'        : self._max_queue,
+        'max_wait_ms'      : self._max_wait_ms,
+        'in_flight'        : self._in_flight,
+        'capacity'         : self._get_capacity(),
+        'queue_depth'      : self.queue_depth,
+        'max_queue_depth'  : self._max_queue_depth,
+        'admitted'         : self._nr_admitted,
+        'rejected_full'    : self._nr_rejected_full,
+        'rejected_timeout' : self._nr_rejected_timeout,
+      }
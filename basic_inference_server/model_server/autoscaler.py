@@ -0,0 +1,171 @@
+from collections import deque
+from threading import Thread, Event, Lock
+from time import time
+
+DEFAULT_INTERVAL = 5
+DEFAULT_WAIT_MS = 100
+DEFAULT_IDLE_WINDOWS = 3
+MAX_HISTORY = 20
+
+
+class Autoscaler(object):
+  """
+  Adjusts the number of workers of a `FlaskModelServer` between `min_workers` and `max_workers`.
+
+  Every `interval` seconds the worker pool stats of the last window are checked:
+    * requests waiting for a worker or a p90 wait above `wait_ms` add workers (one per waiting
+      request) unless the available memory is below `min_avail_mem`
+    * at least one idle worker during `idle_windows` consecutive windows removes one worker
+    * available memory below `min_avail_mem` removes one worker
+  """
+  def __init__(self, log, scale_func, get_nr_workers, get_window_stats, get_avail_mem,
+               min_workers, max_workers, interval=None, wait_ms=None, idle_windows=None,
+               min_avail_mem=None):
+    """
+    Parameters:
+    -----------
+    log: Logger, mandatory
+      The logger of the server
+
+    scale_func: callable, mandatory
+      Sets the number of workers (e.g. `FlaskModelServer._update_nr_workers`)
+
+    get_nr_workers: callable, mandatory
+      Returns the current number of workers
+
+    get_window_stats: callable, mandatory
+      Returns the worker pool stats since the previous call (`WorkerPool.get_window_stats`)
+
+    get_avail_mem: callable, mandatory
+      Returns the available memory as a fraction of the total memory
+
+    min_workers, max_workers: int, mandatory
+      The bounds of the number of workers
+
+    interval: float, optional
+      Seconds between two checks. The default is None (5)
+
+    wait_ms: float, optional
+      Workers are added when the p90 wait for a worker exceeds this value. The default is None (100)
+
+    idle_windows: int, optional
+      Consecutive windows with idle workers before one worker is removed. The default is None (3)
+
+    min_avail_mem: float, optional
+      No workers are added (and one is removed) below this fraction of available memory.
+      The default is None (no memory limit)
+    """
+    self.log = log
+    self._scale_func = scale_func
+    self._get_nr_workers = get_nr_workers
+    self._get_window_stats = get_window_stats
+    self._get_avail_mem = get_avail_mem
+    self._min_workers = min_workers
+    self._max_workers = max_workers
+    self._interval = interval or DEFAULT_INTERVAL
+    self._wait_ms = wait_ms or DEFAULT_WAIT_MS
+    self._idle_windows = idle_windows or DEFAULT_IDLE_WINDOWS
+    self._min_avail_mem = min_avail_mem
+
+    self._lock = Lock()
+    self._stop = Event()
+    self._thread = None
+    self._nr_idle_windows = 0
+    self._last_stats = None
+    self._history = deque(maxlen=MAX_HISTORY)
+    self._nr_scale_up = 0
+    self._nr_scale_down = 0
+    self._nr_errors = 0
+    return
+
+  def start(self):
+    self._thread = Thread(target=self._run, daemon=True)
+    self._thread.start()
+    return
+
+  def stop(self):
+    self._stop.set()
+    return
+
+  def _run(self):
+    while not self._stop.wait(self._interval):
+      try:
+        self.step()
+      except Exception as exc:
+        # e.g. a new worker that fails to load its model: the autoscaler keeps checking the pool
+        err_info = self.log.get_error_info()
+        self.log.P("Autoscaler step failed: {}".format(err_info), color='r')
+        with self._lock:
+          self._nr_errors += 1
+          self._history.append({
+            'time'   : round(time(), 3),
+            'error'  : str(exc),
+          })
+        #endwith
+      #endtry
+    #endwhile
+    return
+
+  def decide(self, nr_workers, stats, avail_mem):
+    """
+    Returns the target number of workers and the reason of the change (None if no change)
+    """
+    low_mem = self._min_avail_mem is not None and avail_mem < self._min_avail_mem
+    overloaded = stats['queue_depth'] > 0 or stats['wait_p90'] * 1000 > self._wait_ms
+    idle = not overloaded and stats['min_idle'] > 0
+    self._nr_idle_windows = self._nr_idle_windows + 1 if idle else 0
+
+    if nr_workers < self._min_workers:
+      return self._min_workers, 'below MIN_WORKERS'
+    if nr_workers > self._max_workers:
+      return self._max_workers, 'above MAX_WORKERS'
+    if low_mem and nr_workers > self._min_workers:
+      return nr_workers - 1, 'available memory {:.2f} below {:.2f}'.format(avail_mem, self._min_avail_mem)
+    if overloaded and not low_mem and nr_workers < self._max_workers:
+      target = min(nr_workers + max(stats['queue_depth'], 1), self._max_workers)
+      return target, 'queue depth {}, p90 wait {:.0f}ms'.format(stats['queue_depth'], stats['wait_p90'] * 1000)
+    if self._nr_idle_windows >= self._idle_windows and nr_workers > self._min_workers:
+      self._nr_idle_windows = 0
+      return nr_workers - 1, 'idle workers during {} windows'.format(self._idle_windows)
+    return nr_workers, None
+
+  def step(self):
+    stats = self._get_window_stats()
+    avail_mem = self._get_avail_mem()
+    nr_workers = self._get_nr_workers()
+    target, reason = self.decide(nr_workers, stats, avail_mem)
+    with self._lock:
+      self._last_stats = {**stats, 'avail_mem' : round(avail_mem, 4)}
+    if reason is None:
+      return
+    self._scale_func(target)
+    nr_new_workers = self._get_nr_workers()
+    with self._lock:
+      if nr_new_workers > nr_workers:
+        self._nr_scale_up += 1
+      elif nr_new_workers < nr_workers:
+        self._nr_scale_down += 1
+      self._history.append({
+        'time'   : round(time(), 3),
+        'from'   : nr_workers,
+        'to'     : nr_new_workers,
+        'reason' : reason,
+      })
+    #endwith
+    return
+
+  def get_status(self):
+    with self._lock:
+      return {
+        'min_workers'   : self._min_workers,
+        'max_workers'   : self._max_workers,
+        'workers'       : self._get_nr_workers(),
+        'interval'      : self._interval,
+        'wait_ms'       : self._wait_ms,
+        'min_avail_mem' : self._min_avail_mem,
+        'scale_up'      : self._nr_scale_up,
+        'scale_down'    : self._nr_scale_down,
+        'errors'        : self._nr_errors,
+        'last_window'   : self._last_stats,
+        'history'       : list(self._history),
+      }
@@ -0,0 +1,456 @@
+import sys
+import json
+import math
+import requests
+import subprocess
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock, local
+from time import perf_counter, sleep
+
+from .request_utils import MSCT
+
+MODE_CLOSED = 'closed'
+MODE_OPEN = 'open'
+MODE_REPLAY = 'replay'
+
+PERCENTILES = (50, 95, 99)
+
+# the stages measured by the servers (see `FlaskModelServer._setup_metrics`)
+SERVER_STAGES = ('queue_wait', 'pre_process', 'predict', 'post_process', 'total')
+
+STATUS_ERROR = 'error'
+
+
+def load_requests(path):
+  """
+  Loads the traffic sample of a benchmark. Each line of the jsonl file is either the body of an
+  execution call (with `SIGNATURE`) or `{"t": <seconds from start>, "body": {...}}`; `t` is
+  only used by the replay mode.
+
+  Returns a list of `(t, body)`
+  """
+  lst_requests = []
+  with open(path, 'rt') as fh:
+    for idx, line in enumerate(fh):
+      line = line.strip()
+      if len(line) == 0 or line.startswith('#'):
+        continue
+      item = json.loads(line)
+      if 'body' in item:
+        t, body = item.get('t'), item['body']
+      else:
+        t, body = None, item
+      if MSCT.SIGNATURE not in body:
+        raise ValueError("Line {} of '{}' has no {}".format(idx + 1, path, MSCT.SIGNATURE))
+      lst_requests.append((t, body))
+    #endfor
+  #endwith
+  if len(lst_requests) == 0:
+    raise ValueError("No requests in '{}'".format(path))
+  return lst_requests
+
+
+def synthetic_requests(signature, sleep_ms=0, cpu_ms=0, payload_size=0):
+  """
+  Returns the traffic for the `synthetic_model` endpoint (a single request shape)
+  """
+  body = {
+    MSCT.SIGNATURE : signature,
+    'SLEEP_MS'     : sleep_ms,
+    'CPU_MS'       : cpu_ms,
+    'PAYLOAD_SIZE' : payload_size,
+  }
+  return [(None, body)]
+
+
+def percentile(sorted_values, q):
+  """
+  Nearest-rank percentile of an already sorted list
+  """
+  if len(sorted_values) == 0:
+    return None
+  rank = max(int(math.ceil(q / 100 * len(sorted_values))), 1)
+  return sorted_values[rank - 1]
+
+
+def latency_summary(values):
+  """
+  Latency stats in milliseconds of a list of durations in seconds
+  """
+  values = sorted(values)
+  if len(values) == 0:
+    return {'count' : 0}
+  dct_stats = {
+    'count' : len(values),
+    'mean'  : round(sum(values) / len(values) * 1000, 3),
+    'max'   : round(values[-1] * 1000, 3),
+  }
+  for q in PERCENTILES:
+    dct_stats['p{}'.format(q)] = round(percentile(values, q) * 1000, 3)
+  return dct_stats
+
+
+class LoadGenerator(object):
+  """
+  Sends the execution calls of a benchmark to a gateway (or directly to a server) and records
+  the latency and the status of each call.
+
+  The closed loop mode keeps `concurrency` calls in progress: a client sends the next call when
+  the previous one ends, so the rate adapts to the server. The open loop and replay modes send
+  the calls on a schedule whatever the answer times are; their latency is measured from the
+  scheduled time, so the time a call waited for a free client is not hidden (coordinated omission).
+  """
+  def __init__(self, url, lst_requests, path=MSCT.RULE_RUN, timeout=30):
+    """
+    Parameters:
+    -----------
+    url: str, mandatory
+      The base url of the gateway (e.g. `http://127.0.0.1:5002`)
+
+    lst_requests: list, mandatory
+      The `(t, body)` calls returned by `load_requests` or `synthetic_requests`. The calls are
+      sent in a round robin
+
+    path: str, optional
+      The execution path. The default is `/run`
+
+    timeout: float, optional
+      Timeout in seconds of each call. The default is 30
+    """
+    self._url = url.rstrip('/') + path
+    self._requests = lst_requests
+    self._timeout = timeout
+    self._local = local()
+    self._lock = Lock()
+    self._records = []
+    return
+
+  def _get_session(self):
+    session = getattr(self._local, 'session', None)
+    if session is None:
+      session = requests.Session()
+      self._local.session = session
+    return session
+
+  def _send(self, body, t_sched, t0):
+    t_start = perf_counter()
+    status, size = STATUS_ERROR, 0
+    try:
+      resp = self._get_session().post(self._url, json=body, timeout=self._timeout)
+      status, size = resp.status_code, len(resp.content)
+    except requests.RequestException:
+      pass
+    t_end = perf_counter()
+    record = {
+      'signature' : body.get(MSCT.SIGNATURE),
+      'start'     : t_sched - t0,
+      'latency'   : t_end - t_sched,
+      'service'   : t_end - t_start,
+      'status'    : status,
+      'size'      : size,
+    }
+    with self._lock:
+      self._records.append(record)
+    return
+
+  def _pop_records(self):
+    with self._lock:
+      records, self._records = self._records, []
+    return records
+
+  def run_closed_loop(self, concurrency, duration=None, nr_requests=None):
+    """
+    Runs `concurrency` clients until `duration` seconds elapsed or `nr_requests` calls were sent.
+
+    Returns the records of the calls and the elapsed time
+    """
+    if duration is None and nr_requests is None:
+      raise ValueError("Either the duration or the number of requests must be given")
+    counter = {'sent' : 0}
+    lock = Lock()
+    t0 = perf_counter()
+    t_stop = t0 + duration if duration is not None else None
+
+    def _client():
+      while t_stop is None or perf_counter() < t_stop:
+        with lock:
+          idx = counter['sent']
+          if nr_requests is not None and idx >= nr_requests:
+            break
+          counter['sent'] += 1
+        #endwith
+        _, body = self._requests[idx % len(self._requests)]
+        self._send(body, perf_counter(), t0)
+      #endwhile
+      return
+
+    threads = [Thread(target=_client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return self._pop_records(), perf_counter() - t0
+
+  def run_open_loop(self, rps=None, duration=None, max_in_flight=256, speed=1):
+    """
+    Sends the calls on a schedule: `rps` calls per second during `duration` seconds or, if `rps`
+    is None, once at the `t` offsets of the traffic sample (replay) divided by `speed`.
+
+    Returns the records of the calls and the elapsed time
+    """
+    if rps is not None:
+      if duration is None:
+        raise ValueError("The open loop mode needs a duration")
+      nr_calls = max(int(rps * duration), 1)
+      schedule = [(i / rps, self._requests[i % len(self._requests)][1]) for i in range(nr_calls)]
+    else:
+      offsets = [t for t, _ in self._requests]
+      if any(t is None for t in offsets):
+        raise ValueError("The replay mode needs the `t` offset of each request")
+      start = min(offsets)
+      schedule = sorted(
+        [((t - start) / speed, body) for t, body in self._requests], key=lambda x: x[0]
+      )
+    #endif
+
+    t0 = perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+      for offset, body in schedule:
+        delay = t0 + offset - perf_counter()
+        if delay > 0:
+          sleep(delay)
+        executor.submit(self._send, body, t0 + offset, t0)
+      #endfor
+    #endwith
+    return self._pop_records(), perf_counter() - t0
+
+
+def summarize_records(records, elapsed):
+  """
+  Returns the throughput, error rate and latency percentiles of a benchmark, overall and for
+  each signature
+  """
+  def _summary(lst, elapsed):
+    nr_ok = sum(1 for x in lst if x['status'] == 200)
+    dct_status = defaultdict(int)
+    for x in lst:
+      dct_status[str(x['status'])] += 1
+    return {
+      'requests'       : len(lst),
+      'errors'         : len(lst) - nr_ok,
+      'error_rate'     : round((len(lst) - nr_ok) / len(lst), 4) if len(lst) > 0 else 0,
+      'throughput'     : round(nr_ok / elapsed, 2) if elapsed > 0 else 0,
+      'status'         : dict(dct_status),
+      'latency_ms'     : latency_summary([x['latency'] for x in lst]),
+      'service_ms'     : latency_summary([x['service'] for x in lst]),
+      'response_bytes' : round(sum(x['size'] for x in lst) / max(len(lst), 1), 1),
+    }
+
+  dct_signatures = defaultdict(list)
+  for record in records:
+    dct_signatures[record['signature']].append(record)
+  result = _summary(records, elapsed)
+  result['elapsed'] = round(elapsed, 3)
+  result['signatures'] = {sig : _summary(lst, elapsed) for sig, lst in sorted(dct_signatures.items())}
+  return result
+
+
+def parse_metrics(text):
+  """
+  Parses the Prometheus text format of `/metrics` into `{(name, ((label, value), ...)): value}`
+  """
+  dct_values = {}
+  for line in text.splitlines():
+    if len(line) == 0 or line.startswith('#'):
+      continue
+    series, _, value = line.rpartition(' ')
+    if '{' in series:
+      name, _, str_labels = series.partition('{')
+      labels = []
+      for pair in str_labels.rstrip('}').split('",'):
+        if len(pair) == 0:
+          continue
+        key, _, val = pair.partition('=')
+        labels.append((key, val.strip('"')))
+      #endfor
+    else:
+      name, labels = series, []
+    dct_values[(name, tuple(sorted(labels)))] = float(value)
+  #endfor
+  return dct_values
+
+
+def scrape_metrics(url, timeout=5):
+  """
+  Returns the parsed `/metrics` of a gateway or server or None if they are not available
+  """
+  try:
+    resp = requests.get(url.rstrip('/') + MSCT.RULE_METRICS, timeout=timeout)
+    if resp.status_code != 200:
+      return None
+    return parse_metrics(resp.text)
+  except requests.RequestException:
+    return None
+
+
+def histogram_summary(before, after, name, **labels):
+  """
+  Stats in milliseconds of the observations of a histogram between two scrapes. The percentiles
+  are interpolated inside the histogram buckets so they are estimates.
+  """
+  def _match(series_labels):
+    dct_labels = dict(series_labels)
+    return all(dct_labels.get(k) == v for k, v in labels.items())
+
+  buckets = []
+  total, count = 0, 0
+  for (series, series_labels), value in after.items():
+    if not _match(series_labels):
+      continue
+    delta = value - before.get((series, series_labels), 0)
+    if series == name + '_bucket':
+      buckets.append((float(dict(series_labels)['le']), delta))
+    elif series == name + '_sum':
+      total += delta
+    elif series == name + '_count':
+      count += delta
+  #endfor
+  if count <= 0:
+    return {'count' : 0}
+  buckets.sort()
+  dct_stats = {
+    'count' : int(count),
+    'mean'  : round(total / count * 1000, 3),
+  }
+  for q in PERCENTILES:
+    rank = q / 100 * count
+    prev_upper, prev_cumulative, estimate = 0, 0, None
+    for upper, cumulative in buckets:
+      if cumulative >= rank:
+        if math.isinf(upper):
+          # above the last finite bucket there is no upper bound
+          estimate = prev_upper
+        else:
+          in_bucket = cumulative - prev_cumulative
+          fraction = (rank - prev_cumulative) / in_bucket if in_bucket > 0 else 1
+          estimate = prev_upper + (upper - prev_upper) * fraction
+        break
+      prev_upper, prev_cumulative = upper, cumulative
+    #endfor
+    dct_stats['p{}'.format(q)] = round(estimate * 1000, 3) if estimate is not None else None
+  #endfor
+  return dct_stats
+
+
+def get_hops(result, gateway_before, gateway_after, servers_before, servers_after):
+  """
+  Per hop latency breakdown of each signature: the client end to end latency, the gateway
+  proxy time (gateway -> server -> answer) and the stages measured by the server. The
+  differences of the means are the time spent in the gateway and between gateway and server.
+  """
+  dct_hops = {}
+  for signature, sig_result in result['signatures'].items():
+    hops = {'client' : sig_result['service_ms']}
+    if gateway_before is not None and gateway_after is not None:
+      hops['gateway_proxy'] = histogram_summary(
+        gateway_before, gateway_after, 'bis_gateway_proxy_duration_seconds', signature=signature
+      )
+    before, after = servers_before.get(signature), servers_after.get(signature)
+    if before is not None and after is not None:
+      for stage in SERVER_STAGES:
+        hops['server_' + stage] = histogram_summary(
+          before, after, 'bis_server_request_duration_seconds', signature=signature, stage=stage
+        )
+    #endif
+
+    def _mean(key):
+      return hops.get(key, {}).get('mean')
+
+    if _mean('client') is not None and _mean('gateway_proxy') is not None:
+      hops['gateway_overhead_mean'] = round(_mean('client') - _mean('gateway_proxy'), 3)
+    if _mean('gateway_proxy') is not None and _mean('server_total') is not None:
+      hops['transport_overhead_mean'] = round(_mean('gateway_proxy') - _mean('server_total'), 3)
+    dct_hops[signature] = hops
+  #endfor
+  return dct_hops
+
+
+def get_import_report(module='basic_inference_server', top=15):
+  """
+  Import cost of `module` in a new interpreter (`python -X importtime`): the total time and the
+  modules with the highest own and cumulative (with their imports) times, in milliseconds
+  """
+  proc = subprocess.run(
+    [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+    capture_output=True, text=True,
+  )
+  if proc.returncode != 0:
+    raise ValueError("Cannot import '{}': {}".format(module, proc.stderr.strip().splitlines()[-1:]))
+  lst_modules = []
+  for line in proc.stderr.splitlines():
+    if not line.startswith('import time:') or 'self [us]' in line:
+      continue
+    str_self, str_cumulative, name = line[len('import time:'):].split('|')
+    lst_modules.append((name.strip(), int(str_self) / 1000, int(str_cumulative) / 1000))
+  #endfor
+  total = next((cumulative for name, _, cumulative in lst_modules if name == module), None)
+  own = [x for x in lst_modules if x[0] == module or x[0].startswith(module + '.')]
+  return {
+    'module'         : module,
+    'total_ms'       : round(total, 1) if total is not None else None,
+    'own_ms'         : round(sum(x[1] for x in own), 1),
+    'nr_modules'     : len(lst_modules),
+    'top_self'       : [(name, round(t, 2)) for name, t, _ in sorted(lst_modules, key=lambda x: -x[1])[:top]],
+    'top_cumulative' : [(name, round(t, 2)) for name, _, t in sorted(lst_modules, key=lambda x: -x[2])[:top]],
+  }
+
+
+def compare_results(baseline, current):
+  """
+  Relative change (percent) of the throughput and of the latency percentiles between two saved
+  benchmark results, overall and for each signature found in both, and of the import time
+  """
+  def _delta(old, new):
+    if old in [None, 0] or new is None:
+      return None
+    return round((new - old) / old * 100, 2)
+
+  def _compare(old, new):
+    dct_delta = {
+      'throughput' : _delta(old.get('throughput'), new.get('throughput')),
+      'error_rate' : round(new.get('error_rate', 0) - old.get('error_rate', 0), 4),
+    }
+    for q in PERCENTILES:
+      key = 'p{}'.format(q)
+      dct_delta['latency_' + key] = _delta(old['latency_ms'].get(key), new['latency_ms'].get(key))
+    return dct_delta
+
+  comparison = {}
+  if baseline.get('results') is not None and current.get('results') is not None:
+    comparison = _compare(baseline['results'], current['results'])
+    comparison['signatures'] = {
+      sig : _compare(baseline['results']['signatures'][sig], sig_result)
+      for sig, sig_result in current['results']['signatures'].items()
+      if sig in baseline['results']['signatures']
+    }
+  #endif
+  old_import = (baseline.get('startup') or {}).get('import', {}).get('total_ms')
+  new_import = (current.get('startup') or {}).get('import', {}).get('total_ms')
+  comparison['import_ms'] = _delta(old_import, new_import)
+  return comparison
+
+
+def get_regressions(comparison, max_regression):
+  """
+  Returns the overall metrics (including the import time) of a `compare_results` that got worse by
+  more than `max_regression` percent
+  """
+  lst_regressions = []
+  if comparison.get('throughput') is not None and comparison['throughput'] < -max_regression:
+    lst_regressions.append('throughput {}%'.format(comparison['throughput']))
+  for key in ['latency_p{}'.format(q) for q in PERCENTILES] + ['import_ms']:
+    if comparison.get(key) is not None and comparison[key] > max_regression:
+      lst_regressions.append('{} +{}%'.format(key, comparison[key]))
+  return lst_regressions
@@ -50,7 +50,8 @@ class FakeWorker(FlaskWorker):
     ### abstract method implementation: "in-memory model :)" that adds and subtracts.
     self._create_notification(
       notif='log',
-      msg='Predicting on usr_input: {}'.format(prep_inputs)
+      msg='Predicting on usr_input: {}',
+      msg_args=(prep_inputs,),
     )
 
     if not self.cfg_minus:
@@ -0,0 +1,314 @@
+"""
+Fork server: a pre-warmed interpreter that forks the model servers.
+
+The gateway starts this module once as a script. It imports the libraries shared by all the
+model servers (numpy, flask, this package and the optional `FORK_SERVER_PRELOAD` modules) and then
+waits on a Unix domain socket. Each `spawn` request forks a child that runs
+`run_server.main(args)` with the same arguments `run_server.py` would receive, so a new server
+starts without the interpreter startup and the imports.
+"""
+import os
+import sys
+import json
+import socket
+import signal
+import argparse
+import importlib
+import subprocess
+import traceback
+
+from time import sleep, time, perf_counter
+
+CMD_PING = 'ping'
+CMD_SPAWN = 'spawn'
+CMD_STATUS = 'status'
+
+DEFAULT_PRELOAD = [
+  'numpy',
+  'flask',
+  'basic_inference_server',
+  'basic_inference_server.model_server.run_server',
+]
+
+START_TIMEOUT = 60
+REQUEST_TIMEOUT = 10
+WAIT_INTERVAL = 0.05
+
+# exit codes of the reaped children (fork server side)
+_exit_codes = {}
+
+
+def fork_server_available():
+  return hasattr(os, 'fork') and hasattr(socket, 'AF_UNIX')
+
+
+def _read_line(conn):
+  data = b''
+  while not data.endswith(b'\n'):
+    chunk = conn.recv(65536)
+    if len(chunk) == 0:
+      break
+    data += chunk
+  #endwhile
+  return data
+
+
+def _send_request(socket_path, request, timeout=REQUEST_TIMEOUT):
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+    sock.settimeout(timeout)
+    sock.connect(socket_path)
+    sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+    data = _read_line(sock)
+  if len(data) == 0:
+    raise ConnectionError("No answer from the fork server on {}".format(socket_path))
+  answer = json.loads(data)
+  if 'error' in answer:
+    raise ValueError("Fork server error: {}".format(answer['error']))
+  return answer
+
+
+class ForkedProcess(object):
+  """
+  `subprocess.Popen` like handle of a server forked by the fork server. The gateway is not the
+  parent of the server so the exit code is asked from the fork server once the process is gone.
+  """
+  def __init__(self, client, pid, args):
+    self._client = client
+    self.pid = pid
+    self.args = args
+    self.returncode = None
+    return
+
+  def poll(self):
+    if self.returncode is None:
+      try:
+        os.kill(self.pid, 0)
+      except ProcessLookupError:
+        self.returncode = self._client.get_returncode(self.pid)
+      except PermissionError:
+        pass
+    #endif
+    return self.returncode
+
+  def wait(self, timeout=None):
+    start = time()
+    while self.poll() is None:
+      if timeout is not None and (time() - start) > timeout:
+        raise subprocess.TimeoutExpired(self.args, timeout)
+      sleep(WAIT_INTERVAL)
+    #endwhile
+    return self.returncode
+
+  def send_signal(self, sig):
+    if self.poll() is None:
+      try:
+        os.kill(self.pid, sig)
+      except ProcessLookupError:
+        pass
+    return
+
+  def terminate(self):
+    self.send_signal(signal.SIGTERM)
+    return
+
+  def kill(self):
+    self.send_signal(signal.SIGKILL)
+    return
+
+
+class ForkServerClient(object):
+  """
+  Gateway side of the fork server: starts the fork server process and asks it to fork servers.
+  """
+  def __init__(self, socket_path, preload=None):
+    """
+    Parameters:
+    -----------
+    socket_path: str, mandatory
+      The Unix domain socket of the fork server
+
+    preload: list, optional
+      Modules imported by the fork server in addition to `DEFAULT_PRELOAD` (e.g. `torch` or the
+      module of a worker). These modules must not start threads or initialize a GPU when imported.
+      The default is None
+    """
+    self._socket_path = socket_path
+    self._preload = DEFAULT_PRELOAD + [x for x in (preload or []) if x not in DEFAULT_PRELOAD]
+    self._process = None
+    self._startup_time = None
+    self._nr_spawned = 0
+    self._spawn_time = 0
+    return
+
+  @property
+  def pid(self):
+    return self._process.pid if self._process is not None else None
+
+  def start(self, timeout=START_TIMEOUT):
+    """
+    Starts the fork server and waits until it has imported the preloaded modules.
+    Returns True if the fork server is ready
+    """
+    if os.path.exists(self._socket_path):
+      os.remove(self._socket_path)
+    start = time()
+    self._process = subprocess.Popen([
+      'python', os.path.relpath(__file__),
+      '--socket', self._socket_path,
+      '--preload', ','.join(self._preload),
+    ])
+    while (time() - start) < timeout:
+      if self._process.poll() is not None:
+        return False
+      if os.path.exists(self._socket_path):
+        try:
+          _send_request(self._socket_path, {'cmd' : CMD_PING})
+          self._startup_time = time() - start
+          return True
+        except (OSError, ValueError):
+          pass
+      #endif
+      sleep(WAIT_INTERVAL)
+    #endwhile
+    return False
+
+  def is_alive(self):
+    return self._process is not None and self._process.poll() is None
+
+  def spawn(self, args):
+    """
+    Forks a model server that runs `run_server.main(args)` and returns its `ForkedProcess`
+    """
+    start = perf_counter()
+    answer = _send_request(self._socket_path, {'cmd' : CMD_SPAWN, 'args' : args})
+    self._nr_spawned += 1
+    self._spawn_time += perf_counter() - start
+    return ForkedProcess(client=self, pid=answer['pid'], args=['fork_server'] + list(args))
+
+  def get_returncode(self, pid):
+    try:
+      return _send_request(self._socket_path, {'cmd' : CMD_STATUS, 'pid' : pid})['returncode']
+    except (OSError, ValueError):
+      # the fork server is gone as well
+      return -1
+
+  def stop(self, timeout=5):
+    if self._process is not None and self._process.poll() is None:
+      self._process.terminate()
+      try:
+        self._process.wait(timeout)
+      except subprocess.TimeoutExpired:
+        self._process.kill()
+    #endif
+    if os.path.exists(self._socket_path):
+      os.remove(self._socket_path)
+    return
+
+  def get_status(self):
+    return {
+      'pid'       : self.pid,
+      'alive'     : self.is_alive(),
+      'startup_s' : round(self._startup_time, 3) if self._startup_time is not None else None,
+      'spawned'   : self._nr_spawned,
+      'spawn_ms'  : round(self._spawn_time / self._nr_spawned * 1000, 2) if self._nr_spawned > 0 else None,
+      'preload'   : self._preload,
+    }
+
+
+def _reap_children(signum, frame):
+  while True:
+    try:
+      pid, status = os.waitpid(-1, os.WNOHANG)
+    except ChildProcessError:
+      return
+    if pid == 0:
+      return
+    _exit_codes[pid] = os.waitstatus_to_exitcode(status)
+  #endwhile
+
+
+def _run_child(listener, conn, args):
+  # the child becomes a regular model server: it must not keep the fork server socket nor its
+  # SIGCHLD handler (the server workers and subprocesses wait for their own children)
+  listener.close()
+  conn.close()
+  signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  code = 0
+  try:
+    from basic_inference_server.model_server import run_server
+    sys.argv = [run_server.__file__] + list(args)
+    run_server.main(args)
+  except SystemExit as exc:
+    code = exc.code if isinstance(exc.code, int) else (0 if exc.code is None else 1)
+  except BaseException:
+    traceback.print_exc()
+    code = 1
+  sys.stdout.flush()
+  sys.stderr.flush()
+  os._exit(code)
+  return
+
+
+def _serve(socket_path, preload):
+  start = time()
+  for module in preload:
+    try:
+      importlib.import_module(module)
+    except Exception as exc:
+      print("Fork server could not preload '{}': {}".format(module, exc), flush=True)
+  #endfor
+  print("Fork server pid {} preloaded {} in {:.2f}s, listening on {}".format(
+    os.getpid(), preload, time() - start, socket_path), flush=True
+  )
+
+  signal.signal(signal.SIGCHLD, _reap_children)
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  if os.path.exists(socket_path):
+    os.remove(socket_path)
+  listener.bind(socket_path)
+  listener.listen(16)
+  try:
+    while True:
+      conn, _ = listener.accept()
+      with conn:
+        try:
+          request = json.loads(_read_line(conn))
+          cmd = request.get('cmd')
+          if cmd == CMD_SPAWN:
+            pid = os.fork()
+            if pid == 0:
+              _run_child(listener, conn, request['args'])
+            answer = {'pid' : pid}
+          elif cmd == CMD_STATUS:
+            answer = {'returncode' : _exit_codes.get(request['pid'])}
+          elif cmd == CMD_PING:
+            answer = {'pid' : os.getpid()}
+          else:
+            answer = {'error' : 'unknown command {}'.format(cmd)}
+        except Exception as exc:
+          answer = {'error' : str(exc)}
+        conn.sendall((json.dumps(answer) + '\n').encode('utf-8'))
+      #endwith
+    #endwhile
+  finally:
+    listener.close()
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+  return
+
+
+if __name__ == '__main__':
+  # same as `run_server.py`: the workers are imported relative to the working folder
+  sys.path.append(os.getcwd())
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--socket', type=str, required=True)
+  parser.add_argument('--preload', type=str, default=','.join(DEFAULT_PRELOAD))
+  args = parser.parse_args()
+
+  _serve(
+    socket_path=args.socket,
+    preload=[x for x in args.preload.split(',') if len(x) > 0],
+  )
@@ -17,7 +17,7 @@ import os
 import signal
 import subprocess
 import json
-import requests
+import tempfile
 
 
 import flask
@@ -30,9 +30,11 @@ from ..public_logger import Logger
 from ..generic_obj import BaseObject
 from ..logger_mixins.serialization_json_mixin import NPJson
 from .request_utils import MSCT
+from .tensor_codec import encode_tensors, CONTENT_TYPE_TENSOR
 
 
 from . import run_server as run_server_module
+from .fork_server import ForkServerClient, fork_server_available
 
 from ..lib_ver import __VER__ as LIB_VER
 from app_ver import __VER__ as APP_VER
@@ -41,14 +43,22 @@ from .gateway_functions import _GatewayFunctionMixin
 from .gateway_utils_mixin import _GatewayUtilsMixin, StateCT
 from .gateway_support import _GatewaySupportMixin, MONITORED_PACKAGES
 from .gateway_support import _get_packages as get_packages
+from .gateway_sessions import _GatewaySessionsMixin
+from .gateway_readiness import _GatewayReadinessMixin, READINESS_TIMEOUT
+from .gateway_routing import _GatewayRoutingMixin
+from .gateway_metrics import _GatewayMetricsMixin
 
 DEFAULT_NR_WORKERS = 5
 DEFAULT_HOST = '127.0.0.1'
 
+UNIX_SOCKETS_FOLDER = '_sockets'
+MAX_UNIX_SOCKET_PATH = 100 # AF_UNIX paths are limited to ~108 bytes
+
 DEFAULT_SERVER_PATHS = [
   MSCT.RULE_RUN,
   MSCT.RULE_NOTIF,
-  MSCT.RULE_UPDATE_WORKERS
+  MSCT.RULE_UPDATE_WORKERS,
+  MSCT.RULE_SERVER_STATUS,
 ]
 
 
@@ -57,6 +67,10 @@ class FlaskGateway(
   _GatewayFunctionMixin,
   _GatewayUtilsMixin,
   _GatewaySupportMixin,
+  _GatewaySessionsMixin,
+  _GatewayReadinessMixin,
+  _GatewayRoutingMixin,
+  _GatewayMetricsMixin,
   ):
 
   app = None
@@ -129,34 +143,57 @@ class FlaskGateway(
     
     self._servers = {}
     self._paths = None
+    self._fork_server = None
     super(FlaskGateway, self).__init__(log=log, prefix_log='[GW]', **kwargs)
     return
     
   
-  def get_response(self, data):
-    if MSCT.DOWNLOAD_FILE_COMMAND in data:
+  def get_response(self, data, as_tensor=False):
+    fn = self._get_download_file(data)
+    if fn is not None:
+      return flask.send_file(fn)
+    elif as_tensor:
+      return flask.Response(encode_tensors(self._get_response_dict(data)), mimetype=CONTENT_TYPE_TENSOR)
+    else:
+      return flask.jsonify(self._get_response_dict(data))
+
+  def _get_download_file(self, data):
+    if isinstance(data, dict) and MSCT.DOWNLOAD_FILE_COMMAND in data:
       # MSCT.DOWNLOAD_FILE_COMMAND is a special field in responses that allows the creation of a file download from the
       # gateway directly to the client
       self.P("Received {} command:\n{}".format(MSCT.DOWNLOAD_FILE_COMMAND, json.dumps(data, indent=4)))
       dct_download = data[MSCT.DOWNLOAD_FILE_COMMAND]
-      fn = dct_download[MSCT.DOWNLOAD_FILE_PATH]
-      return flask.send_file(fn)
+      return dct_download[MSCT.DOWNLOAD_FILE_PATH]
+    return None
+
+  def _get_response_dict(self, data):
+    worker_id = 'unknown'
+    if isinstance(data, dict):
+      dct_result = data
+      worker_id = data.pop(MSCT.WORKER_ID, 'unknown')
     else:
-      worker_id = 'unknown'
-      if isinstance(data, dict):
-        dct_result = data
-        worker_id = data.pop(MSCT.WORKER_ID, 'unknown')
-      else:
-        dct_result = {
-          MSCT.DATA : data,        
-        }              
-      dct_result[MSCT.APP_VER] = APP_VER
-      dct_result[MSCT.FRM_VER] = LIB_VER
-      dct_result[MSCT.HOSTNAME] = self.hostname
-      dct_result[MSCT.WORKER_ID] = worker_id     
-      dct_result[MSCT.TIME] = self.log.time_to_str()
-      dct_result[MSCT.GW_UPTIME] = self._elapsed_to_str(time() - self._start_time)
-      return flask.jsonify(dct_result)
+      dct_result = {
+        MSCT.DATA : data,        
+      }              
+    dct_result = {
+      **dct_result,
+      **self._get_response_metadata(),
+      MSCT.WORKER_ID : worker_id,
+    }
+    return dct_result
+
+  def _get_response_metadata(self):
+    """
+    Gateway fields added to each answer - in the json body for regular calls and as 
+    response headers for passthrough calls.
+    """
+    return {
+      MSCT.APP_VER   : APP_VER,
+      MSCT.FRM_VER   : LIB_VER,
+      MSCT.HOSTNAME  : self.hostname,
+      MSCT.TIME      : self.log.time_to_str(),
+      MSCT.GW_UPTIME : self._elapsed_to_str(time() - self._start_time),
+    }
 
   def _log_banner(self):
     _logo = "FlaskGateway v{} started on '{}:{}'".format(
@@ -171,6 +208,7 @@ class FlaskGateway(
     self.load_gw_state_history() 
     self._log_banner()
     self._no_startup_wait = self.config_data.get(MSCT.NO_STARTUP_WAIT, False)
+    self._passthrough = self.config_data.get(MSCT.PASSTHROUGH, False)
     self._config_endpoints = self.config_data.get(MSCT.CONFIG_ENDPOINTS, {})
 
     if self._start_server_names is None:
@@ -179,15 +217,41 @@ class FlaskGateway(
     if not self._server_execution_path.startswith('/'):
       self._server_execution_path = '/' + self._server_execution_path
 
-    self.app = flask.Flask('FlaskGateway')
+    self._create_app()
 
-    self._start_basic_endpoints()
+    self._start_fork_server()
+    try:
+      self.start_servers(start_support=False)
+      if self._paths is None:
+        raise ValueError("Gateway cannot start because no paths were retrieved from endpoints.")
+
+      self._register_server_paths()
 
-    self.start_servers(start_support=False)
-    if self._paths is None:
+      self.P("Starting gateway server after all endpoints have been defined...", color='g')
+      self._get_system_status(display=True)
+      
+      self.P("Starting support processes...", color='g')
+      self.start_servers(start_support=True)    
+      
+      self.update_gw_state_history(state=StateCT.STARTUP)
+      self.register_handlers()
+      
+      self._run_app()
+    except BaseException as exc:
+      # e.g. the gateway port is in use (`SystemExit`): the servers - forked or not - and the fork
+      # server would otherwise be left running without a gateway
+      self.P("Gateway stopped ({}), terminating the servers ...".format(repr(exc)), color='r')
       self.kill_servers()
-      raise ValueError("Gateway cannot start because no paths were retrieved from endpoints.")
+      raise
+    #endtry
+    return
+
+  def _create_app(self):
+    self.app = flask.Flask('FlaskGateway')
+    self._start_basic_endpoints()
+    return
 
+  def _register_server_paths(self):
     self.app.json_encoder = NPJson
     for rule in self._paths:
       partial_view_func = partial(self._view_func_worker, rule)
@@ -199,17 +263,9 @@ class FlaskGateway(
         methods=['GET', 'POST', 'OPTIONS']
       )
     #endfor
-    
+    return
 
-    self.P("Starting gateway server after all endpoints have been defined...", color='g')
-    self._get_system_status(display=True)
-    
-    self.P("Starting support processes...", color='g')
-    self.start_servers(start_support=True)    
-    
-    self.update_gw_state_history(state=StateCT.STARTUP)
-    self.register_handlers()
-    
+  def _run_app(self):
     self.app.run(
       host=self._host,
       port=self._port,
@@ -243,6 +299,12 @@ class FlaskGateway(
         view_func=self._view_system_status,
         methods=['GET', 'POST']        
       ),
+      dict(
+        rule=MSCT.RULE_METRICS,
+        endpoint='MetricsEndpoint',
+        view_func=self._view_metrics,
+        methods=['GET']
+      ),
       
       ### endpoint only for support processes
       dict(
@@ -306,6 +368,7 @@ class FlaskGateway(
     else:
       server_class = server_name
 
+    unix_socket = None
     if MSCT.HOST in config_endpoint:
       host = config_endpoint[MSCT.HOST]
     else:
@@ -353,7 +416,13 @@ class FlaskGateway(
       #endif
       
       
-      msg = "Creating server `{} <{}>` at {}:{}{}".format(server_name, server_class, host, port, execution_path)
+      server_host = host
+      if self._get_server_transport(config_endpoint) == MSCT.TRANSPORT_UDS:
+        unix_socket = self._get_unix_socket_path(server_name)
+        server_host, port = 'unix://' + unix_socket, None
+        msg = "Creating server `{} <{}>` at {}{}".format(server_name, server_class, server_host, execution_path)
+      else:
+        msg = "Creating server `{} <{}>` at {}:{}{}".format(server_name, server_class, host, port, execution_path)
       self.P(msg, color='g')
       self._create_notification('log', msg)
       str_cmd = os.path.relpath(run_server_module.__file__)
@@ -363,8 +432,8 @@ class FlaskGateway(
         '--base_folder', self.log.root_folder,
         '--app_folder', self.log.app_folder,
         '--config_endpoint', json.dumps(config_endpoint),
-        '--host', host,
-        '--port', str(port),
+        '--host', server_host,
+        '--port', str(port or 0),
         '--execution_path', execution_path,
         '--workers_location', self._workers_location,
         '--worker_name', server_class,
@@ -376,36 +445,43 @@ class FlaskGateway(
       ]
       self.P("Running {}".format(popen_args))
     #endif suport process or normal server
-      
-    process = subprocess.Popen(
-      popen_args,
-    )
 
-    self.P(f"Waiting for process to {process.pid} warmup...")
-    sleep(2)
-    is_alive = process.poll() is None
-    if not is_alive:
-      msg = "**************** Process failed for {}:{}:{} *******************".format(process.args, host, port)
-      self.P(msg, color='r')
-      self._create_notification(notif='log', msg=msg)
-      return False
-    #endif
+    process = None
+    if not is_support_process and self._fork_server is not None and config_endpoint.get(MSCT.FORK_SERVER, True):
+      process = self._fork_server_spawn(server_name, popen_args[2:])
+    if process is None:
+      process = subprocess.Popen(
+        popen_args,
+      )
     
+    session = None
+    if not is_support_process:
+      session = self._create_server_session(server_name=server_name, host=host, port=port, unix_socket=unix_socket)
+      if port is not None:
+        self._current_server_port = port + 1
+
     self._servers[server_name] = {
       MSCT.PROCESS   : process,
       MSCT.HOST      : host,
       MSCT.PORT      : port,
+      MSCT.UNIX_SOCKET : unix_socket,
       MSCT.START     : time(),
       MSCT.SUPPORT   : is_support_process, 
+      MSCT.SESSION   : session,
+      MSCT.SERVER_CLASS : server_class,
+      MSCT.NR_WORKERS : nr_workers,
+      # support processes do not serve requests so they do not need a warmup
+      MSCT.READY     : is_support_process,
     }    
     
     result = None
     if host == MSCT.SUPPORT_PROCESS_NO_HOST:
       msg = "Successfully created SUPPORT process '{}' with PID={}".format(server_name, process.pid)
-      result = False # no need to increment port nr
+      result = False
     else:
-      msg = "Successfully created server '{}' with PID={}".format(server_name, process.pid)
+      msg = "Successfully created server '{}' with PID={}, waiting for it to become ready...".format(server_name, process.pid)
       result = True
+      self._start_readiness_monitor()
     self.P(msg, color='g')
     self._create_notification('log', msg)
     return result
@@ -424,21 +500,12 @@ class FlaskGateway(
       paths = [process.args]
     else:
       try:
-        url = 'http://{}:{}{}'.format(
-          self._servers[server_name][MSCT.HOST],
-          self._servers[server_name][MSCT.PORT],
-          MSCT.RULE_PATHS
-        )
-        response = requests.get(url=url)
+        session = self._get_server_session(server_name)
+        response = session.get(MSCT.RULE_PATHS)
         paths = response.json()[MSCT.PATHS]
-        urls = [url]
+        urls = [session.address + MSCT.RULE_PATHS]
         for path in paths:
-          url = 'http://{}:{}{}'.format(
-            self._servers[server_name][MSCT.HOST],
-            self._servers[server_name][MSCT.PORT],
-            path
-          )
-          urls.append(url)
+          urls.append(session.address + path)
         online = True
       except Exception as exc:
         _error = str(exc)
@@ -446,6 +513,7 @@ class FlaskGateway(
   
     result = {
       MSCT.ONLINE  : online,
+      MSCT.READY   : self._servers[server_name][MSCT.READY],
       MSCT.ERROR   : _error,
       MSCT.URLS    : urls,
       MSCT.PATHS   : paths,
@@ -454,18 +522,6 @@ class FlaskGateway(
     }
     return result
 
-  def _get_paths_from_server(self, server_name):
-    self.P("Requesting `get_paths` from server '{}' in order to map available paths...".format(server_name))
-    
-    resp = self._get_server_status(server_name)
-    if not resp[MSCT.ONLINE]:
-      raise ValueError('Server not yet online: {}'.format(resp[MSCT.ERROR]))
-    else:
-      self._paths = resp[MSCT.PATHS]
-      self.P("  Responded with paths={}".format(self._paths), color='g')
-    return
-
-
   def start_servers(self, start_support=False):
     for i,server_name in enumerate(self._start_server_names):
       config_endpoint = self._config_endpoints.get(server_name, {})
@@ -481,41 +537,93 @@ class FlaskGateway(
         else:
           self.P("  Starting microservice server '{}' ...".format(server_name), color='g')
       
-      success = self._start_server(
+      self._start_server(
         server_name=server_name,
         port=self._current_server_port,
         execution_path=self._server_execution_path,
         verbosity=1
       )
-      if success:
-        self._current_server_port += 1
     #endfor
 
+    if start_support:
+      return
+
     if self._no_startup_wait:
       self.P("Fast startup enabled, using default paths: {}".format(DEFAULT_SERVER_PATHS), color='g')
       self._paths = DEFAULT_SERVER_PATHS 
     else:
-      nr_tries = 0    
-      svr = self.config_data.get(MSCT.DEFAULT_SERVER,  self._start_server_names[0])
-      self.P("")
-      WAIT_ON_ERROR = 10
-      while True:
-        try:
-          nr_tries += 1
-          self._get_paths_from_server(svr)
-          self.P("  Done getting paths.", color='g')
-          break
-        except Exception as exc:
-          self.P("  Error: {}".format(exc), color='r')
-          if nr_tries >= (120 / WAIT_ON_ERROR):
-            raise ValueError("Could not get paths from server '{}'".format(svr))
-          sleep(WAIT_ON_ERROR)
-        #end try-except
-      #endwhile
+      default_server = self.config_data.get(MSCT.DEFAULT_SERVER)
+      if default_server is not None and self._server_exists(default_server):
+        self.P("Waiting for the default server '{}' to become ready in order to map available paths...".format(
+          default_server
+        ))
+        if self._wait_server_ready(default_server, timeout=READINESS_TIMEOUT):
+          self._paths = self._servers[default_server][MSCT.PATHS]
+        else:
+          self.P("  Default server '{}' did not become ready, using the first ready server".format(
+            default_server), color='r'
+          )
+      #endif default server
+      if self._paths is not None or self._wait_first_ready(timeout=READINESS_TIMEOUT):
+        self.P("  Done getting paths: {}".format(self._paths), color='g')
+      else:
+        self.P("  No server became ready in {}s".format(READINESS_TIMEOUT), color='r')
     #endif no startup wait or wait for paths
+    return
+
 
+  def _start_fork_server(self):
+    if not self.config_data.get(MSCT.FORK_SERVER, False):
+      return
+    if not fork_server_available():
+      self.P("WARNING: {} is not available on this platform, servers are started as new processes".format(
+        MSCT.FORK_SERVER), color='r'
+      )
+      return
+    self.P("Starting the fork server ...", color='g')
+    fork_server = ForkServerClient(
+      socket_path=self._get_unix_socket_path('_fork_server'),
+      preload=self.config_data.get(MSCT.FORK_SERVER_PRELOAD),
+    )
+    if fork_server.start():
+      self._fork_server = fork_server
+      self.P("  Fork server ready: {}".format(fork_server.get_status()), color='g')
+    else:
+      fork_server.stop()
+      self.P("WARNING: the fork server did not start, servers are started as new processes", color='r')
+    return
+
+  def _fork_server_spawn(self, server_name, args):
+    start = time()
+    try:
+      process = self._fork_server.spawn(args)
+    except Exception as exc:
+      self.P("WARNING: fork server could not start '{}' ({}), starting it as a new process".format(
+        server_name, exc), color='r'
+      )
+      return None
+    self.P("  Forked server '{}' with PID={} in {:.1f}ms".format(server_name, process.pid, (time() - start) * 1000))
+    return process
+
+  def _stop_fork_server(self):
+    if self._fork_server is not None:
+      self.P("Stopping the fork server ...")
+      self._fork_server.stop()
+      self._fork_server = None
     return
 
+  def _get_server_transport(self, config_endpoint):
+    transport = config_endpoint.get(MSCT.TRANSPORT, self.config_data.get(MSCT.TRANSPORT, MSCT.TRANSPORT_TCP))
+    return transport.lower()
+
+  def _get_unix_socket_path(self, server_name):
+    folder = os.path.join(self.log.get_base_folder(), UNIX_SOCKETS_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, server_name + '.sock')
+    if len(path) > MAX_UNIX_SOCKET_PATH:
+      path = os.path.join(tempfile.gettempdir(), '{}_{}.sock'.format(self.__host_id, server_name))
+      self.P("WARNING: socket path too long for '{}', using {}".format(server_name, path), color='r')
+    return path
 
   def _get_server_process(self, server_name):
     return self._servers[server_name][MSCT.PROCESS]
@@ -538,6 +646,10 @@ class FlaskGateway(
       process.kill()
       sleep(1)
     self.P("  '{}' terminated with code: {}".format(server_name, process.returncode))
+    self._close_server_session(server_name)
+    unix_socket = self._servers[server_name].get(MSCT.UNIX_SOCKET)
+    if unix_socket is not None and os.path.exists(unix_socket):
+      os.remove(unix_socket)
     self._servers.pop(server_name)
     return
 
@@ -548,6 +660,7 @@ class FlaskGateway(
       self._kill_server_by_name(server_name)
       sleep(2)
       self.P("  Server '{}' deallocated.".format(server_name))
+    self._stop_fork_server()
     return
 
   def register_handlers(self):
@@ -586,6 +699,7 @@ class FlaskGateway(
     
     self.P("Terminating gateway server v{}/{} with pid {} with signal {}...".format(
       APP_VER, LIB_VER, _pid, _signal))
+    self.log.flush_log()
     os.kill(_pid, _signal)
     self.P("Running _exit() ...")
     os._exit(1)    
\ No newline at end of file
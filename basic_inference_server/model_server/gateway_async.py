@@ -0,0 +1,391 @@
+"""
+Copyright (C) 2017-2021 Andrei Damian, andrei.damian@me.com,  All rights reserved.
+
+This software and its associated documentation are the exclusive property of the creator.
+Unauthorized use, copying, or distribution of this software, or any portion thereof,
+is strictly prohibited.
+
+Parts of this software are licensed and used in software developed by Neural Energy SRL.
+Any software proprietary to Neural Energy SRL is covered by Romanian and  Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+
+Dissemination of this information or reproduction of this material is strictly forbidden unless prior
+written permission from the author.
+
+"""
+import asyncio
+import json
+
+from functools import partial
+from time import time
+
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, UnixConnector, ClientConnectorError
+
+from ..logger_mixins.serialization_json_mixin import NPJson
+from .request_utils import MSCT, get_request_deadline
+from .stream_utils import (
+  get_response_stream_format, encode_chunk, ChunkDecoder, STREAM_SSE, STREAM_CONTENT_TYPES, SSE_END,
+)
+from .metrics import CONTENT_TYPE_METRICS
+from .tensor_codec import is_tensor_content, accepts_tensor, decode_tensors, encode_tensors, CONTENT_TYPE_TENSOR
+
+from .gateway import FlaskGateway
+from .gateway_functions import HOP_BY_HOP_HEADERS, PASSTHROUGH_CHUNK_SIZE
+from .gateway_readiness import RETRY_AFTER_WARMUP
+from .admission_control import RETRY_AFTER_OVERLOAD, get_remaining_time, is_expired
+from .gateway_sessions import DEFAULT_POOL_SIZE, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DEFAULT_MAX_RETRIES
+
+MAX_REQUEST_SIZE = 1024 ** 3
+
+# same key order as `flask.jsonify`
+_json_dumps = partial(json.dumps, cls=NPJson, sort_keys=True)
+
+
+async def get_async_request_body(request):
+  """
+  aiohttp version of `get_api_request_body`: url parameters for GET, form or json otherwise
+  """
+  params = {}
+  try:
+    if is_tensor_content(request.headers):
+      return decode_tensors(await request.read())
+    if request.method == 'GET':
+      params = dict(request.query)
+    else:
+      params = dict(await request.post())
+      if len(params) == 0 and request.can_read_body:
+        json_data = await request.json()
+        params = dict(json_data) if json_data is not None else {}
+    #endif
+  except Exception:
+    params = {}
+  return params
+
+
+class AsyncGateway(FlaskGateway):
+  """
+  `asyncio` front end of the gateway: same routes and answers as `FlaskGateway` but each proxied
+  call is a coroutine on an `aiohttp` connection pool instead of an OS thread blocked for the
+  whole round trip. Blocking gateway commands (start/kill servers, status) run in the default
+  executor. Servers management, readiness and routing are inherited unchanged.
+  """
+  def __init__(self, **kwargs):
+    self._client_sessions = {}
+    super(AsyncGateway, self).__init__(**kwargs)
+    return
+
+  def _log_banner(self):
+    _logo = "AsyncGateway v{} started on '{}:{}'".format(
+      self.__version__, self._host, self._port
+    )
+    self.log.P(_logo, color='g', boxed=True)
+    return
+
+  def _create_app(self):
+    self.app = web.Application(client_max_size=MAX_REQUEST_SIZE)
+    self.app.on_cleanup.append(self._close_client_sessions)
+
+    # (rule, command, uses request params, runs in executor)
+    rules = [
+      (MSCT.RULE_START, self._start_server_command, True, True),
+      (MSCT.RULE_KILL, self._kill_server_command, True, True),
+      (MSCT.RULE_LIST, self._list_servers_command, False, True),
+      (MSCT.RULE_SYS, self._system_status_command, False, True),
+      ### endpoint only for support processes
+      (MSCT.RULE_SUPPORT, self._support_status_command, True, False),
+      ### THIS SHOULD BE USED WITH CARE IN PROD
+      (MSCT.RULE_SHUTDOWN, self._shutdown_command, True, True),
+    ]
+    for rule, command, with_params, blocking in rules:
+      self.P("Registering {} on `{}`".format(rule, command.__name__), color='g')
+      handler = partial(self._async_view_command, command, with_params, blocking)
+      self.app.router.add_route('GET', rule, handler)
+      self.app.router.add_route('POST', rule, handler)
+    #endfor
+    self.P("Registering {} on `_async_view_metrics`".format(MSCT.RULE_METRICS), color='g')
+    self.app.router.add_route('GET', MSCT.RULE_METRICS, self._async_view_metrics)
+    return
+
+  async def _async_view_metrics(self, request):
+    # rendered on the event loop: only in-memory values are read
+    return web.Response(
+      body=self._metrics_command().encode('utf-8'),
+      headers={'Content-Type' : CONTENT_TYPE_METRICS},
+    )
+
+  def _register_server_paths(self):
+    for rule in self._paths:
+      self.P("Registering {} on `_async_view_worker`".format(rule), color='g')
+      self.app.router.add_route('*', rule, partial(self._async_view_worker, rule))
+    return
+
+  def _run_app(self):
+    # signals are handled by `register_handlers` as in the Flask gateway
+    web.run_app(
+      self.app,
+      host=self._host,
+      port=self._port,
+      handle_signals=False,
+      print=None,
+    )
+    return
+
+  def _async_response(self, data, status=200, headers=None, as_tensor=False):
+    fn = self._get_download_file(data)
+    if fn is not None:
+      return web.FileResponse(fn)
+    if as_tensor:
+      return web.Response(
+        body=encode_tensors(self._get_response_dict(data)),
+        status=status,
+        headers=headers,
+        content_type=CONTENT_TYPE_TENSOR,
+      )
+    return web.json_response(
+      self._get_response_dict(data),
+      status=status,
+      headers=headers,
+      dumps=_json_dumps,
+    )
+
+  def _async_warming_up_response(self, server_name):
+    return self._async_response(
+      self._get_warming_up_data(server_name),
+      status=503,
+      headers={'Retry-After' : str(RETRY_AFTER_WARMUP)},
+    )
+
+  def _async_overloaded_response(self, server_name):
+    return self._async_response(
+      self._get_overloaded_data(server_name),
+      status=429,
+      headers={'Retry-After' : str(RETRY_AFTER_OVERLOAD)},
+    )
+
+  def _async_deadline_exceeded_response(self, server_name):
+    return self._async_response(self._get_deadline_exceeded_data(server_name), status=504)
+
+  def _async_bad_signature_response(self, signature):
+    return self._async_response({
+      MSCT.ERROR : "Bad signature {}. Available signatures/servers: {}".format(
+        signature,
+        self.active_servers
+      )
+    })
+
+  async def _async_view_command(self, command, with_params, blocking, request):
+    args = []
+    if with_params:
+      args.append(await get_async_request_body(request))
+    if blocking:
+      result = await asyncio.get_running_loop().run_in_executor(None, command, *args)
+    else:
+      result = command(*args)
+    return self._async_response(result)
+
+  def _get_client_session(self, server_name):
+    session = self._get_server_session(server_name)
+    client = self._client_sessions.get(server_name)
+    if client is not None and client[0] != session.address:
+      # the server was restarted on another port
+      asyncio.ensure_future(client[1].close())
+      client = None
+    if client is None:
+      config_endpoint = self._config_endpoints.get(server_name, {})
+      pool_size = config_endpoint.get(MSCT.POOL_SIZE, DEFAULT_POOL_SIZE)
+      if session.unix_socket is not None:
+        connector = UnixConnector(path=session.unix_socket, limit=pool_size)
+      else:
+        connector = TCPConnector(limit=pool_size)
+      client = (session.address, ClientSession(
+        base_url=session.base_url,
+        connector=connector,
+        timeout=ClientTimeout(
+          total=None,
+          sock_connect=config_endpoint.get(MSCT.CONNECT_TIMEOUT, DEFAULT_CONNECT_TIMEOUT),
+          sock_read=config_endpoint.get(MSCT.READ_TIMEOUT, DEFAULT_READ_TIMEOUT),
+        ),
+        json_serialize=_json_dumps,
+        auto_decompress=False,
+      ))
+      self._client_sessions[server_name] = client
+    #endif new session
+    return client[1]
+
+  async def _close_client_sessions(self, app):
+    for _, client in self._client_sessions.values():
+      await client.close()
+    self._client_sessions = {}
+    return
+
+  async def _async_request(self, server_name, method, path, **kwargs):
+    # as in the sync pool only connection errors are retried (the request never reached the server)
+    client = self._get_client_session(server_name)
+    max_retries = self._config_endpoints.get(server_name, {}).get(MSCT.MAX_RETRIES, DEFAULT_MAX_RETRIES)
+    for attempt in range(max_retries + 1):
+      try:
+        return await client.request(method, path, **kwargs)
+      except ClientConnectorError:
+        if attempt >= max_retries:
+          raise
+        await asyncio.sleep(0.1 * 2 ** attempt)
+    #endfor
+    return
+
+  async def _async_view_worker(self, path, request):
+    signature = request.headers.get(MSCT.SIGNATURE_HEADER)
+    if signature is None and self._passthrough:
+      signature = request.query.get(MSCT.SIGNATURE)
+    if signature is not None:
+      return await self._async_view_worker_passthrough(path=path, signature=signature, request=request)
+
+    params = await get_async_request_body(request)
+    deadline = get_request_deadline(request.headers, params)
+    signature = params.pop(MSCT.SIGNATURE, None)
+    if signature is None:
+      return self._async_response({MSCT.ERROR : "Bad input. MSCT.SIGNATURE not found"})
+
+    server_name = self._route_request(signature=signature, path=path)
+    if server_name is None:
+      return self._async_bad_signature_response(signature)
+
+    if not self._is_server_ready(server_name):
+      return self._async_warming_up_response(server_name)
+
+    remaining = get_remaining_time(deadline)
+    if remaining is not None and remaining <= 0:
+      return self._async_deadline_exceeded_response(server_name)
+
+    kwargs = self._get_forward_kwargs(params=params, headers=request.headers, remaining=remaining)
+    if remaining is not None:
+      # the gateway stops waiting when the client deadline passes
+      kwargs['timeout'] = ClientTimeout(total=remaining)
+    as_tensor = accepts_tensor(request.headers)
+    if not self._routing_start(server_name, path=path):
+      return self._async_overloaded_response(server_name)
+    start, failed, status_code, headers, stream_format = time(), True, 200, None, None
+    try:
+      response = await self._async_request(server_name, 'POST', path, **kwargs)
+      stream_format = get_response_stream_format(response.headers)
+      if stream_format is None:
+        async with response:
+          result = self._get_forward_answer(await response.read(), response.headers)
+        if path == MSCT.RULE_UPDATE_WORKERS:
+          self._refresh_nr_workers(server_name, result)
+      # admission rejections (429/503 with Retry-After) and expired deadlines (504) are relayed to the client
+      status_code = response.status
+      if 'Retry-After' in response.headers:
+        headers = {'Retry-After' : response.headers['Retry-After']}
+      failed = False
+    except Exception as exc:
+      url = self._get_server_session(server_name).address + path
+      if is_expired(deadline):
+        status_code = 504
+        result = self._get_deadline_exceeded_data(server_name)
+      else:
+        result = {
+          MSCT.ERROR : self._get_not_responding_message(signature=server_name, url=url, exc=exc),
+        }
+      as_tensor = False
+    finally:
+      if failed or stream_format is None:
+        self._routing_end(server_name, elapsed=time() - start, error=failed, status_code=status_code, path=path)
+    if stream_format is not None:
+      # the call is in flight (and holds a server worker) until the stream is closed
+      failed = True
+      try:
+        relayed = await self._async_stream_relay(request, response, stream_format)
+        failed = False
+      finally:
+        self._routing_end(server_name, elapsed=time() - start, error=failed, status_code=status_code, path=path)
+      return relayed
+    return self._async_response(result, status=status_code, headers=headers, as_tensor=as_tensor)
+
+  async def _async_stream_relay(self, request, response, stream_format):
+    """
+    Relays each chunk as soon as it arrives with the gateway envelope, see `_get_stream_relay`
+    """
+    relayed = web.StreamResponse(
+      status=response.status,
+      headers={'Content-Type' : STREAM_CONTENT_TYPES[stream_format], 'Cache-Control' : 'no-cache'},
+    )
+    decoder = ChunkDecoder(stream_format)
+    async with response:
+      await relayed.prepare(request)
+      try:
+        async for line in response.content:
+          chunk = decoder.decode(line)
+          if decoder.ended:
+            break
+          if chunk is not None:
+            await relayed.write(encode_chunk(self._get_response_dict(chunk), stream_format).encode('utf-8'))
+        #endfor
+        if stream_format == STREAM_SSE:
+          await relayed.write(SSE_END.encode('utf-8'))
+        await relayed.write_eof()
+      except ConnectionResetError:
+        # the client left: closing the upstream response stops the stream on the server
+        self.P("Client left during the stream from {}".format(request.path), color='y')
+    return relayed
+
+  async def _async_view_worker_passthrough(self, path, signature, request):
+    """
+    Relays the request and response bytes unchanged, see `_view_func_worker_passthrough`
+    """
+    server_name = self._route_request(signature=signature, path=path)
+    if server_name is None:
+      return self._async_bad_signature_response(signature)
+
+    if not self._is_server_ready(server_name):
+      return self._async_warming_up_response(server_name)
+
+    # the body is not parsed so the deadline can only come in the header
+    deadline = get_request_deadline(request.headers, params=None)
+    remaining = get_remaining_time(deadline)
+    if remaining is not None and remaining <= 0:
+      return self._async_deadline_exceeded_response(server_name)
+
+    headers = {
+      k : v for k, v in request.headers.items()
+      if k.lower() in ['content-type', 'content-encoding', 'accept', 'accept-encoding', 'content-length']
+    }
+    kwargs = {}
+    if remaining is not None:
+      headers[MSCT.DEADLINE_HEADER] = str(int(remaining * 1000))
+      kwargs['timeout'] = ClientTimeout(total=remaining)
+    data = request.content.iter_chunked(PASSTHROUGH_CHUNK_SIZE) if request.can_read_body else None
+    args = [(k, v) for k, v in request.query.items() if k != MSCT.SIGNATURE]
+
+    if not self._routing_start(server_name, path=path):
+      return self._async_overloaded_response(server_name)
+    start, failed, status_code = time(), True, None
+    try:
+      # streamed bodies cannot be sent twice so no retries here
+      response = await self._get_client_session(server_name).request(
+        request.method, path, params=args, data=data, headers=headers, **kwargs
+      )
+      status_code = response.status
+      failed = False
+    except Exception as exc:
+      if is_expired(deadline):
+        status_code = 504
+        return self._async_deadline_exceeded_response(server_name)
+      url = self._get_server_session(server_name).address + path
+      return self._async_response({
+        MSCT.ERROR : self._get_not_responding_message(signature=server_name, url=url, exc=exc),
+      })
+    finally:
+      self._routing_end(server_name, elapsed=time() - start, error=failed, status_code=status_code, path=path)
+
+    relayed_headers = [
+      (k, v) for k, v in response.headers.items()
+      if k.lower() not in HOP_BY_HOP_HEADERS
+    ]
+    relayed_headers += [(k, str(v)) for k, v in self._get_response_metadata().items()]
+    relayed = web.StreamResponse(status=response.status, headers=relayed_headers)
+    async with response:
+      await relayed.prepare(request)
+      async for chunk in response.content.iter_chunked(PASSTHROUGH_CHUNK_SIZE):
+        await relayed.write(chunk)
+      await relayed.write_eof()
+    return relayed
@@ -1,31 +1,260 @@
 import flask
-import requests
+import json
 
 
 from time import sleep, time
 from datetime import timedelta
 
 
-from .request_utils import get_api_request_body, MSCT
+from .request_utils import get_api_request_body, get_request_deadline, MSCT
+from .admission_control import get_remaining_time, is_expired
+from .stream_utils import (
+  get_stream_format, get_response_stream_format, decode_chunks, encode_chunk, ClosingStream,
+  STREAM_SSE, STREAM_CONTENT_TYPES, SSE_END,
+)
+from .tensor_codec import is_tensor_content, accepts_tensor, encode_tensors, decode_tensors, CONTENT_TYPE_TENSOR
 from .gateway_utils_mixin import StateCT
 
 from ..lib_ver import __VER__ as LIB_VER
 from app_ver import __VER__ as APP_VER
 
+PASSTHROUGH_CHUNK_SIZE = 64 * 1024
+
+# headers that are specific to each connection and must not be relayed by the proxy
+HOP_BY_HOP_HEADERS = [
+  'connection',
+  'keep-alive',
+  'proxy-authenticate',
+  'proxy-authorization',
+  'te',
+  'trailers',
+  'transfer-encoding',
+  'upgrade',
+  'server',
+  'date',
+]
+
+
+class _SizedStream(object):
+  """
+  Wraps the incoming request stream so that `requests` sends it with the original
+  Content-Length instead of reading it in memory or switching to chunked encoding.
+  """
+  def __init__(self, stream, length):
+    self._stream = stream
+    self._length = length
+    return
+
+  def __len__(self):
+    return self._length
+
+  def read(self, size=-1):
+    return self._stream.read(size)
+
+
 class _GatewayFunctionMixin(object):
   def __init__(self) -> None:
     super(_GatewayFunctionMixin, self).__init__()
     return
   
+  
+  def _get_passthrough_signature(self, request):
+    """
+    Returns the signature of a passthrough call or None for a regular call. A call is 
+    passthrough if the signature is sent in the `X-Signature` header or, when `PASSTHROUGH` 
+    is enabled in the gateway config, in the `SIGNATURE` query parameter.
+    """
+    signature = request.headers.get(MSCT.SIGNATURE_HEADER)
+    if signature is None and self._passthrough:
+      signature = request.args.get(MSCT.SIGNATURE)
+    return signature
+  
+  
+  def _get_not_responding_message(self, signature, url, exc):
+    request_time_since_start = time() - self._servers[signature][MSCT.START]
+    if request_time_since_start < 70:
+      msg = "Server '{}' is not responding ({:.1f}s from start) - probably is still in INIT stage: {}".format(
+        url, request_time_since_start,
+        exc
+      )
+    else:
+      msg = "Server '{}' is not responding ({:.1f}s from start) - probably is DOWN: {}".format(
+        url, request_time_since_start,
+        exc
+      )
+    #endif too early or not
+    return msg
+
+
+  def _get_deadline_exceeded_data(self, server_name):
+    return {
+      MSCT.ERROR : "Deadline exceeded before server '{}' answered".format(server_name),
+    }
+
+  def _get_deadline_exceeded_response(self, server_name):
+    response = self.get_response(self._get_deadline_exceeded_data(server_name))
+    response.status_code = 504
+    return response
+
+  def _view_func_worker_passthrough(self, path, signature):
+    """
+    Relays the request and response bytes unchanged - no json decoding/encoding is done 
+    in the gateway. The gateway metadata is delivered in the response headers.
+    """
+    request = flask.request
+    server_name = self._route_request(signature=signature, path=path)
+    if server_name is None:
+      return self.get_response({
+        MSCT.ERROR : "Bad signature {}. Available signatures/servers: {}".format(
+          signature, 
+          self.active_servers
+        )
+      })
+    
+    if not self._is_server_ready(server_name):
+      return self._get_warming_up_response(server_name)
+    
+    # the body is not parsed so the deadline can only come in the header
+    deadline = get_request_deadline(request.headers, params=None)
+    remaining = get_remaining_time(deadline)
+    if remaining is not None and remaining <= 0:
+      return self._get_deadline_exceeded_response(server_name)
+
+    session = self._get_server_session(server_name)
+    url = session.address + path
+    
+    headers = {
+      k : v for k, v in request.headers.items() 
+      if k.lower() in ['content-type', 'content-encoding', 'accept', 'accept-encoding']
+    }
+    timeout = session.timeout
+    if remaining is not None:
+      headers[MSCT.DEADLINE_HEADER] = str(int(remaining * 1000))
+      timeout = (session.timeout[0], remaining)
+    if request.content_length:
+      data = _SizedStream(request.stream, request.content_length)
+    else:
+      data = request.get_data()
+    args = [(k, v) for k, v in request.args.items(multi=True) if k != MSCT.SIGNATURE]
+    
+    # the streamed body is not awaited so the routing latency is the time to the response headers
+    if not self._routing_start(server_name, path=path):
+      return self._get_overloaded_response(server_name)
+    start, failed, status_code = time(), True, None
+    try:
+      response = session.request(
+        method=request.method,
+        path=path,
+        params=args,
+        data=data,
+        headers=headers,
+        stream=True,
+        timeout=timeout,
+      )
+      status_code = response.status_code
+      failed = False
+    except Exception as exc:
+      if is_expired(deadline):
+        status_code = 504
+        return self._get_deadline_exceeded_response(server_name)
+      return self.get_response({
+        MSCT.ERROR : self._get_not_responding_message(signature=server_name, url=url, exc=exc),
+      })
+    finally:
+      self._routing_end(server_name, elapsed=time() - start, error=failed, status_code=status_code, path=path)
+    
+    def _relay():
+      try:
+        for chunk in response.raw.stream(PASSTHROUGH_CHUNK_SIZE, decode_content=False):
+          yield chunk
+      finally:
+        response.close()
+      return
+    
+    relayed_headers = [
+      (k, v) for k, v in response.headers.items() 
+      if k.lower() not in HOP_BY_HOP_HEADERS
+    ]
+    relayed_headers += [(k, str(v)) for k, v in self._get_response_metadata().items()]
+    return flask.Response(
+      _relay(),
+      status=response.status_code,
+      headers=relayed_headers,
+      direct_passthrough=True,
+    )
+  
+
+  def _get_stream_relay(self, response, stream_format, on_end=None):
+    """
+    Relays each chunk as soon as it arrives with the gateway envelope of `get_response`.
+    `on_end(failed)` is called once the stream is closed (finished, failed or left by the client)
+    """
+    state = {'failed' : False}
+
+    def _relay():
+      try:
+        for chunk in decode_chunks(response.iter_lines(), stream_format):
+          yield encode_chunk(self._get_response_dict(chunk), stream_format)
+        if stream_format == STREAM_SSE:
+          yield SSE_END
+      except Exception:
+        # a client that leaves closes the generator (GeneratorExit) which is not a failure
+        state['failed'] = True
+        raise
+      return
+
+    def _close():
+      response.close()
+      if on_end is not None:
+        on_end(failed=state['failed'])
+      return
+
+    return flask.Response(
+      ClosingStream(_relay(), on_close=_close),
+      status=response.status_code,
+      mimetype=STREAM_CONTENT_TYPES[stream_format],
+      headers={'Cache-Control' : 'no-cache'},
+    )
+
+  def _get_forward_kwargs(self, params, headers, remaining=None):
+    """
+    The call to the server keeps the format of the client call: binary payloads are re-encoded
+    (only the json header changes, the arrays are not converted) and binary answers are requested
+    only if the client accepts them. The server receives the remaining deadline budget (if any).
+    """
+    dct_headers = {}
+    if remaining is not None:
+      dct_headers[MSCT.DEADLINE_HEADER] = str(int(remaining * 1000))
+    stream_format = get_stream_format(headers)
+    if stream_format is not None:
+      # a streamed answer is always made of json chunks
+      dct_headers['Accept'] = STREAM_CONTENT_TYPES[stream_format]
+    elif accepts_tensor(headers):
+      dct_headers['Accept'] = CONTENT_TYPE_TENSOR
+    if is_tensor_content(headers):
+      dct_headers['Content-Type'] = CONTENT_TYPE_TENSOR
+      return {'data' : encode_tensors(params), 'headers' : dct_headers}
+    return {'json' : params, 'headers' : dct_headers}
+
+  def _get_forward_answer(self, content, headers):
+    if is_tensor_content(headers):
+      return decode_tensors(content)
+    return json.loads(content)
 
   def _view_func_worker(self, path):
     request = flask.request
+    passthrough_signature = self._get_passthrough_signature(request)
+    if passthrough_signature is not None:
+      return self._view_func_worker_passthrough(path=path, signature=passthrough_signature)
+    
     params = get_api_request_body(request, self.log)
+    deadline = get_request_deadline(request.headers, params)
     signature = params.pop(MSCT.SIGNATURE, None)
     if signature is None:
       return self.get_response({MSCT.ERROR : "Bad input. MSCT.SIGNATURE not found"})
 
-    if signature not in self._servers:
+    server_name = self._route_request(signature=signature, path=path)
+    if server_name is None:
       return self.get_response({
         MSCT.ERROR : "Bad signature {}. Available signatures/servers: {}".format(
           signature, 
@@ -33,43 +262,69 @@ class _GatewayFunctionMixin(object):
         )
       })
     
-    url = 'http://{}:{}{}'.format(
-      self._servers[signature][MSCT.HOST],
-      self._servers[signature][MSCT.PORT],
-      path
-    )
+    if not self._is_server_ready(server_name):
+      return self._get_warming_up_response(server_name)
+
+    remaining = get_remaining_time(deadline)
+    if remaining is not None and remaining <= 0:
+      return self._get_deadline_exceeded_response(server_name)
+
+    session = self._get_server_session(server_name)
+    url = session.address + path
+    kwargs = self._get_forward_kwargs(params=params, headers=request.headers, remaining=remaining)
+    if remaining is not None:
+      # the gateway stops waiting when the client deadline passes
+      kwargs['timeout'] = (session.timeout[0], remaining)
+    if get_stream_format(request.headers) is not None:
+      kwargs['stream'] = True
+    as_tensor = accepts_tensor(request.headers)
     result = None
-    request_time_since_start = time() - self._servers[signature][MSCT.START]
+    if not self._routing_start(server_name, path=path):
+      return self._get_overloaded_response(server_name)
+    start, failed, status_code, is_stream = time(), True, None, False
     try:      
-      response = requests.post(url, json=params)
-      result = self.get_response(response.json())
+      response = session.post(path, **kwargs)
+      status_code = response.status_code
+      stream_format = get_response_stream_format(response.headers)
+      if stream_format is not None:
+        # the call is in flight (and holds a server worker) until the stream is closed
+        def _on_stream_end(failed):
+          self._routing_end(server_name, elapsed=time() - start, error=failed, status_code=status_code, path=path)
+          return
+        result = self._get_stream_relay(response, stream_format, on_end=_on_stream_end)
+        failed, is_stream = False, True
+        return result
+      answer = self._get_forward_answer(response.content, response.headers)
+      if path == MSCT.RULE_UPDATE_WORKERS:
+        self._refresh_nr_workers(server_name, answer)
+      result = self.get_response(answer, as_tensor=as_tensor)
+      # admission rejections (429/503 with Retry-After) and expired deadlines (504) are relayed to the client
+      if status_code != 200:
+        result.status_code = status_code
+        if 'Retry-After' in response.headers:
+          result.headers['Retry-After'] = response.headers['Retry-After']
+      failed = False
     except Exception as exc:
-      if request_time_since_start < 70:
-        msg = "Server '{}' is not responding ({:.1f}s from start) - probably is still in INIT stage: {}".format(
-          url, request_time_since_start,
-          exc
-        )
+      if is_expired(deadline):
+        status_code = 504
+        result = self._get_deadline_exceeded_response(server_name)
       else:
-        msg = "Server '{}' is not responding ({:.1f}s from start) - probably is DOWN: {}".format(
-          url, request_time_since_start,
-          exc
-        )
-      #endif too early or not
-      result = self.get_response({
-        MSCT.ERROR : msg,
-      })
+        result = self.get_response({
+          MSCT.ERROR : self._get_not_responding_message(signature=server_name, url=url, exc=exc),
+        })
+    finally:
+      if not is_stream:
+        self._routing_end(server_name, elapsed=time() - start, error=failed, status_code=status_code, path=path)
     return result
 
-  def _view_func_start_server(self):
-    request = flask.request
-    params = get_api_request_body(request, self.log)
+  def _start_server_command(self, params):
     signature = params.get(MSCT.SIGNATURE, None)
 
     if signature is None:
-      return self.get_response({MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"})
+      return {MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"}
 
     if self._server_exists(signature):
-      return self.get_response({MSCT.ERROR : "Signature {} already started".format(signature)})
+      return {MSCT.ERROR : "Signature {} already started".format(signature)}
 
     resp = self._start_server(
       server_name=signature,
@@ -78,58 +333,50 @@ class _GatewayFunctionMixin(object):
       verbosity=0
     )
     if resp:
-      self._current_server_port += 1
-      return self.get_response({'MESSAGE': 'OK.'})
+      return {'MESSAGE': 'OK.'}
     else:
-      return self.get_response({'MESSAGE': 'Server DISABLED.'})
+      return {'MESSAGE': 'Server DISABLED.'}
 
-  def _view_func_kill_server(self):
-    request = flask.request
-    params = get_api_request_body(request, self.log)
+  def _kill_server_command(self, params):
     signature = params.get(MSCT.SIGNATURE, None)
 
     if signature is None:
-      return self.get_response({MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"})
+      return {MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"}
     
     if signature == '*':
       self.kill_servers()      
     elif not self._server_exists(signature):
-      return self.get_response({MSCT.ERROR : "Bad signature {}. Available signatures: {}".format(signature, self.active_servers)})
+      return {MSCT.ERROR : "Bad signature {}. Available signatures: {}".format(signature, self.active_servers)}
     else:
       process = self._get_server_process(signature)
       self._kill_server_by_name(signature)
-      return self.get_response({'MESSAGE' : 'OK. Killed PID={} with return_code {}.'.format(
+      return {'MESSAGE' : 'OK. Killed PID={} with return_code {}.'.format(
         process.pid,
         process.returncode
-      )})
+      )}
 
-
-  def _view_list_servers(self):
-    return self.get_response({
+  def _list_servers_command(self):
+    return {
       MSCT.AVAIL_SERVERS : {
         svr_name : self._get_server_status(svr_name)
-        for svr_name in self._servers 
+        for svr_name in list(self._servers)
       },
-    })
-  
-  
-  def _view_system_status(self):
+    }
+
+  def _system_status_command(self):
     status, alerts = self._get_system_status(display=True)
     dct_history = self.get_gw_state_history()
-    return self.get_response({
+    return {
       MSCT.SYSTEM_ALERTS : alerts,
       MSCT.SYSTEM_HISTORY : dct_history,
       MSCT.SYSTEM_STATUS : status,
-    })
-    
-    
-  def _view_shutdown(self):
-    request = flask.request
-    params = get_api_request_body(request, self.log)
+    }
+
+  def _shutdown_command(self, params):
     signature = params.get(MSCT.SIGNATURE, None)
 
     if signature is None:
-      return self.get_response({MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"})
+      return {MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"}
     
     if signature.upper() == MSCT.KILL_CMD:
       self.P("Received shutdown command.Confirmation signature: {}".format(signature.upper()))
@@ -137,29 +384,58 @@ class _GatewayFunctionMixin(object):
     #endif done kill 
 
     if not self._server_exists(signature):
-      return self.get_response({MSCT.ERROR : "Bad signature {}. Available signatures: {}".format(signature, self.active_servers)})
+      return {MSCT.ERROR : "Bad signature {}. Available signatures: {}".format(signature, self.active_servers)}
     return
-  
-
-  def _view_support_status(self):
-    """
-    
-    This endpoint is used by the support module to update the status of the server.
-    It should not be called directly by the user/consumers.
 
-    """
+  def _support_status_command(self, params):
     ok = True
-    request = flask.request
-    params = get_api_request_body(request, self.log)
     signature = params.get(MSCT.SIGNATURE, None)
 
     if signature is None:
-      return self.get_response({MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"})
+      return {MSCT.ERROR : f"Bad input. {MSCT.SIGNATURE} not found"}
     data = params.get('data', {})
     if len(data) > 0:
       self._process_support_data(signature, data)
     if ok:
-      return self.get_response({'MESSAGE': 'OK.'})
+      return {'MESSAGE': 'OK.'}
     else:
-      return self.get_response({'MESSAGE': 'ERROR.'})
-  
\ No newline at end of file
+      return {'MESSAGE': 'ERROR.'}
+
+
+  def _view_func_start_server(self):
+    params = get_api_request_body(flask.request, self.log)
+    return self.get_response(self._start_server_command(params))
+
+  def _view_func_kill_server(self):
+    params = get_api_request_body(flask.request, self.log)
+    result = self._kill_server_command(params)
+    if result is not None:
+      return self.get_response(result)
+    return
+
+
+  def _view_list_servers(self):
+    return self.get_response(self._list_servers_command())
+  
+  
+  def _view_system_status(self):
+    return self.get_response(self._system_status_command())
+    
+    
+  def _view_shutdown(self):
+    params = get_api_request_body(flask.request, self.log)
+    result = self._shutdown_command(params)
+    if result is not None:
+      return self.get_response(result)
+    return
+  
+
+  def _view_support_status(self):
+    """
+    
+    This endpoint is used by the support module to update the status of the server.
+    It should not be called directly by the user/consumers.
+
+    """
+    params = get_api_request_body(flask.request, self.log)
+    return self.get_response(self._support_status_command(params))
@@ -0,0 +1,46 @@
+import flask
+
+from .metrics import MetricsRegistry, CONTENT_TYPE_METRICS
+
+
+class _GatewayMetricsMixin(object):
+  """
+  Prometheus-style metrics of the gateway served on `/metrics`. The execution calls are counted
+  per server signature when their routing ends, so a scrape only renders in-memory values and
+  never waits for the logger or for the servers.
+  """
+  def __init__(self) -> None:
+    super(_GatewayMetricsMixin, self).__init__()
+    self.__metrics = MetricsRegistry()
+    self.__requests = self.__metrics.counter(
+      'bis_gateway_requests_total', 'Execution calls proxied to the servers by status',
+      labels=('signature', 'status'),
+    )
+    self.__proxy_time = self.__metrics.histogram(
+      'bis_gateway_proxy_duration_seconds', 'Time from proxying a call to the server answer (headers for streams)',
+      labels=('signature',),
+    )
+    self.__metrics.gauge(
+      'bis_gateway_in_flight_requests', 'Calls in progress for each server',
+      labels=('signature',), func=lambda: self.__get_routing_values('in_flight'),
+    )
+    self.__metrics.counter(
+      'bis_gateway_shed_total', 'Calls rejected by the gateway with 429 before reaching the server',
+      labels=('signature',), func=lambda: self.__get_routing_values('shed'),
+    )
+    self.__metrics.add_process_metrics()
+    return
+
+  def __get_routing_values(self, key):
+    return [((svr,), stats[key]) for svr, stats in self._get_routing_status()['servers'].items()]
+
+  def _metrics_call_end(self, server_name, elapsed, status):
+    self.__requests.inc(server_name, status)
+    self.__proxy_time.observe(elapsed, server_name)
+    return
+
+  def _metrics_command(self):
+    return self.__metrics.render()
+
+  def _view_metrics(self):
+    return flask.Response(self._metrics_command(), content_type=CONTENT_TYPE_METRICS)
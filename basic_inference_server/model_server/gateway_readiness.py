@@ -0,0 +1,135 @@
+from threading import Lock, Event, Thread
+from time import sleep, time
+
+from .request_utils import MSCT
+
+READINESS_POLL_INTERVAL = 0.25
+READINESS_TIMEOUT = 120
+READINESS_CHECK_TIMEOUT = (0.5, 2)
+RETRY_AFTER_WARMUP = 5
+
+
+class _GatewayReadinessMixin(object):
+  """
+  Tracks the readiness of the started servers. All servers are launched at once and a
+  background thread polls the `/get_paths` of each server that is still warming up. A
+  server is ready (receives traffic) as soon as it answers; until then the gateway
+  answers with 503 and a `Retry-After` header.
+  """
+  def __init__(self) -> None:
+    super(_GatewayReadinessMixin, self).__init__()
+    self.__readiness_lock = Lock()
+    self.__readiness_thread = None
+    self.__first_ready = Event()
+    return
+
+  def _is_server_ready(self, server_name):
+    return self._servers.get(server_name, {}).get(MSCT.READY, False)
+
+  def _get_pending_servers(self):
+    return [
+      svr for svr in list(self._servers)
+      if not self._servers.get(svr, {}).get(MSCT.READY, True)
+    ]
+
+  def _handle_failed_server(self, server_name):
+    dct_server = self._servers.get(server_name)
+    if dct_server is None:
+      return
+    process = dct_server[MSCT.PROCESS]
+    msg = "**************** Process failed for {}:{} with code {} *******************".format(
+      process.args, dct_server[MSCT.SESSION].address, process.returncode
+    )
+    self.P(msg, color='r')
+    self._create_notification(notif='log', msg=msg)
+    self._close_server_session(server_name)
+    self._servers.pop(server_name, None)
+    return
+
+  def _check_server_readiness(self, server_name):
+    dct_server = self._servers.get(server_name)
+    if dct_server is None:
+      # server was killed meanwhile
+      return
+    if dct_server[MSCT.PROCESS].poll() is not None:
+      self._handle_failed_server(server_name)
+      return
+    try:
+      response = dct_server[MSCT.SESSION].get(MSCT.RULE_PATHS, timeout=READINESS_CHECK_TIMEOUT)
+      paths = response.json()[MSCT.PATHS]
+    except Exception:
+      return
+    dct_server[MSCT.PATHS] = paths
+    dct_server[MSCT.READY] = True
+    if self._paths is None:
+      self._paths = paths
+    elapsed = time() - dct_server[MSCT.START]
+    msg = "Server '{}' is ready after {:.1f}s with paths={}".format(server_name, elapsed, paths)
+    self.P(msg, color='g')
+    self._create_notification('log', msg)
+    self.__first_ready.set()
+    return
+
+  def _readiness_loop(self):
+    while True:
+      with self.__readiness_lock:
+        pending = self._get_pending_servers()
+        if len(pending) == 0:
+          self.__readiness_thread = None
+          break
+      #endwith
+      for server_name in pending:
+        self._check_server_readiness(server_name)
+      sleep(READINESS_POLL_INTERVAL)
+    #endwhile
+    return
+
+  def _start_readiness_monitor(self):
+    with self.__readiness_lock:
+      if self.__readiness_thread is None:
+        self.__readiness_thread = Thread(target=self._readiness_loop, name='GatewayReadiness', daemon=True)
+        self.__readiness_thread.start()
+    return
+
+  def _wait_first_ready(self, timeout=READINESS_TIMEOUT):
+    """
+    Blocks until any of the servers is ready and returns True or False after `timeout` seconds
+    """
+    start = time()
+    while (time() - start) < timeout:
+      if self.__first_ready.wait(READINESS_POLL_INTERVAL):
+        return True
+      if len(self._get_pending_servers()) == 0:
+        # all servers failed
+        return False
+    #endwhile
+    return False
+
+  def _wait_server_ready(self, server_name, timeout=READINESS_TIMEOUT):
+    """
+    Blocks until `server_name` is ready and returns True or False after `timeout` seconds or if the
+    server failed
+    """
+    start = time()
+    while (time() - start) < timeout:
+      if self._is_server_ready(server_name):
+        return True
+      if server_name not in self._servers:
+        return False
+      sleep(READINESS_POLL_INTERVAL)
+    #endwhile
+    return False
+
+  def _get_warming_up_data(self, server_name):
+    elapsed = time() - self._servers[server_name][MSCT.START]
+    return {
+      MSCT.ERROR : "Server '{}' is warming up ({:.1f}s from start). Retry in {}s.".format(
+        server_name, elapsed, RETRY_AFTER_WARMUP
+      )
+    }
+
+  def _get_warming_up_response(self, server_name):
+    response = self.get_response(self._get_warming_up_data(server_name))
+    response.status_code = 503
+    response.headers['Retry-After'] = str(RETRY_AFTER_WARMUP)
+    return response
@@ -0,0 +1,199 @@
+import random
+
+from threading import Lock
+
+from .request_utils import MSCT
+from .admission_control import RETRY_AFTER_OVERLOAD
+
+ROUTING_LEAST_OUTSTANDING = 'least_outstanding'
+ROUTING_P2C = 'p2c'
+ROUTING_ROUND_ROBIN = 'round_robin'
+ROUTING_POLICIES = [ROUTING_LEAST_OUTSTANDING, ROUTING_P2C, ROUTING_ROUND_ROBIN]
+
+EWMA_ALPHA = 0.2
+
+
+class _GatewayRoutingMixin(object):
+  """
+  Spreads the calls of a logical signature over all the live replicas of the same `SERVER_CLASS`
+  (e.g. `dummy_model_demo1` and `dummy_model_demo1-bis`). A replica that is addressed by its own
+  name (different from its class) still receives only the calls targeted at it.
+  """
+  def __init__(self) -> None:
+    super(_GatewayRoutingMixin, self).__init__()
+    self.__routing_lock = Lock()
+    self.__routing_stats = {}
+    self.__rr_weights = {}
+    return
+
+  @property
+  def _routing_policy(self):
+    policy = self.config_data.get(MSCT.ROUTING_POLICY, ROUTING_LEAST_OUTSTANDING).lower()
+    if policy not in ROUTING_POLICIES:
+      policy = ROUTING_LEAST_OUTSTANDING
+    return policy
+
+  def _get_server_class(self, server_name):
+    return self._servers.get(server_name, {}).get(MSCT.SERVER_CLASS, server_name)
+
+  def _get_replica_group(self, signature):
+    return [
+      svr for svr in list(self._servers)
+      if not self._servers.get(svr, {}).get(MSCT.SUPPORT, True) and self._get_server_class(svr) == signature
+    ]
+
+  def _is_server_live(self, server_name):
+    dct_server = self._servers.get(server_name)
+    if dct_server is None:
+      return False
+    return dct_server[MSCT.READY] and dct_server[MSCT.PROCESS].poll() is None
+
+  def _get_routing_weight(self, server_name):
+    return max(self._config_endpoints.get(server_name, {}).get(MSCT.ROUTING_WEIGHT, 1), 1e-3)
+
+  def _get_max_in_flight(self, server_name):
+    """
+    Calls above this limit are shed by the gateway without reaching the server. The limit is
+    only set when `MAX_QUEUE` is configured: what the workers execute at once plus the queue
+    """
+    config_endpoint = self._config_endpoints.get(server_name, {})
+    max_queue = config_endpoint.get(MSCT.MAX_QUEUE)
+    if max_queue is None:
+      return None
+    # autoscaled servers can grow up to `MAX_WORKERS`
+    nr_workers = config_endpoint.get(MSCT.MAX_WORKERS) or self._servers.get(server_name, {}).get(MSCT.NR_WORKERS) or 1
+    return nr_workers * config_endpoint.get(MSCT.MAX_BATCH_SIZE, 1) + max_queue
+
+  def _refresh_nr_workers(self, server_name, answer):
+    """
+    Keeps the `NR_WORKERS` used by `_get_max_in_flight` up to date with the answers of the server
+    `/update_workers` and `/server_status`
+    """
+    dct_server = self._servers.get(server_name)
+    if dct_server is not None and isinstance(answer, dict) and isinstance(answer.get(MSCT.NR_WORKERS), int):
+      dct_server[MSCT.NR_WORKERS] = answer[MSCT.NR_WORKERS]
+    return
+
+  def __get_stats(self, server_name):
+    if server_name not in self.__routing_stats:
+      self.__routing_stats[server_name] = {
+        'in_flight' : 0,
+        'ewma'      : None,
+        'requests'  : 0,
+        'errors'    : 0,
+        'shed'      : 0,
+        'rejected'  : 0,
+        'expired'   : 0,
+      }
+    return self.__routing_stats[server_name]
+
+  def __load_key(self, server_name):
+    stats = self.__get_stats(server_name)
+    ewma = stats['ewma'] if stats['ewma'] is not None else 0
+    return (stats['in_flight'] + 1) / self._get_routing_weight(server_name), ewma
+
+  def __select_round_robin(self, group_name, replicas):
+    # smooth weighted round robin: each replica gains its weight, the selected one pays the total
+    current = self.__rr_weights.setdefault(group_name, {})
+    total = 0
+    for svr in replicas:
+      weight = self._get_routing_weight(svr)
+      current[svr] = current.get(svr, 0) + weight
+      total += weight
+    #endfor
+    selected = max(replicas, key=lambda svr: current[svr])
+    current[selected] -= total
+    return selected
+
+  def _select_replica(self, group_name, replicas):
+    policy = self._routing_policy
+    with self.__routing_lock:
+      if len(replicas) == 1:
+        return replicas[0]
+      if policy == ROUTING_ROUND_ROBIN:
+        return self.__select_round_robin(group_name, replicas)
+      if policy == ROUTING_P2C:
+        replicas = random.sample(replicas, 2)
+      return min(replicas, key=self.__load_key)
+
+  def _route_request(self, signature, path):
+    """
+    Returns the name of the server that handles the call or None if the signature is unknown
+    """
+    group = []
+    # only the execution calls are balanced, other calls (notifications, status) target the given server
+    if path == self._server_execution_path:
+      group = self._get_replica_group(signature)
+    if len(group) == 0:
+      return signature if signature in self._servers else None
+    live = [svr for svr in group if self._is_server_live(svr)]
+    if len(live) == 0:
+      # the caller answers with the warmup or not responding message of the addressed server
+      return signature if signature in group else group[0]
+    return self._select_replica(signature, live)
+
+  def _routing_start(self, server_name, path=None):
+    """
+    Returns False if the execution call must be shed (the server is already at its limit)
+    """
+    max_in_flight = self._get_max_in_flight(server_name) if path == self._server_execution_path else None
+    with self.__routing_lock:
+      stats = self.__get_stats(server_name)
+      if max_in_flight is not None and stats['in_flight'] >= max_in_flight:
+        stats['shed'] += 1
+        return False
+      stats['in_flight'] += 1
+      stats['requests'] += 1
+    return True
+
+  def _routing_end(self, server_name, elapsed, error=False, status_code=None, path=None):
+    if path == self._server_execution_path:
+      status = str(status_code) if status_code == 504 or not error else 'error'
+      self._metrics_call_end(server_name, elapsed=elapsed, status=status)
+    with self.__routing_lock:
+      stats = self.__get_stats(server_name)
+      stats['in_flight'] -= 1
+      if status_code in [429, 503]:
+        # admission rejections of the server are fast answers so they do not count for the latency
+        stats['rejected'] += 1
+      elif status_code == 504:
+        # the client deadline passed (in the server or while the gateway was waiting)
+        stats['expired'] += 1
+      elif error:
+        stats['errors'] += 1
+      elif stats['ewma'] is None:
+        stats['ewma'] = elapsed
+      else:
+        stats['ewma'] = EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * stats['ewma']
+    return
+
+  def _get_overloaded_data(self, server_name):
+    return {
+      MSCT.ERROR : "Server '{}' is overloaded ({} calls in progress). Retry in {}s.".format(
+        server_name, self.__get_stats(server_name)['in_flight'], RETRY_AFTER_OVERLOAD
+      )
+    }
+
+  def _get_overloaded_response(self, server_name):
+    response = self.get_response(self._get_overloaded_data(server_name))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(RETRY_AFTER_OVERLOAD)
+    return response
+
+  def _get_routing_status(self):
+    with self.__routing_lock:
+      dct_servers = {
+        svr : {
+          **stats,
+          'ewma'   : round(stats['ewma'], 4) if stats['ewma'] is not None else None,
+          'weight' : self._get_routing_weight(svr),
+          'max_in_flight' : self._get_max_in_flight(svr),
+          'class'  : self._get_server_class(svr),
+        }
+        for svr, stats in self.__routing_stats.items()
+        if svr in self._servers
+      }
+    return {
+      'policy'  : self._routing_policy,
+      'servers' : dct_servers,
+    }
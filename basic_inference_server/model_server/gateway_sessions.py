@@ -0,0 +1,206 @@
+import socket
+import requests
+
+from functools import partial
+from threading import Lock
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib3.util.retry import Retry
+
+from .request_utils import MSCT
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 3
+DEFAULT_READ_TIMEOUT = None # model servers can take a while to respond so no default limit
+DEFAULT_MAX_RETRIES = 2
+
+
+class _UnixHTTPConnection(HTTPConnection):
+  def __init__(self, *args, unix_socket=None, **kwargs):
+    self._unix_socket = unix_socket
+    super(_UnixHTTPConnection, self).__init__(*args, **kwargs)
+    return
+
+  def _new_conn(self):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    if isinstance(self.timeout, (int, float)):
+      sock.settimeout(self.timeout)
+    try:
+      sock.connect(self._unix_socket)
+    except socket.timeout as exc:
+      sock.close()
+      raise ConnectTimeoutError(self, "Connection to {} timed out".format(self._unix_socket)) from exc
+    except OSError as exc:
+      sock.close()
+      raise NewConnectionError(self, "Failed to connect to {}: {}".format(self._unix_socket, exc)) from exc
+    return sock
+
+
+class _UnixHTTPConnectionPool(HTTPConnectionPool):
+  ConnectionCls = _UnixHTTPConnection
+
+
+class _UnixSocketAdapter(HTTPAdapter):
+  """
+  `requests` adapter that sends all the requests of the session to a Unix domain socket
+  """
+  def __init__(self, unix_socket, **kwargs):
+    self._unix_socket = unix_socket
+    super(_UnixSocketAdapter, self).__init__(**kwargs)
+    return
+
+  def init_poolmanager(self, *args, **kwargs):
+    super(_UnixSocketAdapter, self).init_poolmanager(*args, **kwargs)
+    self.poolmanager.pool_classes_by_scheme = {
+      'http' : partial(_UnixHTTPConnectionPool, unix_socket=self._unix_socket),
+    }
+    return
+
+
+class ServerSession(object):
+  """
+  Keep-alive HTTP session with a bounded connection pool towards one model server
+  listening on TCP (`base_url`) or on a Unix domain socket (`unix_socket`).
+  Only connection errors are retried (the request never reached the server) so
+  non-idempotent calls are never executed twice.
+  """
+  def __init__(self, base_url,
+               pool_size=DEFAULT_POOL_SIZE,
+               connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+               read_timeout=DEFAULT_READ_TIMEOUT,
+               max_retries=DEFAULT_MAX_RETRIES,
+               unix_socket=None,
+               ):
+    self.base_url = base_url
+    self.unix_socket = unix_socket
+    # the address of the server as displayed in status and error messages
+    self.address = 'unix://' + unix_socket if unix_socket is not None else base_url
+    self.pool_size = pool_size
+    self.timeout = (connect_timeout, read_timeout)
+
+    retries = Retry(
+      total=max_retries,
+      connect=max_retries,
+      read=0,
+      status=0,
+      other=0,
+      allowed_methods=None,
+      backoff_factor=0.1,
+      raise_on_status=False,
+    )
+    if unix_socket is None:
+      self._adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=retries,
+      )
+    else:
+      self._adapter = _UnixSocketAdapter(
+        unix_socket=unix_socket,
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=retries,
+      )
+    self._session = requests.Session()
+    self._session.mount('http://', self._adapter)
+
+    self._lock = Lock()
+    self._in_use = 0
+    self._max_in_use = 0
+    self._nr_requests = 0
+    self._nr_errors = 0
+    return
+
+  def request(self, method, path, **kwargs):
+    kwargs.setdefault('timeout', self.timeout)
+    with self._lock:
+      self._in_use += 1
+      self._nr_requests += 1
+      self._max_in_use = max(self._max_in_use, self._in_use)
+    try:
+      return self._session.request(method, self.base_url + path, **kwargs)
+    except:
+      with self._lock:
+        self._nr_errors += 1
+      raise
+    finally:
+      with self._lock:
+        self._in_use -= 1
+
+  def get(self, path, **kwargs):
+    return self.request('GET', path, **kwargs)
+
+  def post(self, path, **kwargs):
+    return self.request('POST', path, **kwargs)
+
+  def close(self):
+    self._session.close()
+    return
+
+  def get_status(self):
+    nr_connections, nr_pool_requests = 0, 0
+    pools = self._adapter.poolmanager.pools
+    for key in pools.keys():
+      pool = pools.get(key)
+      if pool is not None:
+        nr_connections += pool.num_connections
+        nr_pool_requests += pool.num_requests
+    #endfor
+    with self._lock:
+      in_use = self._in_use
+      max_in_use = self._max_in_use
+      nr_requests = self._nr_requests
+      nr_errors = self._nr_errors
+    return {
+      'pool_size'   : self.pool_size,
+      'in_use'      : in_use,
+      'max_in_use'  : max_in_use,
+      'requests'    : nr_requests,
+      'errors'      : nr_errors,
+      # each new connection is a pool miss, all other requests reused a kept-alive socket
+      'pool_misses' : nr_connections,
+      'pool_hits'   : max(nr_pool_requests - nr_connections, 0),
+    }
+
+
+class _GatewaySessionsMixin(object):
+  def __init__(self) -> None:
+    super(_GatewaySessionsMixin, self).__init__()
+    return
+
+  def _create_server_session(self, server_name, host, port, unix_socket=None):
+    config_endpoint = self._config_endpoints.get(server_name, {})
+    session = ServerSession(
+      # the host is only used for the `Host` header when the server listens on a unix socket
+      base_url='http://{}:{}'.format(host, port) if unix_socket is None else 'http://localhost',
+      unix_socket=unix_socket,
+      pool_size=config_endpoint.get(MSCT.POOL_SIZE, DEFAULT_POOL_SIZE),
+      connect_timeout=config_endpoint.get(MSCT.CONNECT_TIMEOUT, DEFAULT_CONNECT_TIMEOUT),
+      read_timeout=config_endpoint.get(MSCT.READ_TIMEOUT, DEFAULT_READ_TIMEOUT),
+      max_retries=config_endpoint.get(MSCT.MAX_RETRIES, DEFAULT_MAX_RETRIES),
+    )
+    self.P("  Created connection pool for '{}' on {} (size: {}, timeouts: {})".format(
+      server_name, session.address, session.pool_size, session.timeout
+    ))
+    return session
+
+  def _close_server_session(self, server_name):
+    session = self._servers.get(server_name, {}).get(MSCT.SESSION)
+    if session is not None:
+      session.close()
+      self.P("  Closed connection pool for '{}'".format(server_name))
+    return
+
+  def _get_server_session(self, server_name):
+    return self._servers[server_name].get(MSCT.SESSION)
+
+  def _get_sessions_status(self):
+    dct_servers = dict(self._servers)
+    return {
+      svr : dct_servers[svr][MSCT.SESSION].get_status()
+      for svr in dct_servers
+      if dct_servers[svr].get(MSCT.SESSION) is not None
+    }
@@ -16,6 +16,8 @@ MONITORED_PACKAGES = [
   'python-telegram-bot',  
 ]
 
+STATUS_TIMEOUT = (0.5, 2)
+
 
 def _get_packages(monitored_packages=None):
   import pkg_resources
@@ -40,6 +42,21 @@ class _GatewaySupportMixin(object):
     self.__support_status = {}
     return
 
+  def _get_servers_status(self):
+    dct_servers = {}
+    for svr in list(self._servers):
+      session = self._servers.get(svr, {}).get(MSCT.SESSION)
+      if session is None or not self._is_server_ready(svr):
+        continue
+      try:
+        dct_servers[svr] = session.get(MSCT.RULE_SERVER_STATUS, timeout=STATUS_TIMEOUT).json()
+      except Exception:
+        continue
+      # the autoscaler changes the number of workers as well
+      self._refresh_nr_workers(svr, dct_servers[svr])
+    #endfor
+    return dct_servers
+
   def _get_system_status(self, display=True):
     mem_total = round(self.log.get_machine_memory(gb=True),2)
     mem_avail = round(self.log.get_avail_memory(gb=True),2)
@@ -50,7 +67,7 @@ class _GatewaySupportMixin(object):
     mem_servers = 0
     dct_servers = {
     }
-    for svr in self._servers:
+    for svr in list(self._servers):
       proc = psutil.Process(self._servers[svr][MSCT.PROCESS].pid)
       proc_mem = round(proc.memory_info().rss / (1024**3), 2)
       mem_servers += proc_mem
@@ -67,6 +84,47 @@ class _GatewaySupportMixin(object):
     self.P("  Disk free:   {:>5.1f} GB".format(disk_avail), color='g')
     self.P("  Disk total:  {:>5.1f} GB".format(disk_total), color='g')
     
+    dct_pools = self._get_sessions_status()
+    for svr, dct_pool in dct_pools.items():
+      self.P("  Pool '{}': in use {}/{}, hits: {}, misses: {}, errors: {}".format(
+        svr, dct_pool['in_use'], dct_pool['pool_size'], 
+        dct_pool['pool_hits'], dct_pool['pool_misses'], dct_pool['errors']
+      ), color='g')
+    
+    dct_servers_status = self._get_servers_status()
+    dct_shared = {
+      svr : dct_status[MSCT.SHARED_MODEL] for svr, dct_status in dct_servers_status.items()
+      if MSCT.SHARED_MODEL in dct_status
+    }
+    dct_caches = {
+      svr : dct_status[MSCT.CACHE] for svr, dct_status in dct_servers_status.items()
+      if MSCT.CACHE in dct_status
+    }
+    dct_autoscale = {
+      svr : dct_status[MSCT.AUTOSCALE] for svr, dct_status in dct_servers_status.items()
+      if MSCT.AUTOSCALE in dct_status
+    }
+    mem_saved = round(sum(x['saved_mb'] for x in dct_shared.values()) / 1024, 2)
+    for svr, dct_model in dct_shared.items():
+      self.P("  Shared model '{}': {:.1f} MB used by {} workers, saved {:.1f} MB".format(
+        svr, dct_model['size_mb'], dct_model['workers'], dct_model['saved_mb'],
+      ), color='g')
+    for svr, dct_cache in dct_caches.items():
+      self.P("  Cache '{}': {}/{} answers, hits: {}, misses: {}, evictions: {}".format(
+        svr, dct_cache['size'], dct_cache['max_size'],
+        dct_cache['hits'], dct_cache['misses'], dct_cache['evictions'],
+      ), color='g')
+    for svr, dct_scale in dct_autoscale.items():
+      self.P("  Autoscale '{}': {} workers ({}-{}), scale up: {}, scale down: {}".format(
+        svr, dct_scale['workers'], dct_scale['min_workers'], dct_scale['max_workers'],
+        dct_scale['scale_up'], dct_scale['scale_down'],
+      ), color='g')
+    dct_fork_server = self._fork_server.get_status() if self._fork_server is not None else None
+    if dct_fork_server is not None:
+      self.P("  Fork server pid {}: spawned {} servers, avg spawn {} ms".format(
+        dct_fork_server['pid'], dct_fork_server['spawned'], dct_fork_server['spawn_ms'],
+      ), color='g')
+    
     mem_alert = (mem_avail / mem_total) < MSCT.MEM_ALERT_THR
     disk_alert = (disk_avail / disk_total) < MSCT.DISK_ALERT_THR
     
@@ -96,6 +154,13 @@ class _GatewaySupportMixin(object):
       monitored_packages=_get_packages(monitored_packages=MONITORED_PACKAGES),
       info='Memory Size is in GB. Total and avail mem may be reported inconsistently in containers.',
       system_support_services=self.__support_status,
+      connection_pools=dct_pools,
+      shared_models=dct_shared,
+      mem_saved=mem_saved,
+      response_caches=dct_caches,
+      autoscale=dct_autoscale,
+      routing=self._get_routing_status(),
+      fork_server=dct_fork_server,
     )
     return dct_stats, dct_system_alert  
   
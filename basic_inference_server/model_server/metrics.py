@@ -0,0 +1,204 @@
+import os
+import psutil
+
+from bisect import bisect_left
+from threading import Lock
+
+CONTENT_TYPE_METRICS = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds, from sub-millisecond proxy overheads up to slow model calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None):
+  pairs = list(zip(names, values))
+  if extra is not None:
+    pairs.append(extra)
+  if len(pairs) == 0:
+    return ''
+  str_pairs = [
+    '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+    for k, v in pairs
+  ]
+  return '{' + ','.join(str_pairs) + '}'
+
+
+class _Metric(object):
+  """
+  Base of the metrics: the values are updated by the request threads or, if `func` is given,
+  read when the metrics are scraped from `func`, a callable that returns a list of
+  `(label_values, value)`
+  """
+  kind = None
+
+  def __init__(self, name, documentation, labels=(), func=None):
+    self.name = name
+    self.documentation = documentation
+    self.labels = tuple(labels)
+    self._func = func
+    # each metric has its own lock so updates never wait for the logger or for other metrics
+    self._lock = Lock()
+    self._values = {}
+    return
+
+  def _samples(self):
+    if self._func is not None:
+      items = self._func()
+    else:
+      with self._lock:
+        items = list(self._values.items())
+    return [('', tuple(label_values), None, value) for label_values, value in items]
+
+  def render(self):
+    lines = [
+      '# HELP {} {}'.format(self.name, self.documentation),
+      '# TYPE {} {}'.format(self.name, self.kind),
+    ]
+    for suffix, label_values, extra, value in self._samples():
+      lines.append('{}{}{} {}'.format(
+        self.name, suffix, _format_labels(self.labels, label_values, extra), _format_value(value)
+      ))
+    return lines
+
+
+class Counter(_Metric):
+  kind = 'counter'
+
+  def inc(self, *label_values, amount=1):
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+    return
+
+
+class Gauge(_Metric):
+  kind = 'gauge'
+
+  def set(self, value, *label_values):
+    with self._lock:
+      self._values[label_values] = value
+    return
+
+  def inc(self, *label_values, amount=1):
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+    return
+
+  def dec(self, *label_values, amount=1):
+    self.inc(*label_values, amount=-amount)
+    return
+
+
+class Histogram(_Metric):
+  """
+  Fixed buckets histogram: each observation increments a single bucket so the cumulative
+  counts are only computed when the metrics are scraped
+  """
+  kind = 'histogram'
+
+  def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    super(Histogram, self).__init__(name, documentation, labels)
+    self.buckets = tuple(sorted(buckets))
+    return
+
+  def observe(self, value, *label_values):
+    idx = bisect_left(self.buckets, value)
+    with self._lock:
+      item = self._values.get(label_values)
+      if item is None:
+        # per bucket counts (the last one is +Inf), sum
+        item = [[0] * (len(self.buckets) + 1), 0]
+        self._values[label_values] = item
+      item[0][idx] += 1
+      item[1] += value
+    return
+
+  def _samples(self):
+    with self._lock:
+      items = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+    samples = []
+    for label_values, counts, total in items:
+      cumulative = 0
+      for upper, count in zip(self.buckets + (float('inf'),), counts):
+        cumulative += count
+        samples.append(('_bucket', label_values, ('le', _format_value(float(upper))), cumulative))
+      #endfor
+      samples.append(('_sum', label_values, None, round(total, 6)))
+      samples.append(('_count', label_values, None, cumulative))
+    #endfor
+    return samples
+
+
+class MetricsRegistry(object):
+  """
+  In-memory metrics rendered in the Prometheus text exposition format by `render`
+  """
+  def __init__(self):
+    self._metrics = []
+    return
+
+  def _register(self, metric):
+    self._metrics.append(metric)
+    return metric
+
+  def counter(self, name, documentation, labels=(), func=None):
+    return self._register(Counter(name, documentation, labels, func=func))
+
+  def gauge(self, name, documentation, labels=(), func=None):
+    return self._register(Gauge(name, documentation, labels, func=func))
+
+  def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return self._register(Histogram(name, documentation, labels, buckets=buckets))
+
+  def add_process_metrics(self, include_children=False):
+    """
+    Adds the memory and cpu of the current process (and of its child processes, e.g. the
+    worker processes of a server)
+    """
+    process = psutil.Process(os.getpid())
+
+    def _get_processes():
+      lst_processes = [process]
+      if include_children:
+        try:
+          lst_processes += process.children(recursive=True)
+        except psutil.Error:
+          pass
+      return lst_processes
+
+    def _sum(func):
+      total = 0
+      for proc in _get_processes():
+        try:
+          total += func(proc)
+        except psutil.Error:
+          # a child process ended meanwhile
+          continue
+      return total
+
+    self.gauge(
+      'process_resident_memory_bytes', 'Resident memory size in bytes',
+      func=lambda: [((), _sum(lambda proc: proc.memory_info().rss))],
+    )
+    self.counter(
+      'process_cpu_seconds_total', 'Total user and system CPU time spent in seconds',
+      func=lambda: [((), round(_sum(lambda proc: sum(proc.cpu_times()[:2])), 3))],
+    )
+    self.gauge(
+      'process_num_threads', 'Number of OS threads',
+      func=lambda: [((), _sum(lambda proc: proc.num_threads()))],
+    )
+    return
+
+  def render(self):
+    lines = []
+    for metric in self._metrics:
+      lines += metric.render()
+    return '\n'.join(lines) + '\n'
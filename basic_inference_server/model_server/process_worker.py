@@ -0,0 +1,347 @@
+"""
+Copyright (C) 2017-2021 Andrei Damian, andrei.damian@me.com,  All rights reserved.
+
+This software and its associated documentation are the exclusive property of the creator.
+Unauthorized use, copying, or distribution of this software, or any portion thereof,
+is strictly prohibited.
+
+Parts of this software are licensed and used in software developed by Neural Energy SRL.
+Any software proprietary to Neural Energy SRL is covered by Romanian and  Foreign Patents,
+patents in process, and are protected by trade secret or copyright law.
+
+Dissemination of this information or reproduction of this material is strictly forbidden unless prior
+written permission from the author.
+
+"""
+import os
+import gc
+import importlib
+import multiprocessing as mp
+
+from threading import Lock, Thread
+from time import sleep
+
+from .stream_utils import ClosingStream, PREDICT_STREAM, is_stream_answer
+
+DEFAULT_START_METHOD = 'spawn'
+PARENT_CHECK_INTERVAL = 1
+
+class CMD:
+  READY = 'READY'
+  FAILED = 'FAILED'
+  EXECUTE = 'EXECUTE'
+  EXECUTE_BATCH = 'EXECUTE_BATCH'
+  STREAM = 'STREAM'
+  CHUNK = 'CHUNK'
+  END = 'END'
+  NOTIFICATIONS = 'NOTIFICATIONS'
+  STOP = 'STOP'
+
+
+def _serve_control(conn, worker):
+  # runs in a separate thread of the child so notifications can be read while the worker is busy
+  while True:
+    try:
+      cmd, data = conn.recv()
+    except (EOFError, OSError):
+      break
+    if cmd == CMD.NOTIFICATIONS:
+      conn.send(worker.get_notifications(since=data))
+  #endwhile
+  return
+
+
+def _exit_with_parent(parent_pid):
+  # a forked child inherits the server ends of its own pipe and of the pipes of the workers forked
+  # before it, so it never sees EOF if the server is killed: it exits when its parent is gone
+  while os.getppid() == parent_pid:
+    sleep(PARENT_CHECK_INTERVAL)
+  os._exit(0)
+  return
+
+
+def _get_error_answer(worker, log, cmd):
+  # same answer as an exception caught by the worker in its own stages (see `FlaskWorker`)
+  err_type, err_file, err_func, err_line, err_msg = log.get_error_info(return_err_val=True)
+  log.P("Worker process {}:{} failed on {}: {}".format(
+    worker.__class__.__name__, worker._worker_id, cmd, err_msg), color='r'
+  )
+  err_dict = {
+    'ERR_TYPE' : err_type,
+    'ERR_MSG' : err_msg,
+    'ERR_FILE' : err_file,
+    'ERR_FUNC' : err_func,
+    'ERR_LINE' : err_line
+  }
+  return {'{}_ERROR'.format(worker.__class__.__name__) : err_dict}
+
+
+def _process_worker_main(conn, ctrl_conn, worker_params, log_params, shared_model=None):
+  """
+  Entry point of the child process: creates its own logger, loads the worker (thus
+  running `_load_model` only once) and then serves requests received over the pipe.
+  The child exits when the server process closes (or loses) its pipe end or when it dies.
+  `shared_model` is only received with the `fork` start method (inherited, not pickled);
+  otherwise the child has to load its own copy.
+  """
+  from ..public_logger import Logger
+
+  # a forked child starts with the gc disabled by `ProcessWorker._start_process` (the objects
+  # inherited from the server stay frozen)
+  gc.enable()
+  Thread(target=_exit_with_parent, args=(mp.parent_process().pid,), daemon=True).start()
+
+  # same logger class as the server (e.g. `SlimLogger`)
+  log_params = dict(log_params)
+  logger_class = log_params.pop('logger_class', None) or Logger
+  log = logger_class(**log_params)
+  try:
+    module = importlib.import_module(worker_params['module_name'])
+    cls_def = getattr(module, worker_params['class_name'])
+    if shared_model is None and cls_def.has_shared_model():
+      shared_model = cls_def._load_shared_model(log=log, config=worker_params['shared_config'])
+    worker = cls_def(
+      log=log,
+      default_config=worker_params['default_config'],
+      verbosity_level=worker_params['verbosity_level'],
+      worker_id=worker_params['worker_id'],
+      upstream_config=worker_params['upstream_config'],
+      shared_model=shared_model,
+    )
+  except Exception as exc:
+    log.P("Worker process failed to start: {}".format(exc), color='r')
+    conn.send((CMD.FAILED, str(exc)))
+    return
+
+  Thread(target=_serve_control, args=(ctrl_conn, worker), daemon=True).start()
+  conn.send((CMD.READY, None))
+
+  while True:
+    try:
+      cmd, payload = conn.recv()
+    except (EOFError, OSError):
+      break
+    if cmd == CMD.STOP:
+      worker.shutdown()
+      break
+    # a request that fails (e.g. bad `BASE64_KEYS`) gets an error answer: the process and its model
+    # must not be restarted because of a single request
+    streaming = False
+    try:
+      if cmd == CMD.EXECUTE:
+        result = worker.execute(**payload)
+        if is_stream_answer(result):
+          # generators cannot be pickled so the chunks follow the answer header one by one
+          chunks = result.pop(PREDICT_STREAM)
+          conn.send((CMD.STREAM, result))
+          streaming = True
+          for chunk in chunks:
+            conn.send((CMD.CHUNK, chunk))
+          result = (CMD.END, None)
+      elif cmd == CMD.EXECUTE_BATCH:
+        result = worker.execute_batch(**payload)
+      else:
+        result = None
+      conn.send(result)
+    except Exception:
+      error_answer = _get_error_answer(worker, log, cmd)
+      try:
+        if streaming:
+          # the error ends the stream as an error chunk
+          conn.send((CMD.CHUNK, error_answer))
+          conn.send((CMD.END, None))
+        elif cmd == CMD.EXECUTE_BATCH:
+          conn.send([error_answer for _ in payload['lst_inputs']])
+        else:
+          conn.send(error_answer)
+      except (EOFError, OSError):
+        # the server end of the pipe is gone
+        break
+    #endtry
+  #endwhile
+  log.flush_log()
+  return
+
+
+class ProcessWorker(object):
+  """
+  Server side proxy for a `FlaskWorker` hosted in a child process. Exposes the same
+  `execute` / `execute_batch` / `get_notifications` interface as the worker so the server
+  handles thread and process workers in the same way.
+  """
+  def __init__(self, log, worker_params, log_params, start_method=None, shared_model=None):
+    self.log = log
+    self.worker_class_name = worker_params['class_name']
+    self._worker_id = worker_params['worker_id']
+    self._worker_params = worker_params
+    self._log_params = log_params
+    self._start_method = start_method or DEFAULT_START_METHOD
+    self._ctx = mp.get_context(self._start_method)
+    # only a forked child can inherit the shared model, any other start method would pickle a copy
+    self._shared_model = shared_model if self._start_method == 'fork' else None
+    self._lock = Lock()
+    self._ctrl_lock = Lock()
+    self._process = None
+    self._conn = None
+    self._ctrl_conn = None
+    self._ready = False
+    self._streaming = False
+    # sequence id of the last notification read from the child
+    self._notif_since = 0
+    self._start_process()
+    return
+
+  @property
+  def worker_id(self):
+    return self.log.host_id + ":" + str(self._worker_id)
+
+  @property
+  def pid(self):
+    return self._process.pid if self._process is not None else None
+
+  def _start_process(self):
+    conn, child_conn = self._ctx.Pipe()
+    ctrl_conn, child_ctrl_conn = self._ctx.Pipe()
+    self._process = self._ctx.Process(
+      target=_process_worker_main,
+      args=(child_conn, child_ctrl_conn, self._worker_params, self._log_params, self._shared_model),
+      name='{}:{}'.format(self.worker_class_name, self._worker_id),
+      daemon=True,
+    )
+    is_fork = self._start_method == 'fork'
+    if is_fork:
+      # the forked child sees the objects allocated so far in a permanent generation so its gc does
+      # not write to (and thus copy) their pages - e.g. the shared model. The child re-enables the
+      # gc while the server unfreezes right after the fork so its own garbage is still collected
+      gc.disable()
+      gc.freeze()
+    try:
+      self._process.start()
+    finally:
+      if is_fork:
+        gc.unfreeze()
+        gc.enable()
+    #endtry
+    # close our copy of the child ends so that the child sees EOF if the server dies
+    child_conn.close()
+    child_ctrl_conn.close()
+    self._conn = conn
+    self._ctrl_conn = ctrl_conn
+    self._ready = False
+    return
+
+  def wait_ready(self):
+    with self._lock:
+      return self._ensure_ready()
+
+  def _ensure_ready(self):
+    if self._process is None or not self._process.is_alive():
+      self.log.P("Worker process {}:{} is not alive. Restarting...".format(
+        self.worker_class_name, self._worker_id), color='r'
+      )
+      self._start_process()
+    if not self._ready:
+      status, msg = self._conn.recv()
+      if status != CMD.READY:
+        raise ValueError("Worker process {}:{} failed to start: {}".format(
+          self.worker_class_name, self._worker_id, msg
+        ))
+      self._ready = True
+    return True
+
+  def _call(self, cmd, payload):
+    with self._lock:
+      try:
+        self._ensure_ready()
+        self._conn.send((cmd, payload))
+        result = self._conn.recv()
+      except Exception as exc:
+        self._ready = False
+        msg = "Worker process {}:{} failed on {}: {}".format(self.worker_class_name, self._worker_id, cmd, exc)
+        self.log.P(msg, color='r')
+        result = None
+    return result
+
+  def _recv_stream(self):
+    """
+    Yields the chunks sent by the child. The server holds this worker until the stream is closed
+    so no other call uses the pipe meanwhile.
+    """
+    try:
+      while self._streaming:
+        cmd, chunk = self._conn.recv()
+        if cmd == CMD.END:
+          self._streaming = False
+          break
+        yield chunk
+      #endwhile
+    except (EOFError, OSError) as exc:
+      self._streaming = False
+      self._ready = False
+      self.log.P("Worker process {}:{} failed while streaming: {}".format(
+        self.worker_class_name, self._worker_id, exc), color='r'
+      )
+      yield self._error_answer()
+    return
+
+  def _drain_stream(self):
+    # if the client leaves early the remaining chunks are read so that the next call does not get them
+    while self._streaming:
+      try:
+        self._streaming = self._conn.recv()[0] != CMD.END
+      except Exception:
+        self._streaming = False
+        self._ready = False
+    #endwhile
+    return
+
+  def _error_answer(self):
+    return {'{}_ERROR'.format(self.worker_class_name) : 'Worker process failure'}
+
+  def execute(self, inputs, counter, deadline=None, stream=False):
+    answer = self._call(CMD.EXECUTE, dict(inputs=inputs, counter=counter, deadline=deadline, stream=stream))
+    if answer is None:
+      answer = self._error_answer()
+    elif isinstance(answer, tuple) and answer[0] == CMD.STREAM:
+      self._streaming = True
+      answer = {**answer[1], PREDICT_STREAM : ClosingStream(self._recv_stream(), on_close=self._drain_stream)}
+    return answer
+
+  def execute_batch(self, lst_inputs, lst_counters, deadline=None):
+    # the deadline is absolute (wall clock) so it holds in the child process as well
+    lst_answers = self._call(
+      CMD.EXECUTE_BATCH, dict(lst_inputs=lst_inputs, lst_counters=lst_counters, deadline=deadline)
+    )
+    if lst_answers is None:
+      lst_answers = [self._error_answer() for _ in lst_inputs]
+    return lst_answers
+
+  def get_notifications(self):
+    """
+    Returns the notifications of the child created since the previous call
+    """
+    if not self._ready:
+      return []
+    with self._ctrl_lock:
+      try:
+        self._ctrl_conn.send((CMD.NOTIFICATIONS, self._notif_since))
+        lst = self._ctrl_conn.recv()
+      except Exception:
+        lst = []
+      if len(lst) > 0:
+        self._notif_since = lst[-1]['SEQ']
+    #endwith
+    return lst
+
+  def shutdown(self, timeout=5):
+    with self._lock:
+      try:
+        self._conn.send((CMD.STOP, None))
+      except Exception:
+        pass
+      self._process.join(timeout)
+      if self._process.is_alive():
+        self._process.terminate()
+      self._conn.close()
+      self._ctrl_conn.close()
+    return
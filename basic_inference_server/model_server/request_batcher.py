@@ -0,0 +1,163 @@
+from collections import deque
+from threading import Lock, Condition, Event
+from time import perf_counter
+
+from .admission_control import DeadlineExceeded, is_expired
+
+DEFAULT_BATCH_WINDOW_MS = 5
+
+
+class _BatchItem(object):
+  def __init__(self, data, counter, deadline=None):
+    self.data = data
+    self.counter = counter
+    self.deadline = deadline
+    self.event = Event()
+    self.is_leader = False
+    self.result = None
+    self.error = None
+    self.done = False
+    return
+
+
+class RequestBatcher(object):
+  """
+  Groups the requests that arrive within a short window (at most `max_batch_size`) so that
+  they can be predicted in a single worker call.
+
+  There is no dispatcher thread: the first request of a batch acts as leader - it waits
+  for the window to close (or the batch to fill up), runs `execute_batch_func` and delivers
+  the answers to the other requests of the batch. If more requests are pending, the
+  oldest one becomes the leader of the next batch.
+  """
+  def __init__(self, execute_batch_func, max_batch_size, batch_window_ms=None):
+    """
+    Parameters:
+    -----------
+    execute_batch_func: callable, mandatory
+      `func(lst_data, lst_counters, deadline)` that returns `(worker, lst_answers, wid)`
+
+    max_batch_size: int, mandatory
+      Max number of requests in a batch
+
+    batch_window_ms: int, optional
+      How long the leader waits for other requests. The default is None (5ms)
+    """
+    if batch_window_ms is None:
+      batch_window_ms = DEFAULT_BATCH_WINDOW_MS
+    self._execute_batch_func = execute_batch_func
+    self._max_batch_size = max_batch_size
+    self._batch_window = batch_window_ms / 1000
+
+    self._lock = Lock()
+    self._cond = Condition(self._lock)
+    self._pending = deque()
+
+    self._nr_batches = 0
+    self._nr_batched_requests = 0
+    self._max_seen_batch = 0
+    self._nr_expired = 0
+    return
+
+  def submit(self, data, counter, deadline=None):
+    """
+    Blocks until the request is executed as part of a batch and returns `(worker, answer, wid)`.
+    Raises `DeadlineExceeded` if the deadline passed before the batch of the request started.
+    """
+    item = _BatchItem(data=data, counter=counter, deadline=deadline)
+    with self._cond:
+      self._pending.append(item)
+      if len(self._pending) == 1:
+        item.is_leader = True
+      elif len(self._pending) >= self._max_batch_size:
+        self._cond.notify_all()
+      #endif
+    #endwith
+
+    while not item.done:
+      if item.is_leader:
+        self._lead()
+      else:
+        item.event.wait()
+        item.event.clear()
+      #endif
+    #endwhile
+    if item.error is not None:
+      # the batch failed (the leader raised the error from `_lead`) or the request expired before it
+      raise item.error
+    return item.result
+
+  def _lead(self):
+    window_end = perf_counter() + self._batch_window
+    with self._cond:
+      while len(self._pending) < self._max_batch_size:
+        remaining = window_end - perf_counter()
+        if remaining <= 0:
+          break
+        self._cond.wait(remaining)
+      #endwhile
+      batch = [self._pending.popleft() for _ in range(min(len(self._pending), self._max_batch_size))]
+      if len(self._pending) > 0:
+        next_leader = self._pending[0]
+        next_leader.is_leader = True
+        next_leader.event.set()
+      #endif
+      self._nr_batches += 1
+      self._nr_batched_requests += len(batch)
+      self._max_seen_batch = max(self._max_seen_batch, len(batch))
+      # expired requests are dropped before they take a slot in the worker call
+      expired = [x for x in batch if is_expired(x.deadline)]
+      self._nr_expired += len(expired)
+    #endwith
+
+    for item in expired:
+      item.error = DeadlineExceeded("Deadline exceeded while waiting for the batch")
+      item.is_leader = False
+      item.done = True
+      item.event.set()
+    #endfor
+    batch = [x for x in batch if not x.done]
+    if len(batch) == 0:
+      return
+    # no deadline if any of the requests has none
+    lst_deadlines = [x.deadline for x in batch]
+    deadline = None if None in lst_deadlines else max(lst_deadlines)
+
+    worker, lst_answers, wid, error = None, [None] * len(batch), -1, None
+    try:
+      worker, lst_answers, wid = self._execute_batch_func(
+        [x.data for x in batch],
+        [x.counter for x in batch],
+        deadline,
+      )
+    except Exception as exc:
+      error = exc
+      raise
+    finally:
+      # followers must be released even if the batch failed
+      for item, answer in zip(batch, lst_answers):
+        item.result = (worker, answer, wid)
+        item.error = error
+        item.is_leader = False
+        item.done = True
+        item.event.set()
+      #endfor
+    #endtry
+    return
+
+  @property
+  def max_batch_size(self):
+    return self._max_batch_size
+
+  def get_status(self):
+    with self._lock:
+      return {
+        'max_batch_size'  : self._max_batch_size,
+        'batch_window_ms' : round(self._batch_window * 1000, 1),
+        'batches'         : self._nr_batches,
+        'requests'        : self._nr_batched_requests,
+        'mean_batch_size' : round(self._nr_batched_requests / max(self._nr_batches, 1), 2),
+        'max_seen_batch'  : self._max_seen_batch,
+        'pending'         : len(self._pending),
+        'expired'         : self._nr_expired,
+      }
@@ -15,7 +15,9 @@ written permission from the author.
 """
 
 import traceback
+from time import time
 from ..public_logger import Logger
+from .tensor_codec import is_tensor_content, decode_tensors
 import os
 
 class MSCT:
@@ -25,6 +27,8 @@ class MSCT:
   SERVER_NAME = 'SERVER_NAME'
   
   SIGNATURE = 'SIGNATURE'
+  SIGNATURE_HEADER = 'X-Signature'
+  PASSTHROUGH = 'PASSTHROUGH'
   
   PROCESS = 'PROCESS'
   DISABLED = 'DISABLED'
@@ -48,17 +52,76 @@ class MSCT:
   UPTIME = 'UPTIME'
   START = 'START'
   SUPPORT = 'SUPPORT'
+  SESSION = 'SESSION'
+  READY = 'READY'
+  
+  POOL_SIZE = 'POOL_SIZE'
+  CONNECT_TIMEOUT = 'CONNECT_TIMEOUT'
+  READ_TIMEOUT = 'READ_TIMEOUT'
+  MAX_RETRIES = 'MAX_RETRIES'
+  
+  MAX_BATCH_SIZE = 'MAX_BATCH_SIZE'
+  BATCH_WINDOW_MS = 'BATCH_WINDOW_MS'
+  
+  EXECUTION_MODE = 'EXECUTION_MODE'
+  EXECUTION_MODE_THREAD = 'thread'
+  EXECUTION_MODE_PROCESS = 'process'
+  PROCESS_START_METHOD = 'PROCESS_START_METHOD'
+  SHARED_MODEL = 'SHARED_MODEL'
+  CACHE = 'CACHE'
+  CACHE_SIZE = 'CACHE_SIZE'
+  CACHE_TTL = 'CACHE_TTL'
+  CACHE_KEY_FIELDS = 'CACHE_KEY_FIELDS'
+  COALESCE_REQUESTS = 'COALESCE_REQUESTS'
+  COALESCING = 'COALESCING'
+  ROUTING_POLICY = 'ROUTING_POLICY'
+  ROUTING_WEIGHT = 'ROUTING_WEIGHT'
+  TRANSPORT = 'TRANSPORT'
+  TRANSPORT_TCP = 'tcp'
+  TRANSPORT_UDS = 'uds'
+  UNIX_SOCKET = 'UNIX_SOCKET'
+  MAX_QUEUE = 'MAX_QUEUE'
+  MAX_WAIT_MS = 'MAX_WAIT_MS'
+  ADMISSION = 'ADMISSION'
+  DEADLINE_MS = 'DEADLINE_MS'
+  DEADLINE_HEADER = 'X-Deadline-Ms'
+  EXPIRED = 'EXPIRED'
+  MIN_WORKERS = 'MIN_WORKERS'
+  MAX_WORKERS = 'MAX_WORKERS'
+  AUTOSCALE_INTERVAL = 'AUTOSCALE_INTERVAL'
+  AUTOSCALE_WAIT_MS = 'AUTOSCALE_WAIT_MS'
+  AUTOSCALE_IDLE_WINDOWS = 'AUTOSCALE_IDLE_WINDOWS'
+  AUTOSCALE_MIN_AVAIL_MEM = 'AUTOSCALE_MIN_AVAIL_MEM'
+  SCALE_DOWN_TIMEOUT = 'SCALE_DOWN_TIMEOUT'
+  AUTOSCALE = 'AUTOSCALE'
+  FULL_LOGGER = 'FULL_LOGGER'
+  FORK_SERVER = 'FORK_SERVER'
+  FORK_SERVER_PRELOAD = 'FORK_SERVER_PRELOAD'
+  NOTIFICATIONS_LEVEL = 'NOTIFICATIONS_LEVEL'
+  NOTIFICATIONS_SAMPLING = 'NOTIFICATIONS_SAMPLING'
+  REQUEST_NOTIFICATIONS = 'REQUEST_NOTIFICATIONS'
+  # stage durations added by the worker to its answer, removed by the server
+  STAGE_TIMES = '_stage_times'
   
   SYSTEM_STATUS = 'SYSTEM_STATUS'
   SYSTEM_ALERTS = 'SYSTEM_ALERTS'
   SYSTEM_HISTORY = 'SYSTEM_HISTORY'
   
+  WORKER_POOL = 'WORKER_POOL'
+  BATCHING = 'BATCHING'
+  
   DEFAULT_SERVER = 'DEFAULT_SERVER'
   AVAIL_SERVERS = 'AVAIL_SERVERS'
   
   NOTIF_NOTIFICATION_TYPE = 'NOTIFICATION_TYPE'
   NOTIF_MODULE = 'MODULE'
   NOTIF_TIME = 'TIMESTAMP'
+  NOTIF_SEQ = 'SEQ'
+  NOTIF_SINCE = 'since'
+  NOTIF_LAST_SEQ = 'LAST_SEQ'
+  NOTIF_MISSED = 'MISSED'
+  NOTIF_CALL_ID = 'CALL_ID'
+  LAST_EVENT_ID_HEADER = 'Last-Event-ID'
   
   DOWNLOAD_FILE_COMMAND = 'DOWNLOAD'  
   DOWNLOAD_FILE_PATH = 'DOWNLOAD_FILE_PATH'
@@ -75,19 +138,51 @@ class MSCT:
   RULE_RUN = '/run'
   RULE_UPDATE_WORKERS = '/update_workers'
   RULE_PATHS = '/get_paths'
+  RULE_SERVER_STATUS = '/server_status'
+  RULE_METRICS = '/metrics'
   
   KILL_CMD = 'SAFE_KILL_SERVER_CMD' 
   
   MEM_ALERT_THR = 0.15
   DISK_ALERT_THR = 0.10
 
+def get_request_deadline(headers, params):
+  """
+  Returns the absolute (`time()` based) deadline of a request that carries its budget in ms in the
+  `X-Deadline-Ms` header or in the `DEADLINE_MS` field (popped from `params`) or None
+  """
+  budget_ms = params.pop(MSCT.DEADLINE_MS, None) if isinstance(params, dict) else None
+  budget_ms = headers.get(MSCT.DEADLINE_HEADER, budget_ms)
+  if budget_ms is None:
+    return None
+  try:
+    return time() + float(budget_ms) / 1000
+  except (TypeError, ValueError):
+    return None
+
+
+def get_notifications_config(config):
+  """
+  Returns the `BaseObject.setup_notifications` arguments given in an endpoint configuration
+  """
+  return dict(
+    level=config.get(MSCT.NOTIFICATIONS_LEVEL),
+    sampling=config.get(MSCT.NOTIFICATIONS_SAMPLING),
+    request_notifications=config.get(MSCT.REQUEST_NOTIFICATIONS),
+  )
+
+
 def get_api_request_body(request, log : Logger, sender=None):
   params = {}
   try:
+    if is_tensor_content(request.headers):
+      # binary payload, the arrays are views on the request body
+      return decode_tensors(request.get_data())
+
     method = request.method
     args_data = request.args
     form_data = request.form
-    json_data = request.json
+    json_data = request.get_json(silent=True)
 
     if method == 'GET':
       # parameters in URL
@@ -0,0 +1,105 @@
+import json
+import hashlib
+import numpy as np
+
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from time import time
+
+
+def _key_default(obj):
+  # binary payloads carry numpy arrays: their (truncated) str is not a valid key
+  if isinstance(obj, np.ndarray):
+    return [obj.dtype.str, obj.shape, hashlib.sha1(np.ascontiguousarray(obj).view(np.uint8)).hexdigest()]
+  return str(obj)
+
+
+def get_request_key(data, key_fields=None):
+  """
+  Returns a stable hash of the canonical json of the request (all fields or only `key_fields`)
+  so the same payload gives the same key regardless of the order of its fields
+  """
+  if key_fields is not None:
+    data = {k : data.get(k) for k in key_fields}
+  str_data = json.dumps(data, sort_keys=True, separators=(',', ':'), default=_key_default)
+  return hashlib.sha1(str_data.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+  """
+  LRU cache with time-to-live for the answers of a `FlaskModelServer` keyed by `get_request_key`
+  """
+  def __init__(self, max_size, ttl=None, key_fields=None):
+    """
+    Parameters:
+    -----------
+    max_size: int, mandatory
+      Max number of cached answers. The least recently used answer is evicted when full
+
+    ttl: float, optional
+      Seconds after which an answer expires. The default is None (never expires)
+
+    key_fields: list, optional
+      The request fields used for the key. The default is None (all fields)
+    """
+    self._max_size = max_size
+    self._ttl = ttl
+    self._key_fields = key_fields
+
+    self._lock = Lock()
+    self._data = OrderedDict()
+
+    self._nr_hits = 0
+    self._nr_misses = 0
+    self._nr_evictions = 0
+    self._nr_expirations = 0
+    return
+
+  def make_key(self, data):
+    return get_request_key(data, key_fields=self._key_fields)
+
+  def get(self, key):
+    """
+    Returns a copy of the cached answer or None
+    """
+    with self._lock:
+      item = self._data.get(key)
+      if item is not None and self._ttl is not None and (time() - item[0]) > self._ttl:
+        del self._data[key]
+        self._nr_expirations += 1
+        item = None
+      if item is None:
+        self._nr_misses += 1
+        return None
+      self._data.move_to_end(key)
+      self._nr_hits += 1
+    #endwith
+    # callers add per-call fields to the answer so the cached object must not be shared
+    return deepcopy(item[1])
+
+  def put(self, key, answer):
+    answer = deepcopy(answer)
+    with self._lock:
+      self._data[key] = (time(), answer)
+      self._data.move_to_end(key)
+      while len(self._data) > self._max_size:
+        self._data.popitem(last=False)
+        self._nr_evictions += 1
+    #endwith
+    return
+
+  def get_status(self):
+    with self._lock:
+      nr_lookups = self._nr_hits + self._nr_misses
+      return {
+        'size'        : len(self._data),
+        'max_size'    : self._max_size,
+        'ttl'         : self._ttl,
+        'key_fields'  : self._key_fields,
+        'hits'        : self._nr_hits,
+        'misses'      : self._nr_misses,
+        'evictions'   : self._nr_evictions,
+        'expirations' : self._nr_expirations,
+        'hit_rate'    : round(self._nr_hits / max(nr_lookups, 1), 4),
+      }
@@ -9,8 +9,13 @@ import argparse
 import json
 
 import basic_inference_server as BIS
+from basic_inference_server.model_server.request_utils import MSCT
 
-if __name__ == '__main__':
+def main(argv=None):
+  """
+  Starts a `FlaskModelServer` (blocking). `argv` are the command line arguments, given when the
+  server is forked by the fork server instead of being started as a new interpreter
+  """
   print("run_server cwd: {}".format(cwd))
 
   parser = argparse.ArgumentParser()
@@ -77,7 +82,7 @@ if __name__ == '__main__':
     '--use_tf', action='store_true'
   )
 
-  args = parser.parse_args()
+  args = parser.parse_args(argv)
   base_folder = args.base_folder
   app_folder = args.app_folder
   config_endpoint = args.config_endpoint
@@ -96,7 +101,13 @@ if __name__ == '__main__':
   if microservice_code is None:
     microservice_code = BIS.Logger.name_abbreviation(microservice_name)
 
-  log = BIS.Logger(
+  # the servers use the slim logger unless the endpoint asks for the full one at startup
+  if (config_endpoint or {}).get(MSCT.FULL_LOGGER, False):
+    logger_class = BIS.Logger
+  else:
+    logger_class = BIS.SlimLogger
+
+  log = logger_class(
     lib_name=microservice_code,
     host_id=host_id,
     base_folder=base_folder,
@@ -118,3 +129,8 @@ if __name__ == '__main__':
     execution_path=execution_path,
     nr_workers=nr_workers
   )
+  return
+
+
+if __name__ == '__main__':
+  main()
@@ -14,24 +14,36 @@ written permission from the author.
 
 """
 
+import gc
 import flask
-import numpy as np
 import json
 
-from time import sleep
-
+from copy import deepcopy
+from functools import partial
 from threading import Lock
+from time import time, perf_counter
 
 from ..public_logger import Logger
 from ..generic_obj import BaseObject
 from ..plugins_manager_mixin import _PluginsManagerMixin
 from ..logger_mixins.serialization_json_mixin import NPJson
 
-from ..model_server.request_utils import MSCT
+from ..model_server.request_utils import MSCT, get_notifications_config
 
 from ..lib_ver import __VER__ as LIB_VER
 
 from .server_functions import _ServerFunctionsMixin
+from .worker_pool import WorkerPool
+from .request_batcher import RequestBatcher
+from .response_cache import ResponseCache, get_request_key
+from .single_flight import SingleFlight, FlightTimeout
+from .stream_utils import ClosingStream, PREDICT_STREAM, is_stream_answer
+from .admission_control import AdmissionController, DeadlineExceeded, get_remaining_time, is_expired
+from .process_worker import ProcessWorker
+from .autoscaler import Autoscaler
+from .metrics import MetricsRegistry
+
+DEFAULT_SCALE_DOWN_TIMEOUT = 30
 
 
 class FlaskModelServer(BaseObject, _PluginsManagerMixin, _ServerFunctionsMixin):
@@ -109,13 +121,23 @@ class FlaskModelServer(BaseObject, _PluginsManagerMixin, _ServerFunctionsMixin):
     self._execution_path = execution_path or '/analyze'
     self._verbosity_level = verbosity_level
     self._config_endpoint = config_endpoint or {}
+    self._execution_mode = self._config_endpoint.get(MSCT.EXECUTION_MODE, MSCT.EXECUTION_MODE_THREAD).lower()
 
     self._lst_workers = []
-    self._mask_workers_in_use = []
+    self._worker_pool = WorkerPool()
+    self._batcher = None
+    self._cache = None
+    self._single_flight = None
+    self._admission = None
+    self._autoscaler = None
+    self._metrics = None
+    self._nr_expired = 0
+    self._shared_model = None
+    self._shared_model_info = None
     self._counter = 0
 
-    self._lock = Lock()
     self._lock_counter = Lock()
+    self._lock_workers = Lock()
     self._paths = None
 
     super(FlaskModelServer, self).__init__(log=log, prefix_log='[FSKSVR]', maxlen_notifications=1000)
@@ -123,7 +145,15 @@ class FlaskModelServer(BaseObject, _PluginsManagerMixin, _ServerFunctionsMixin):
 
   def startup(self):
     super().startup()
+    self.setup_notifications(**get_notifications_config(self._config_endpoint))
+    self._setup_metrics()
+    self._maybe_load_shared_model()
     self._update_nr_workers(self.__initial_nr_workers)
+    self._maybe_setup_batching()
+    self._maybe_setup_cache()
+    self._maybe_setup_coalescing()
+    self._maybe_setup_admission()
+    self._maybe_setup_autoscaler()
     self._log_banner()
 
     if not self._execution_path.startswith('/'):
@@ -152,7 +182,22 @@ class FlaskModelServer(BaseObject, _PluginsManagerMixin, _ServerFunctionsMixin):
       methods=['GET', 'POST'],
     )
 
-    self._paths = [self._execution_path, MSCT.RULE_NOTIF, MSCT.RULE_UPDATE_WORKERS]
+    self.app.add_url_rule(
+      rule=MSCT.RULE_SERVER_STATUS,
+      endpoint='ServerStatusEndpoint',
+      view_func=self._view_func_server_status_endpoint,
+      methods=['GET', 'POST'],
+    )
+
+    self._paths = [self._execution_path, MSCT.RULE_NOTIF, MSCT.RULE_UPDATE_WORKERS, MSCT.RULE_SERVER_STATUS]
+
+    # scraped directly on the server port: not in `_paths` as the gateway serves its own `/metrics`
+    self.app.add_url_rule(
+      rule=MSCT.RULE_METRICS,
+      endpoint='MetricsEndpoint',
+      view_func=self._view_func_metrics_endpoint,
+      methods=['GET'],
+    )
 
     self.app.add_url_rule(
       rule=MSCT.RULE_PATHS,
@@ -175,41 +220,162 @@ class FlaskModelServer(BaseObject, _PluginsManagerMixin, _ServerFunctionsMixin):
     return self.__worker_name
 
   def _log_banner(self):
-    _logo = "FlaskModelServer v{} '{}' <{} code={}> started on '{}:{}'".format(
-      self.__version__, self.__microservice_name, self.__worker_name, self.__worker_class_name,  self._host, self._port
+    _logo = "FlaskModelServer v{} '{}' <{} code={}> started on '{}:{}' in {} mode".format(
+      self.__version__, self.__microservice_name, self.__worker_name, self.__worker_class_name,  self._host, self._port,
+      self._execution_mode,
     )
 
     self.log.P(_logo, color='g', boxed=True)
     self.log.P("Given full config:\n{}".format(json.dumps(self._config_endpoint, indent=4)))
     return
 
-  def _create_worker(self):
-    _module_name, _class_name, _cls_def, _config_dict = self._get_module_name_and_class(
+  def _get_worker_class(self):
+    return self._get_module_name_and_class(
       locations=self.__workers_location,
       name=self.__worker_name,
       suffix=self.__worker_suffix
     )
+
+  def _get_shared_model_config(self, default_config):
+    config = dict(default_config or {})
+    config.update({k.upper() : v for k, v in self._config_endpoint.items()})
+    return config
+
+  def _get_process_start_method(self):
+    start_method = self._config_endpoint.get(MSCT.PROCESS_START_METHOD)
+    if self._shared_model_info is not None:
+      if start_method is None:
+        start_method = 'fork'
+      elif start_method != 'fork':
+        self.P("WARNING: {}='{}' does not share the model between worker processes, each process will load its own copy".format(
+          MSCT.PROCESS_START_METHOD, start_method), color='r'
+        )
+    #endif shared model
+    return start_method
+
+  def _maybe_load_shared_model(self):
+    _, _, _cls_def, _config_dict = self._get_worker_class()
+    if _cls_def is None or not _cls_def.has_shared_model():
+      return
+
+    self.P("Loading shared model of {}...".format(_cls_def.__name__))
+    mem_start = self.log.get_current_process_memory(mb=True)
+    t_start = time()
+    self._shared_model = _cls_def._load_shared_model(
+      log=self.log,
+      config=self._get_shared_model_config(_config_dict),
+    )
+    # RSS delta is only an estimate of the model size (allocator caches, lazy loaded pages, etc)
+    self._shared_model_info = {
+      'size_mb'   : round(self.log.get_current_process_memory(mb=True) - mem_start, 2),
+      'load_time' : round(time() - t_start, 2),
+    }
+    self.P("  Shared model loaded: {}".format(self._shared_model_info), color='g')
+    return
+
+  def _get_shared_model_status(self):
+    nr_workers = len(self._lst_workers)
+    nr_copies = 1
+    if self._execution_mode == MSCT.EXECUTION_MODE_PROCESS and self._get_process_start_method() != 'fork':
+      nr_copies = nr_workers
+    return {
+      **self._shared_model_info,
+      'workers'  : nr_workers,
+      'copies'   : nr_copies,
+      'saved_mb' : round(self._shared_model_info['size_mb'] * (nr_workers - nr_copies), 2),
+    }
+
+  def _create_worker(self):
+    _module_name, _class_name, _cls_def, _config_dict = self._get_worker_class()
     
     if _cls_def is None:
       return
     
     self.__worker_class_name = _cls_def.__name__
 
-    worker_id = len(self._mask_workers_in_use)
-
-    worker = _cls_def(
-      log=self.log,
-      default_config=_config_dict,
-      verbosity_level=self._verbosity_level,
-      worker_id=worker_id,
-      upstream_config=self._config_endpoint
-    )
+    worker_id = len(self._lst_workers)
+
+    if self._execution_mode == MSCT.EXECUTION_MODE_PROCESS:
+      worker = ProcessWorker(
+        log=self.log,
+        worker_params=dict(
+          module_name=_module_name,
+          class_name=_class_name,
+          default_config=_config_dict,
+          verbosity_level=self._verbosity_level,
+          worker_id=worker_id,
+          upstream_config=self._config_endpoint,
+          shared_config=self._get_shared_model_config(_config_dict),
+        ),
+        log_params=dict(
+          lib_name='{}_W{}'.format(self.log.log_suffix, worker_id),
+          host_id=self.log.host_id,
+          base_folder=self.log.root_folder,
+          app_folder=self.log.app_folder,
+          max_lines=self.log.max_lines,
+          TF_KERAS=False,
+          logger_class=type(self.log),
+        ),
+        start_method=self._get_process_start_method(),
+        shared_model=self._shared_model,
+      )
+      self.P("  Started worker process {} with PID={}".format(worker_id, worker.pid))
+    else:
+      worker = _cls_def(
+        log=self.log,
+        default_config=_config_dict,
+        verbosity_level=self._verbosity_level,
+        worker_id=worker_id,
+        upstream_config=self._config_endpoint,
+        shared_model=self._shared_model,
+        # thread workers write their notifications directly in the server buffer
+        notifications=self._notifications,
+      )
+    #endif
 
     self._lst_workers.append(worker)
-    self._mask_workers_in_use.append(0)
+    self._worker_pool.add_worker(worker_id)
+    return
+
+  def _remove_workers(self, nr_workers):
+    """
+    Removes the last `nr_workers` workers: each one is first taken out of the worker pool (waiting
+    for its current request, if busy) and then shut down so its model is released
+    """
+    timeout = self._config_endpoint.get(MSCT.SCALE_DOWN_TIMEOUT, DEFAULT_SCALE_DOWN_TIMEOUT)
+    nr_removed = 0
+    for _ in range(nr_workers):
+      # worker ids are positions in `_lst_workers` so only the last worker can be removed
+      wid = len(self._lst_workers) - 1
+      if not self._worker_pool.remove_worker(wid, timeout=timeout):
+        self.P("  Worker {} still busy after {}s, scale-down stopped".format(wid, timeout), color='r')
+        break
+      worker = self._lst_workers.pop()
+      self._collect_worker_notifications([worker])
+      worker.shutdown()
+      nr_removed += 1
+    #endfor
+    gc.collect()
+    return nr_removed
+
+  def _collect_worker_notifications(self, workers=None):
+    """
+    Moves the new notifications of the worker processes in the server buffer (thread workers
+    already share it)
+    """
+    for worker in (workers if workers is not None else list(self._lst_workers)):
+      if isinstance(worker, ProcessWorker):
+        for body in worker.get_notifications():
+          self._notifications.append(body)
+    #endfor
     return
 
   def _update_nr_workers(self, nr_workers):
+    with self._lock_workers:
+      self.__update_nr_workers(nr_workers)
+    return
+
+  def __update_nr_workers(self, nr_workers):
     nr_crt_workers = len(self._lst_workers)
     nr_new_workers = nr_workers - nr_crt_workers
 
@@ -219,11 +385,18 @@ class FlaskModelServer(BaseObject, _PluginsManagerMixin, _ServerFunctionsMixin):
       self._create_notification(notif='log', msg=str_msg)
       for _ in range(nr_new_workers):
         self._create_worker()
+      if self._execution_mode == MSCT.EXECUTION_MODE_PROCESS:
+        # worker processes load their models in parallel so we wait for all of them here
+        for worker in self._lst_workers[nr_crt_workers:]:
+          worker.wait_ready()
       str_msg = "Created {} new workers. (were:{}, total:{})".format(nr_new_workers, nr_crt_workers, nr_workers)
       self._create_notification(notif='log', msg=str_msg)
     elif nr_new_workers < 0:
-      ###TODO delete only unused
-      str_msg = "Should delete {} - not implemented yet".format(-1*nr_new_workers)
+      str_msg = "Removing {} workers for server '{}'".format(-1*nr_new_workers, self.__worker_name)
+      self.P(str_msg, color='g')
+      self._create_notification(notif='log', msg=str_msg)
+      nr_removed = self._remove_workers(-1*nr_new_workers)
+      str_msg = "Removed {} workers. (were:{}, total:{})".format(nr_removed, nr_crt_workers, len(self._lst_workers))
       self._create_notification(notif='log', msg=str_msg)
     else:
       str_msg = "Update with no effect, there are already {} workers".format(nr_workers)
@@ -231,44 +404,275 @@ class FlaskModelServer(BaseObject, _PluginsManagerMixin, _ServerFunctionsMixin):
     #endif
     return
 
-  def _mask_worker_locked(self, wid):
-    self._mask_workers_in_use[wid] = 1
+  def _maybe_setup_batching(self):
+    max_batch_size = self._config_endpoint.get(MSCT.MAX_BATCH_SIZE, 1)
+    if max_batch_size > 1:
+      self._batcher = RequestBatcher(
+        execute_batch_func=self._execute_batch,
+        max_batch_size=max_batch_size,
+        batch_window_ms=self._config_endpoint.get(MSCT.BATCH_WINDOW_MS),
+      )
+      self.P("Batching enabled: {}".format(self._batcher.get_status()), color='g')
     return
 
-  def _mask_worker_unlocked(self, wid):
-    self._mask_workers_in_use[wid] = 0
+  def _maybe_setup_cache(self):
+    cache_size = self._config_endpoint.get(MSCT.CACHE_SIZE, 0)
+    if cache_size > 0:
+      self._cache = ResponseCache(
+        max_size=cache_size,
+        ttl=self._config_endpoint.get(MSCT.CACHE_TTL),
+        key_fields=self._config_endpoint.get(MSCT.CACHE_KEY_FIELDS),
+      )
+      self.P("Response cache enabled: {}".format(self._cache.get_status()), color='g')
+    return
 
-  def _find_unlocked_worker(self, counter):
-    self._lock.acquire()
-    unlocked_workers = np.where(np.array(self._mask_workers_in_use) == 0)[0]
-    if unlocked_workers.shape[0] == 0:
-      self._lock.release()
-      return
+  def _maybe_setup_coalescing(self):
+    if self._config_endpoint.get(MSCT.COALESCE_REQUESTS, False):
+      # only the answer is copied, the worker is shared by all the coalesced requests
+      self._single_flight = SingleFlight(
+        copy_func=lambda result: (result[0], deepcopy(result[1]), result[2]),
+      )
+      self.P("Coalescing of identical concurrent requests enabled", color='g')
+    return
 
-    wid = int(np.random.choice(unlocked_workers))
-    self._mask_worker_locked(wid)
-    self._lock.release()
-    return wid
+  def _maybe_setup_admission(self):
+    max_queue = self._config_endpoint.get(MSCT.MAX_QUEUE)
+    max_wait_ms = self._config_endpoint.get(MSCT.MAX_WAIT_MS)
+    if max_queue is not None or max_wait_ms is not None:
+      self._admission = AdmissionController(
+        get_capacity=self._get_capacity,
+        max_queue=max_queue,
+        max_wait_ms=max_wait_ms,
+      )
+      self.P("Admission control enabled: {}".format(self._admission.get_status()), color='g')
+    return
+
+  def _maybe_setup_autoscaler(self):
+    max_workers = self._config_endpoint.get(MSCT.MAX_WORKERS)
+    if max_workers is not None:
+      self._autoscaler = Autoscaler(
+        log=self.log,
+        scale_func=self._update_nr_workers,
+        get_nr_workers=lambda: len(self._lst_workers),
+        get_window_stats=self._worker_pool.get_window_stats,
+        get_avail_mem=lambda: self.log.get_avail_memory() / self.log.get_machine_memory(),
+        min_workers=self._config_endpoint.get(MSCT.MIN_WORKERS, 1),
+        max_workers=max_workers,
+        interval=self._config_endpoint.get(MSCT.AUTOSCALE_INTERVAL),
+        wait_ms=self._config_endpoint.get(MSCT.AUTOSCALE_WAIT_MS),
+        idle_windows=self._config_endpoint.get(MSCT.AUTOSCALE_IDLE_WINDOWS),
+        # same threshold as the memory alert of the gateway system status
+        min_avail_mem=self._config_endpoint.get(MSCT.AUTOSCALE_MIN_AVAIL_MEM, MSCT.MEM_ALERT_THR),
+      )
+      self._autoscaler.start()
+      self.P("Autoscaling enabled: {}".format(self._autoscaler.get_status()), color='g')
+    return
+
+  def _setup_metrics(self):
+    signature = self.__microservice_name
+    self._metrics = MetricsRegistry()
+    self._metric_requests = self._metrics.counter(
+      'bis_server_requests_total', 'Requests received by the server by status',
+      labels=('signature', 'status'),
+    )
+    self._metric_durations = self._metrics.histogram(
+      'bis_server_request_duration_seconds',
+      'Duration of the request stages: queue_wait (for a worker), pre_process, predict, post_process and total',
+      labels=('signature', 'stage'),
+    )
+    self._metric_in_flight = self._metrics.gauge(
+      'bis_server_in_flight_requests', 'Requests in progress', labels=('signature',),
+    )
+    self._metrics.gauge(
+      'bis_server_workers', 'Number of workers', labels=('signature',),
+      func=lambda: [((signature,), self._worker_pool.nr_workers)],
+    )
+    self._metrics.gauge(
+      'bis_server_worker_busy_ratio', 'Fraction of the workers that are busy', labels=('signature',),
+      func=lambda: [((signature,), self._get_busy_ratio())],
+    )
+    self._metrics.gauge(
+      'bis_server_queue_depth', 'Requests waiting for a worker', labels=('signature',),
+      func=lambda: [((signature,), self._worker_pool.queue_depth)],
+    )
+    # in process mode the memory and cpu of the worker processes are included
+    self._metrics.add_process_metrics(include_children=self._execution_mode == MSCT.EXECUTION_MODE_PROCESS)
+    return
+
+  def _get_busy_ratio(self):
+    nr_workers = self._worker_pool.nr_workers
+    if nr_workers == 0:
+      return 0
+    return round((nr_workers - self._worker_pool.nr_idle) / nr_workers, 4)
 
-  def _wait_predict(self, data, counter):
-    wid = self._find_unlocked_worker(counter)
+  def _observe_stage(self, stage, elapsed):
+    self._metric_durations.observe(elapsed, self.__microservice_name, stage)
+    return
+
+  def _observe_stage_times(self, answer):
+    # the stage durations measured by the worker are not part of the answer
+    dct_times = answer.pop(MSCT.STAGE_TIMES, None) if isinstance(answer, dict) else None
+    for stage, elapsed in (dct_times or {}).items():
+      self._observe_stage(stage, elapsed)
+    return
+
+  def _observe_request_start(self):
+    self._metric_in_flight.inc(self.__microservice_name)
+    return
+
+  def _observe_request_end(self, status, elapsed):
+    self._metric_in_flight.dec(self.__microservice_name)
+    self._metric_requests.inc(self.__microservice_name, status)
+    self._observe_stage('total', elapsed)
+    return
+
+  def _get_capacity(self):
+    # how many requests are executed at the same time
+    max_batch_size = self._batcher.max_batch_size if self._batcher is not None else 1
+    return len(self._lst_workers) * max_batch_size
+
+  def _acquire_worker(self, deadline=None):
+    timeout = self._admission.wait_timeout if self._admission is not None else None
+    remaining = get_remaining_time(deadline)
+    by_deadline = remaining is not None and (timeout is None or remaining < timeout)
+    if by_deadline:
+      if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded before a worker was available")
+      timeout = remaining
+    start = perf_counter()
+    wid = self._worker_pool.acquire(timeout=timeout)
+    self._observe_stage('queue_wait', perf_counter() - start)
     if wid is None:
-      # All model servers in use. Waiting...
+      # the request leaves the queue without taking the worker time
+      if by_deadline:
+        raise DeadlineExceeded("Deadline exceeded while waiting for a worker")
+      raise self._admission.wait_timed_out()
+    return wid
 
-      while wid is None:
-        sleep(1)
-        wid = self._find_unlocked_worker(counter)
-      #endwhile
+  def _count_expired(self):
+    with self._lock_counter:
+      self._nr_expired += 1
+    return
 
-      # Waiting done.
-    #endif
+  def _get_server_status(self):
+    dct_status = {
+      MSCT.EXECUTION_MODE : self._execution_mode,
+      MSCT.NR_WORKERS : len(self._lst_workers),
+      MSCT.WORKER_POOL : self._worker_pool.get_status(),
+      # requests dropped (504) because their `DEADLINE_MS` passed
+      MSCT.EXPIRED : self._nr_expired,
+    }
+    if self._batcher is not None:
+      dct_status[MSCT.BATCHING] = self._batcher.get_status()
+    if self._cache is not None:
+      dct_status[MSCT.CACHE] = self._cache.get_status()
+    if self._single_flight is not None:
+      dct_status[MSCT.COALESCING] = self._single_flight.get_status()
+    if self._admission is not None:
+      dct_status[MSCT.ADMISSION] = self._admission.get_status()
+    if self._autoscaler is not None:
+      dct_status[MSCT.AUTOSCALE] = self._autoscaler.get_status()
+    if self._shared_model_info is not None:
+      dct_status[MSCT.SHARED_MODEL] = self._get_shared_model_status()
+    return dct_status
+
+  def _execute_batch(self, lst_data, lst_counters, deadline=None):
+    wid = self._acquire_worker(deadline=deadline)
+    try:
+      worker = self._lst_workers[wid]
+      lst_answers = worker.execute_batch(
+        lst_inputs=lst_data,
+        lst_counters=lst_counters,
+        deadline=deadline,
+      )
+    finally:
+      self._worker_pool.release(wid)
+    for answer in lst_answers:
+      self._observe_stage_times(answer)
+    return worker, lst_answers, wid
+
+  def _wait_predict(self, data, counter, deadline=None, stream=False):
+    if (self._cache is None and self._single_flight is None) or stream:
+      # streamed answers can be neither cached nor shared
+      return self._execute_predict(data=data, counter=counter, deadline=deadline, stream=stream)
+
+    # the key is computed before execution as the worker may alter the inputs
+    key = get_request_key(data, key_fields=self._config_endpoint.get(MSCT.CACHE_KEY_FIELDS))
+    if self._cache is not None:
+      answer = self._cache.get(key)
+      if answer is not None:
+        answer['cached'] = True
+        return None, answer, -1
+    #endif cache
+
+    if self._single_flight is None:
+      worker, answer, wid = self._execute_predict(data=data, counter=counter, deadline=deadline)
+    else:
+      # a call with a deadline can wait for an identical call but never leads one, so the
+      # `DeadlineExceeded` of a call is never passed to the others. It waits at most its own budget
+      try:
+        (worker, answer, wid), is_shared = self._single_flight.do(
+          key=key,
+          func=lambda: self._execute_predict(data=data, counter=counter, deadline=deadline),
+          timeout=get_remaining_time(deadline),
+          lead=deadline is None,
+        )
+      except FlightTimeout:
+        raise DeadlineExceeded("Deadline exceeded while waiting for an identical request")
+      if is_shared:
+        answer['coalesced'] = True
+        return worker, answer, wid
+    #endif single flight
+
+    # only successful answers are cached
+    if self._cache is not None and isinstance(answer, dict) and 'predict_result' in answer:
+      self._cache.put(key, answer)
+    return worker, answer, wid
 
-    # now worker is locked...
-    worker = self._lst_workers[wid]
-    answer = worker.execute(
-      inputs=data,
-      counter=counter
-    )
-    self._mask_worker_unlocked(wid)
+  def _execute_predict(self, data, counter, deadline=None, stream=False):
+    if self._admission is None:
+      result = self._execute_admitted(data=data, counter=counter, deadline=deadline, stream=stream)
+    else:
+      # raises `AdmissionRejected` when the queue is full
+      self._admission.enter()
+      leave = True
+      try:
+        result = self._execute_admitted(data=data, counter=counter, deadline=deadline, stream=stream)
+        if is_stream_answer(result[1]):
+          # the request is in flight until its stream is closed
+          result[1][PREDICT_STREAM] = ClosingStream(result[1][PREDICT_STREAM], on_close=self._admission.leave)
+          leave = False
+      finally:
+        if leave:
+          self._admission.leave()
+    #endif
+    if is_expired(deadline) and not is_stream_answer(result[1]):
+      # the caller is gone (or about to be) and the answer may be partial if the worker was cancelled
+      raise DeadlineExceeded("Deadline exceeded during execution")
+    return result
+
+  def _execute_admitted(self, data, counter, deadline=None, stream=False):
+    if self._batcher is not None and not stream:
+      return self._batcher.submit(data=data, counter=counter, deadline=deadline)
+
+    # blocks until a worker is handed over by the pool (no polling)
+    wid = self._acquire_worker(deadline=deadline)
+    release = True
+    try:
+      worker = self._lst_workers[wid]
+      answer = worker.execute(
+        inputs=data,
+        counter=counter,
+        deadline=deadline,
+        stream=stream,
+      )
+      if is_stream_answer(answer):
+        # the worker produces the chunks while the response is sent so it is busy until the stream is closed
+        answer[PREDICT_STREAM] = ClosingStream(answer[PREDICT_STREAM], on_close=partial(self._worker_pool.release, wid))
+        release = False
+    finally:
+      if release:
+        self._worker_pool.release(wid)
+    self._observe_stage_times(answer)
     return worker, answer, wid
 
@@ -2,11 +2,22 @@ import flask
 import numpy as np
 import json
 
-from time import sleep
+from time import sleep, perf_counter
 
-from ..model_server.request_utils import get_api_request_body, MSCT
+from ..model_server.request_utils import get_api_request_body, get_request_deadline, MSCT
+from ..model_server.admission_control import AdmissionRejected, DeadlineExceeded
+from ..model_server.stream_utils import (
+  get_stream_format, is_stream_answer, encode_chunk, ClosingStream,
+  PREDICT_STREAM, STREAM_SSE, STREAM_CONTENT_TYPES, SSE_END,
+)
+from ..model_server.metrics import CONTENT_TYPE_METRICS
+from ..model_server.tensor_codec import accepts_tensor, encode_tensors, CONTENT_TYPE_TENSOR
+from ..notifications import snapshot_args
 from ..lib_ver import __VER__ as LIB_VER
 
+NOTIFICATIONS_KEEPALIVE = 15
+NOTIFICATIONS_POLL_INTERVAL = 1
+
 
 class _ServerFunctionsMixin(object):
   def __init__(self) -> None:
@@ -15,6 +26,22 @@ class _ServerFunctionsMixin(object):
   
 
   def _view_func_plugin_endpoint(self):
+    if flask.request.method == 'OPTIONS':
+      jresponse, _ = self._get_plugin_response()
+      return jresponse
+    start = perf_counter()
+    self._observe_request_start()
+    status = 'error'
+    try:
+      jresponse, status = self._get_plugin_response()
+    finally:
+      self._observe_request_end(status=status, elapsed=perf_counter() - start)
+    return jresponse
+
+  def _get_plugin_response(self):
+    """
+    Returns the response of the request and its status for the metrics
+    """
     self._lock_counter.acquire()
     self._counter += 1
     counter = self._counter
@@ -25,13 +52,17 @@ class _ServerFunctionsMixin(object):
       method = request.method
       
       params = get_api_request_body(request=request, log=self.log)
+      deadline = get_request_deadline(request.headers, params)
+      stream_format = get_stream_format(request.headers)
       client = params.get('client', 'unk')
   
-      self._create_notification( # TODO: do we really need this notification? get_qa is crazy...
+      # the params are only formatted (bounded) when /notifications is read, so the notification
+      # keeps a snapshot of the body and not the dict that the worker receives
+      self._create_notification(
         notif='log',
-        msg=(counter, "Received '{}' request {} from client '{}' params: {}".format(
-          method, counter, client, params
-        ))
+        msg=(counter, "Received '{}' request {} from client '{}' params: {}"),
+        msg_args=(method, counter, client, snapshot_args(params)),
+        per_request=True,
       )
       failed_request = False
       err_msg = ''
@@ -40,13 +71,29 @@ class _ServerFunctionsMixin(object):
       err_msg = str(self.log.get_error_info()) # maybe use
       self.P("Request processing generated exception: {}".format(err_msg), color='r')
 
-    worker, wid = None, -1
+    worker, wid, rejected = None, -1, None
     if method != 'OPTIONS' and not failed_request:
-      worker, answer, wid = self._wait_predict(data=params, counter=counter)
+      try:
+        worker, answer, wid = self._wait_predict(
+          data=params, counter=counter, deadline=deadline, stream=stream_format is not None,
+        )
+      except AdmissionRejected as exc:
+        rejected = exc
+        if isinstance(exc, DeadlineExceeded):
+          self._count_expired()
     else:
       answer = {'request_error' : err_msg}
 
-    if answer is None:
+    if rejected is not None:
+      jresponse = flask.jsonify({
+        "ERROR": str(rejected),
+        "call_id": counter,
+        'time' : self.log.time_to_str(),
+      })
+      jresponse.status_code = rejected.status_code
+      if rejected.retry_after is not None:
+        jresponse.headers["Retry-After"] = str(rejected.retry_after)
+    elif answer is None:
       jresponse = flask.jsonify({
         "ERROR": "input json does not contain right info or other error has occured",
         "client": client,
@@ -54,6 +101,10 @@ class _ServerFunctionsMixin(object):
         "input": params,
         'time' : self.log.time_to_str(),
       })
+    elif is_stream_answer(answer):
+      jresponse = self._get_stream_response(
+        answer=answer, counter=counter, worker=worker, wid=wid, stream_format=stream_format,
+      )
     else:
       if isinstance(answer, dict):
         answer['call_id'] = counter
@@ -62,10 +113,14 @@ class _ServerFunctionsMixin(object):
           answer['signature'] = '{}.{}.{}.{}'.format(
             self.log.host_id,
             self.name,
-            worker.__class__.__name__, 
+            worker.worker_class_name, 
             wid
           )
-        jresponse = flask.jsonify(answer)
+        if accepts_tensor(request.headers):
+          # numpy arrays in the answer travel as raw buffers instead of json lists
+          jresponse = flask.Response(encode_tensors(answer), mimetype=CONTENT_TYPE_TENSOR)
+        else:
+          jresponse = flask.jsonify(answer)
       else:
         assert isinstance(answer, str)
         jresponse = flask.make_response(answer)
@@ -75,46 +130,139 @@ class _ServerFunctionsMixin(object):
     jresponse.headers["Access-Control-Allow-Origin"] = "*"
     jresponse.headers["Access-Control-Allow-Methods"] = "POST, GET, OPTIONS, DELETE"
     jresponse.headers["Access-Control-Allow-Headers"] = "Content-Type"
-    return jresponse
+
+    if failed_request:
+      status = 'bad_request'
+    elif rejected is not None:
+      status = 'expired' if isinstance(rejected, DeadlineExceeded) else 'rejected'
+    elif answer is None or (isinstance(answer, dict) and any(str(k).endswith('_ERROR') for k in answer)):
+      status = 'error'
+    else:
+      status = 'ok'
+    return jresponse, status
+
+  def _get_stream_response(self, answer, counter, worker, wid, stream_format):
+    chunks = answer.pop(PREDICT_STREAM)
+    answer['call_id'] = counter
+    answer['signature'] = '{}.{}.{}.{}'.format(
+      self.log.host_id,
+      self.name,
+      worker.worker_class_name,
+      wid
+    )
+
+    def _encode():
+      # each chunk has the envelope of a regular answer (plus `chunk_id`) so the gateway handles it as such
+      for chunk_id, chunk in enumerate(chunks):
+        yield encode_chunk({**answer, **chunk, 'chunk_id' : chunk_id, 'time' : self.log.time_to_str()}, stream_format)
+      if stream_format == STREAM_SSE:
+        yield SSE_END
+      return
+
+    return flask.Response(
+      ClosingStream(_encode(), on_close=chunks.close),
+      mimetype=STREAM_CONTENT_TYPES[stream_format],
+      headers={'Cache-Control' : 'no-cache'},
+    )
 
   def _view_func_notifications_endpoint(self):
-    server_notifs = self.get_notifications()
-    workers_notifs = self.log.flatten_2d_list([w.get_notifications() for w in self._lst_workers])
+    """
+    Returns the notifications with a sequence id above `since` (query or body field) grouped by
+    call plus `LAST_SEQ`, the `since` of the next poll. Clients that accept `text/event-stream`
+    receive the notifications as server-sent events instead.
+    """
+    request = flask.request
+    params = get_api_request_body(request=request, log=self.log)
+    since = params.get(MSCT.NOTIF_SINCE, request.args.get(MSCT.NOTIF_SINCE, 0))
+    since = request.headers.get(MSCT.LAST_EVENT_ID_HEADER, since)
+    try:
+      since = int(since)
+    except (TypeError, ValueError):
+      since = 0
+
+    if get_stream_format(request.headers) == STREAM_SSE:
+      return self._get_notifications_stream(since)
 
-    all_notifs = server_notifs + workers_notifs
+    self._collect_worker_notifications()
+    all_notifs, last_seq, missed = self._notifications.get_since(since)
 
     lst_general_notifs = []
     dct_notifs_per_call = {}
     for notif in all_notifs:
-      dct = {
-        MSCT.NOTIF_NOTIFICATION_TYPE : notif[MSCT.NOTIF_NOTIFICATION_TYPE],
-        MSCT.NOTIF_MODULE : notif[MSCT.NOTIF_MODULE],
-        MSCT.TIME   : notif[MSCT.NOTIF_TIME]
-      }
-
-      if isinstance(notif['NOTIFICATION'], tuple):
-        counter, msg = notif['NOTIFICATION']
-        counter = str(counter)
-        dct['NOTIF'] = msg
-
+      counter, dct = self._format_notification(notif)
+      if counter is None:
+        lst_general_notifs.append(dct)
+      else:
         if counter not in dct_notifs_per_call:
           dct_notifs_per_call[counter] = []
-
         dct_notifs_per_call[counter].append(dct)
-      elif isinstance(notif['NOTIFICATION'], str):
-        msg = notif['NOTIFICATION']
-        dct['NOTIF'] = msg
-        lst_general_notifs.append(dct)
       #endif
-
     #endfor
 
     jresponse = flask.jsonify({
       **{"GENERAL" : lst_general_notifs},
-      **dct_notifs_per_call
+      **dct_notifs_per_call,
+      MSCT.NOTIF_LAST_SEQ : last_seq,
+      MSCT.NOTIF_MISSED : missed,
     })
     return jresponse
 
+  def _format_notification(self, notif):
+    """
+    Returns the call id (None for general notifications) and the answer fields of a notification
+    """
+    dct = {
+      MSCT.NOTIF_NOTIFICATION_TYPE : notif[MSCT.NOTIF_NOTIFICATION_TYPE],
+      MSCT.NOTIF_MODULE : notif[MSCT.NOTIF_MODULE],
+      MSCT.TIME   : notif[MSCT.NOTIF_TIME],
+      MSCT.NOTIF_SEQ : notif[MSCT.NOTIF_SEQ],
+    }
+    counter = None
+    if isinstance(notif['NOTIFICATION'], tuple):
+      # notification of a request (`per_request`), also from a worker process (pickled as a tuple)
+      counter, msg = notif['NOTIFICATION']
+      counter = str(counter)
+    else:
+      msg = notif['NOTIFICATION']
+    dct['NOTIF'] = msg
+    return counter, dct
+
+  def _get_notifications_stream(self, since):
+    """
+    Server-sent events with the notifications above `since`: the event id is the sequence id so a
+    reconnecting client resumes with `Last-Event-ID`. A comment is sent when there is nothing new
+    for `NOTIFICATIONS_KEEPALIVE` seconds so that closed connections are detected.
+    """
+    has_process_workers = self._execution_mode == MSCT.EXECUTION_MODE_PROCESS
+    # the worker processes are polled, the thread workers wake up the stream
+    wait_time = NOTIFICATIONS_POLL_INTERVAL if has_process_workers else NOTIFICATIONS_KEEPALIVE
+
+    def _events():
+      cursor, idle = since, 0
+      while True:
+        if has_process_workers:
+          self._collect_worker_notifications()
+        notifs, cursor, _ = self._notifications.get_since(cursor)
+        for notif in notifs:
+          counter, dct = self._format_notification(notif)
+          dct[MSCT.NOTIF_CALL_ID] = counter
+          yield 'id: {}\n'.format(dct[MSCT.NOTIF_SEQ]) + encode_chunk(dct, STREAM_SSE)
+        if len(notifs) > 0 or self._notifications.wait(cursor, timeout=wait_time):
+          idle = 0
+          continue
+        idle += wait_time
+        if idle >= NOTIFICATIONS_KEEPALIVE:
+          idle = 0
+          yield ': keepalive\n\n'
+      #endwhile
+      return
+
+    return flask.Response(
+      _events(),
+      mimetype=STREAM_CONTENT_TYPES[STREAM_SSE],
+      headers={'Cache-Control' : 'no-cache'},
+    )
+
   def _view_func_workers_endpoint(self):
     request = flask.request
     params = get_api_request_body(request=request, log=self.log)
@@ -123,8 +271,15 @@ class _ServerFunctionsMixin(object):
     if nr_workers is None:
       return flask.jsonify({'ERROR' : "Bad input. 'NR_WORKERS' not found"})
 
+    # a scale-down waits for the removed workers to finish their current requests
     self._update_nr_workers(nr_workers)
-    return flask.jsonify({'MESSAGE': 'OK'})
+    return flask.jsonify({'MESSAGE': 'OK', MSCT.NR_WORKERS : len(self._lst_workers)})
 
   def _view_func_get_paths_endpoint(self):
-    return flask.jsonify({MSCT.PATHS : self._paths})  
\ No newline at end of file
+    return flask.jsonify({MSCT.PATHS : self._paths})
+
+  def _view_func_server_status_endpoint(self):
+    return flask.jsonify(self._get_server_status())
+
+  def _view_func_metrics_endpoint(self):
+    return flask.Response(self._metrics.render(), content_type=CONTENT_TYPE_METRICS)
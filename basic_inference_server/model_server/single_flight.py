@@ -0,0 +1,111 @@
+from copy import deepcopy
+from threading import Lock, Event
+
+
+class FlightTimeout(Exception):
+  """
+  Raised to a waiter whose `timeout` passed before the shared call finished
+  """
+  pass
+
+
+class _Flight(object):
+  def __init__(self):
+    self.event = Event()
+    self.result = None
+    self.error = None
+    self.nr_waiters = 0
+    return
+
+
+class SingleFlight(object):
+  """
+  Coalesces identical concurrent requests: the first request with a given key executes
+  while the duplicates that arrive before it finishes wait for it and receive a copy of
+  its result instead of occupying other workers.
+  """
+  def __init__(self, copy_func=deepcopy):
+    """
+    Parameters:
+    -----------
+    copy_func: callable, optional
+      Copies the result for each waiter so callers can alter their own result.
+      The default is `deepcopy`
+    """
+    self._copy_func = copy_func
+    self._lock = Lock()
+    self._flights = {}
+
+    self._nr_executed = 0
+    self._nr_coalesced = 0
+    self._max_waiters = 0
+    return
+
+  def do(self, key, func, timeout=None, lead=True):
+    """
+    Executes `func()` once for all the concurrent calls with the same `key`
+
+    Parameters:
+    -----------
+    timeout: float, optional
+      Max seconds a waiter waits for the shared call before `FlightTimeout` is raised
+      The default is None (no limit)
+
+    lead: bool, optional
+      If False the call can wait for a shared call but it never starts one: without a call in
+      progress it executes `func()` on its own (e.g. calls with their own deadline whose errors
+      must not be passed to the other calls)
+      The default is True
+
+    Returns:
+    --------
+    (result, is_shared) where `is_shared` is True for the calls that received a copy
+    """
+    with self._lock:
+      flight = self._flights.get(key)
+      if flight is None:
+        if lead:
+          flight = _Flight()
+          self._flights[key] = flight
+        self._nr_executed += 1
+        is_leader = True
+      else:
+        flight.nr_waiters += 1
+        is_leader = False
+        self._nr_coalesced += 1
+        self._max_waiters = max(self._max_waiters, flight.nr_waiters)
+      #endif
+    #endwith
+
+    if flight is None:
+      return func(), False
+
+    if not is_leader:
+      if not flight.event.wait(timeout):
+        raise FlightTimeout("Shared call still running after {}s".format(timeout))
+      if flight.error is not None:
+        raise flight.error
+      # the stored result is never handed out so each waiter can alter its own copy
+      return self._copy_func(flight.result), True
+
+    try:
+      result = func()
+      flight.result = self._copy_func(result)
+    except Exception as exc:
+      flight.error = exc
+      raise
+    finally:
+      with self._lock:
+        self._flights.pop(key, None)
+      flight.event.set()
+    #endtry
+    return result, False
+
+  def get_status(self):
+    with self._lock:
+      return {
+        'in_flight'   : len(self._flights),
+        'executed'    : self._nr_executed,
+        'coalesced'   : self._nr_coalesced,
+        'max_waiters' : self._max_waiters,
+      }
@@ -0,0 +1,136 @@
+import json
+
+from functools import partial
+
+from ..logger_mixins.serialization_json_mixin import NPJson
+
+STREAM_SSE = 'sse'
+STREAM_NDJSON = 'ndjson'
+
+CONTENT_TYPE_SSE = 'text/event-stream'
+CONTENT_TYPE_NDJSON = 'application/x-ndjson'
+
+STREAM_CONTENT_TYPES = {
+  STREAM_SSE    : CONTENT_TYPE_SSE,
+  STREAM_NDJSON : CONTENT_TYPE_NDJSON,
+}
+
+# key of the answer of a worker that streams its result
+PREDICT_STREAM = 'predict_stream'
+
+SSE_END = 'event: end\ndata: {}\n\n'
+
+_json_dumps = partial(json.dumps, cls=NPJson, sort_keys=True)
+
+
+def get_stream_format(headers):
+  """
+  Returns the stream format accepted by the client (`Accept` header) or None
+  """
+  accept = headers.get('Accept', '')
+  for stream_format, content_type in STREAM_CONTENT_TYPES.items():
+    if content_type in accept:
+      return stream_format
+  return None
+
+
+def get_response_stream_format(headers):
+  """
+  Returns the stream format of a response (`Content-Type` header) or None
+  """
+  content_type = headers.get('Content-Type', '')
+  for stream_format, stream_content_type in STREAM_CONTENT_TYPES.items():
+    if content_type.startswith(stream_content_type):
+      return stream_format
+  return None
+
+
+def is_stream_answer(answer):
+  return isinstance(answer, dict) and PREDICT_STREAM in answer
+
+
+def encode_chunk(data, stream_format):
+  if stream_format == STREAM_SSE:
+    return 'data: {}\n\n'.format(_json_dumps(data))
+  return _json_dumps(data) + '\n'
+
+
+class ChunkDecoder(object):
+  """
+  Decodes the lines of a stream encoded with `encode_chunk`, one line at a time
+  """
+  def __init__(self, stream_format):
+    self._stream_format = stream_format
+    self._event = None
+    self.ended = False
+    return
+
+  def decode(self, line):
+    """
+    Returns the chunk (dict) completed by `line` or None
+    """
+    if isinstance(line, bytes):
+      line = line.decode('utf-8')
+    line = line.strip()
+    if len(line) == 0:
+      return None
+    if self._stream_format != STREAM_SSE:
+      return json.loads(line)
+    if line.startswith('event:'):
+      self._event = line[6:].strip()
+    elif line.startswith('data:'):
+      if self._event == 'end':
+        self.ended = True
+        return None
+      return json.loads(line[5:])
+    return None
+
+
+def decode_chunks(lines, stream_format):
+  """
+  Yields the chunks (dicts) of a stream encoded with `encode_chunk` from an iterable of text lines
+  """
+  decoder = ChunkDecoder(stream_format)
+  for line in lines:
+    chunk = decoder.decode(line)
+    if decoder.ended:
+      break
+    if chunk is not None:
+      yield chunk
+  #endfor
+  return
+
+
+class ClosingStream(object):
+  """
+  Iterator over `chunks` that calls `on_close` exactly once: when the chunks are exhausted, fail
+  or when it is closed. Unlike a generator `close()` works even if the iteration never started
+  (e.g. the client left before the first chunk) so the worker held by the stream is released.
+  """
+  def __init__(self, chunks, on_close):
+    self._chunks = iter(chunks)
+    self._on_close = on_close
+    self._closed = False
+    return
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    try:
+      return next(self._chunks)
+    except BaseException:
+      self.close()
+      raise
+
+  def close(self):
+    if self._closed:
+      return
+    self._closed = True
+    try:
+      close = getattr(self._chunks, 'close', None)
+      if close is not None:
+        close()
+    finally:
+      self._on_close()
+    return
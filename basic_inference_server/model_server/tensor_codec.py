@@ -0,0 +1,104 @@
+import json
+import struct
+import numpy as np
+
+from ..logger_mixins.serialization_json_mixin import NPJson
+
+CONTENT_TYPE_TENSOR = 'application/x-bis-tensor'
+
+_MAGIC = b'BIST'
+_VERSION = 1
+# magic, version, header length
+_PREFIX = struct.Struct('<4sBI')
+# buffers start at multiples of this offset in the frame so the decoded arrays keep the alignment of the body
+_ALIGN = 64
+_ND_KEY = '__ndarray__'
+
+
+def _aligned(pos):
+  return (pos + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def is_tensor_content(headers):
+  return headers.get('Content-Type', '').startswith(CONTENT_TYPE_TENSOR)
+
+
+def accepts_tensor(headers):
+  return CONTENT_TYPE_TENSOR in headers.get('Accept', '')
+
+
+def encode_tensors(data):
+  """
+  Encodes a json-like object that can contain numpy arrays in a single binary frame:
+
+    `BIST` | version (u8) | header length (u32) | json header | aligned raw array buffers
+
+  Each array is replaced in the json header by its dtype, shape and buffer index so the
+  numeric data is never converted to text.
+
+  Parameters:
+  -----------
+  data: dict, list or any json serializable object (numpy arrays allowed at any level)
+
+  Returns:
+  --------
+  bytes
+  """
+  arrays = []
+
+  def _replace(obj):
+    if isinstance(obj, np.ndarray):
+      if obj.dtype.hasobject:
+        raise ValueError("Cannot encode numpy arrays of objects")
+      arrays.append(np.ascontiguousarray(obj))
+      return {_ND_KEY : len(arrays) - 1, 'dtype' : obj.dtype.str, 'shape' : list(obj.shape)}
+    if isinstance(obj, dict):
+      return {k : _replace(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+      return [_replace(v) for v in obj]
+    return obj
+
+  header = _replace(data)
+  lst_buffers, pos = [], 0
+  for arr in arrays:
+    pos = _aligned(pos)
+    lst_buffers.append([pos, arr.nbytes])
+    pos += arr.nbytes
+  #endfor
+  str_header = json.dumps({'data' : header, 'buffers' : lst_buffers}, cls=NPJson).encode('utf-8')
+
+  start = _PREFIX.size + len(str_header)
+  parts = [_PREFIX.pack(_MAGIC, _VERSION, len(str_header)), str_header, b'\0' * (_aligned(start) - start)]
+  pos = 0
+  for arr, (offset, nbytes) in zip(arrays, lst_buffers):
+    parts.append(b'\0' * (offset - pos))
+    parts.append(arr.reshape(-1).view(np.uint8))
+    pos = offset + nbytes
+  #endfor
+  return b''.join(parts)
+
+
+def decode_tensors(body):
+  """
+  Decodes a frame created by `encode_tensors`. The arrays are read-only views on `body` (no copy).
+  """
+  magic, version, header_len = _PREFIX.unpack_from(body, 0)
+  if magic != _MAGIC or version > _VERSION:
+    raise ValueError("Unknown tensor frame {}/v{}".format(magic, version))
+  header = json.loads(bytes(body[_PREFIX.size:_PREFIX.size + header_len]))
+  start = _aligned(_PREFIX.size + header_len)
+  lst_buffers = header['buffers']
+
+  def _restore(obj):
+    if isinstance(obj, dict):
+      if _ND_KEY in obj:
+        offset, nbytes = lst_buffers[obj[_ND_KEY]]
+        dtype = np.dtype(obj['dtype'])
+        arr = np.frombuffer(body, dtype=dtype, count=nbytes // max(dtype.itemsize, 1), offset=start + offset)
+        return arr.reshape(obj['shape'])
+      return {k : _restore(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+      return [_restore(v) for v in obj]
+    return obj
+
+  return _restore(header['data'])
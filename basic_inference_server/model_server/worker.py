@@ -17,12 +17,16 @@ import os
 import abc
 import base64
 import json
+import inspect
 import traceback
 
+from time import time, perf_counter
 
 from ..public_logger import Logger
 from ..generic_obj import BaseObject
 from ..config_handler_mixin import _ConfigHandlerMixin
+from .request_utils import MSCT, get_notifications_config
+from .stream_utils import PREDICT_STREAM
   
 
 class FlaskWorker(BaseObject, _ConfigHandlerMixin):
@@ -36,6 +40,7 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
                verbosity_level,
                worker_id,
                upstream_config=None,
+               shared_model=None,
                **kwargs):
 
     """
@@ -58,18 +63,25 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
       The upstream configuration that comes from a configuration file of the process; this `upstream_config` is merged with `default_config`
       in order to compute the final config
       The default is None ({})
+
+    shared_model: object, optional
+      The object returned by `_load_shared_model` - loaded once by the server and shared (read-only)
+      by all the workers of the server
+      The default is None
     """
 
     self._default_config = default_config
     self._upstream_config_params = upstream_config or {}
     self.config_worker = None
     self._worker_id = worker_id
+    self._shared_model = shared_model
     self.hostname = os.environ.get('HOSTNAME', 'unknown') 
     self.__last_query = None
 
     self._verbosity_level = verbosity_level
 
     self._counter = None
+    self._deadline = None
     self.__encountered_error = None
     prefix_log = kwargs.pop('prefix_log', '[FSKWKR]')
     super(FlaskWorker, self).__init__(log=log, maxlen_notifications=1000, prefix_log=prefix_log, **kwargs)
@@ -79,9 +91,52 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
   def worker_id(self):
     return self.log.host_id + ":" + str(self._worker_id)
 
+  @property
+  def worker_class_name(self):
+    return self.__class__.__name__
+
+  @property
+  def shared_model(self):
+    return self._shared_model
+
+  def is_cancelled(self):
+    """
+    Returns True when the deadline of the current request (`DEADLINE_MS`) has passed and its
+    answer will be dropped anyway. Long `_predict` loops can poll it and return early.
+    """
+    return self._deadline is not None and time() >= self._deadline
+
+  @classmethod
+  def has_shared_model(cls):
+    return cls._load_shared_model.__func__ is not FlaskWorker._load_shared_model.__func__
+
+  @classmethod
+  def _load_shared_model(cls, log, config):
+    """
+    Override this method in sub-class in order to load the (read-only) model weights only once per
+    server instead of once per worker. The result is available to all workers as `self.shared_model`
+    (e.g. in `_load_model`). In process mode the model is loaded before the worker processes are
+    forked so the memory pages are shared copy-on-write.
+
+    Parameters:
+    -----------
+    log : Logger
+      The logger of the server
+
+    config: dict
+      The worker default config updated with the endpoint config
+
+    Returns:
+    --------
+    shared_model:
+      Any object that is shared by all the workers of the server
+    """
+    return None
+
   def startup(self):
     super().startup()
     self.config_worker = self._merge_prepare_config()
+    self.setup_notifications(**get_notifications_config(self.config_worker))
     self.setup_config_and_validate(self.config_worker)
     self._load_model()
     return
@@ -94,6 +149,19 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
     """
     raise NotImplementedError
 
+  def _unload_model(self):
+    """
+    Override this method in sub-class in order to free resources that are not released by the
+    garbage collector (e.g. GPU memory) when the worker is removed by a scale-down
+    """
+    return
+
+  def shutdown(self):
+    # called by the server when the worker is removed by a scale-down
+    self._unload_model()
+    super().shutdown()
+    return
+
   @abc.abstractmethod
   def _pre_process(self, inputs):
     """
@@ -126,12 +194,36 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
     """
     raise NotImplementedError
 
+  def _predict_batch(self, lst_prep_inputs):
+    """
+    Override this method in sub-class for models that can run a single vectorized forward pass on 
+    multiple inputs. Only used when the server runs in batching mode (`MAX_BATCH_SIZE` > 1).
+
+    Parameters:
+    -----------
+    lst_prep_inputs: list
+      List of objects returned by `_pre_process` for each request of the batch
+
+    Returns:
+    --------
+    lst_preds: list
+      List with the same length as `lst_prep_inputs` with the objects that will be used in 
+      `_post_process` for each request. If the batch fails then each request is predicted
+      individually with `_predict`
+    """
+    return [self._predict(prep_inputs) for prep_inputs in lst_prep_inputs]
+
   @abc.abstractmethod
   def _post_process(self, pred):
     """
     Implement this method in sub-class - custom logic for post processing the predictions
     (packing the output that goes to the end-user)
 
+    Streaming: if `_predict` returns a generator then `_post_process` is called for each chunk it
+    yields (e.g. each generated token); alternatively `_post_process` itself can return a generator
+    of chunks. The chunks are streamed to clients that accept `text/event-stream` or
+    `application/x-ndjson` and are returned as a list to the other clients.
+
     Parameters:
     ----------
     pred:
@@ -188,6 +280,23 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
       pred = None
     return pred
 
+  def __predict_batch(self, lst_prep_inputs):
+    try:
+      lst_preds = self._predict_batch(lst_prep_inputs)
+      if lst_preds is None or len(lst_preds) != len(lst_prep_inputs):
+        raise ValueError("_predict_batch returned {} results for {} inputs".format(
+          None if lst_preds is None else len(lst_preds), len(lst_prep_inputs)
+        ))
+    except:
+      err_dict = self.__err_dict(*self.log.get_error_info(return_err_val=True))
+      msg = 'Exception in _predict_batch, predicting each request individually:\n{}'.format(err_dict)
+      self._create_notification(
+        notif='exception',
+        msg=msg
+      )
+      lst_preds = None
+    return lst_preds
+
   def __post_process(self, pred):
     if pred is None:
       return
@@ -207,30 +316,53 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
     return answer
   
   
-  def get_last_query(self):
-    return self.__last_query
-  
+  def __iter_chunks(self, gen, post_process):
+    for chunk in gen:
+      yield self._post_process(chunk) if post_process else chunk
+    return
 
-  def execute(self, inputs, counter):
+  def __post_process_or_stream(self, pred):
     """
-    The method exposed for execution.
+    Returns `(temp_answer, None)` or `(None, chunks)` if `_predict`/`_post_process` returned a generator
+    """
+    if inspect.isgenerator(pred):
+      return None, self.__iter_chunks(pred, post_process=True)
+    temp_answer = self.__post_process(pred)
+    if inspect.isgenerator(temp_answer):
+      return None, self.__iter_chunks(temp_answer, post_process=False)
+    return temp_answer, None
 
-    Parameters:
-    ----------
-    inputs: dict, mandatory
-      The request json
+  def __stream_envelopes(self, chunks):
+    # runs lazily while the server sends the response, errors end the stream with an error chunk
+    try:
+      for chunk in chunks:
+        yield {'predict_result' : chunk}
+    except Exception:
+      err_dict = self.__err_dict(*self.log.get_error_info(return_err_val=True))
+      self._create_notification(
+        notif='exception',
+        msg='Exception while streaming:\n{}'.format(err_dict),
+      )
+      yield {'{}_ERROR'.format(self.__class__.__name__) : err_dict}
+    return
 
-    counter: int, mandatory
-      The call id
+  def __consume_stream(self, chunks):
+    try:
+      return list(chunks)
+    except:
+      err_dict = self.__err_dict(*self.log.get_error_info(return_err_val=True))
+      self.__encountered_error = err_dict
+      self._create_notification(
+        notif='exception',
+        msg='Exception while consuming the stream:\n{}'.format(err_dict),
+      )
+      return
 
-    Returns:
-    --------
-    answer: dict
-      The answer that goes to the end-user
-    """
-    self._counter = counter
-    self.__encountered_error = None
+  def get_last_query(self):
+    return self.__last_query
+  
 
+  def __decode_inputs(self, inputs):
     base64_keys = inputs.pop('BASE64_KEYS', [])
     base64_outputs = inputs.pop('BASE64_OUTPUTS', [])
     encoding = inputs.pop('ENCODING', 'ansi')
@@ -240,15 +372,9 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
       else:
         self.P("Key {} sent in 'BASE64_KEYS' does not exist in input", color='e')
     #endfor
+    return base64_outputs, encoding
 
-    self.__last_query = inputs
-    
-    prep_inputs = self.__pre_process(inputs)
-        
-    pred = self.__predict(prep_inputs)
-
-    temp_answer = self.__post_process(pred)
-    
+  def __pack_answer(self, temp_answer, base64_outputs, encoding):
     answer = {
       'predict_result' : temp_answer,
       'worker_id' : self.worker_id,
@@ -272,7 +398,154 @@ class FlaskWorker(BaseObject, _ConfigHandlerMixin):
 
     return answer
 
+  def execute(self, inputs, counter, deadline=None, stream=False):
+    """
+    The method exposed for execution.
+
+    Parameters:
+    ----------
+    inputs: dict, mandatory
+      The request json
+
+    counter: int, mandatory
+      The call id
+
+    deadline: float, optional
+      The absolute (`time()` based) deadline of the request used by `is_cancelled`
+      The default is None (no deadline)
+
+    stream: bool, optional
+      If the client accepts a stream then a generator result is returned as `predict_stream`
+      (lazily evaluated) instead of a list
+      The default is False
+
+    Returns:
+    --------
+    answer: dict
+      The answer that goes to the end-user
+    """
+    self._counter = counter
+    self._deadline = deadline
+    self.__encountered_error = None
+
+    base64_outputs, encoding = self.__decode_inputs(inputs)
+
+    self.__last_query = inputs
+    
+    start = perf_counter()
+    prep_inputs = self.__pre_process(inputs)
+    end_pre_process = perf_counter()
+        
+    pred = self.__predict(prep_inputs)
+    end_predict = perf_counter()
+
+    temp_answer, chunks = self.__post_process_or_stream(pred)
+    if chunks is not None:
+      if stream:
+        return {
+          PREDICT_STREAM : self.__stream_envelopes(chunks),
+          'worker_id' : self.worker_id,
+        }
+      temp_answer = self.__consume_stream(chunks)
+    #endif generator result
+    
+    answer = self.__pack_answer(temp_answer, base64_outputs, encoding)
+    answer[MSCT.STAGE_TIMES] = {
+      'pre_process'  : end_pre_process - start,
+      'predict'      : end_predict - end_pre_process,
+      'post_process' : perf_counter() - end_predict,
+    }
+    return answer
+
+  def execute_batch(self, lst_inputs, lst_counters, deadline=None):
+    """
+    The method exposed for batch execution. Each request is pre-processed and post-processed
+    individually while the prediction is done with a single `_predict_batch` call.
+
+    Parameters:
+    ----------
+    lst_inputs: list[dict], mandatory
+      The request jsons
+
+    lst_counters: list[int], mandatory
+      The call ids
+
+    deadline: float, optional
+      The latest deadline of the batch requests used by `is_cancelled`
+      The default is None (no deadline)
+
+    Returns:
+    --------
+    lst_answers: list[dict]
+      The answers that go to each end-user, in the same order as `lst_inputs`
+    """
+    nr_inputs = len(lst_inputs)
+    self._deadline = deadline
+    lst_errors = [None] * nr_inputs
+    lst_prep_inputs = [None] * nr_inputs
+    lst_preds = [None] * nr_inputs
+    lst_formats = [([], 'ansi')] * nr_inputs
+    lst_times = [{'pre_process' : 0, 'predict' : 0, 'post_process' : 0} for _ in range(nr_inputs)]
+
+    for i, (inputs, counter) in enumerate(zip(lst_inputs, lst_counters)):
+      self._counter = counter
+      self.__encountered_error = None
+      try:
+        lst_formats[i] = self.__decode_inputs(inputs)
+      except:
+        self.__encountered_error = self.__err_dict(*self.log.get_error_info(return_err_val=True))
+        lst_errors[i] = self.__encountered_error
+        continue
+      self.__last_query = inputs
+      start = perf_counter()
+      lst_prep_inputs[i] = self.__pre_process(inputs)
+      lst_times[i]['pre_process'] = perf_counter() - start
+      lst_errors[i] = self.__encountered_error
+    #endfor
+
+    valid = [i for i in range(nr_inputs) if lst_prep_inputs[i] is not None]
+    if len(valid) > 0:
+      self._counter = lst_counters[valid[0]]
+      start = perf_counter()
+      lst_valid_preds = self.__predict_batch([lst_prep_inputs[i] for i in valid])
+      elapsed = perf_counter() - start
+      if lst_valid_preds is not None:
+        for i, pred in zip(valid, lst_valid_preds):
+          lst_preds[i] = pred
+          # each request of the batch waited for the whole batch prediction
+          lst_times[i]['predict'] = elapsed
+      else:
+        # batch failed so we isolate the failing request(s)
+        for i in valid:
+          self._counter = lst_counters[i]
+          self.__encountered_error = None
+          start = perf_counter()
+          lst_preds[i] = self.__predict(lst_prep_inputs[i])
+          lst_times[i]['predict'] = elapsed + perf_counter() - start
+          lst_errors[i] = self.__encountered_error
+        #endfor
+      #endif
+    #endif
+
+    lst_answers = []
+    for i in range(nr_inputs):
+      self._counter = lst_counters[i]
+      self.__encountered_error = lst_errors[i]
+      start = perf_counter()
+      temp_answer, chunks = self.__post_process_or_stream(lst_preds[i])
+      if chunks is not None:
+        # batches are never streamed
+        temp_answer = self.__consume_stream(chunks)
+      base64_outputs, encoding = lst_formats[i]
+      answer = self.__pack_answer(temp_answer, base64_outputs, encoding)
+      lst_times[i]['post_process'] = perf_counter() - start
+      answer[MSCT.STAGE_TIMES] = lst_times[i]
+      lst_answers.append(answer)
+    #endfor
+    return lst_answers
+
   def _create_notification(self, notif, msg, info=None, stream_name=None, **kwargs):
     msg = (self._counter or "INIT", msg)
+    kwargs['per_request'] = self._counter is not None
     super()._create_notification(notif=notif, msg=msg, info=info, stream_name=stream_name, **kwargs)
     return
@@ -0,0 +1,180 @@
+import numpy as np
+
+from collections import deque
+from threading import Lock, Event
+from time import perf_counter
+
+MAX_WAIT_STATS = 1000
+
+
+class _Waiter(object):
+  def __init__(self):
+    self.event = Event()
+    self.wid = None
+    return
+
+
+class WorkerPool(object):
+  """
+  Checkout pool for the workers of a `FlaskModelServer`.
+
+  Idle workers sit in a queue while requests that find no idle worker wait in FIFO
+  order. A released worker is handed over directly to the oldest waiter so no
+  request has to poll for a free worker.
+  """
+  def __init__(self, maxlen_stats=MAX_WAIT_STATS):
+    self._lock = Lock()
+    self._idle = deque()
+    self._waiters = deque()
+    self._nr_workers = 0
+    # worker id -> Event set when the retiring worker is idle and out of the pool
+    self._retiring = {}
+
+    self._wait_times = deque(maxlen=maxlen_stats)
+    self._nr_acquired = 0
+    self._nr_waited = 0
+    self._nr_timeouts = 0
+    self._max_queue_depth = 0
+    self._nr_removed = 0
+
+    # stats since the last `get_window_stats` used by the autoscaler
+    self._window_waits = []
+    self._window_min_idle = 0
+    return
+
+  def add_worker(self, wid):
+    with self._lock:
+      self._nr_workers += 1
+    self.release(wid)
+    return
+
+  def remove_worker(self, wid, timeout=None):
+    """
+    Takes the worker `wid` out of the pool as soon as it is idle: a busy worker finishes its
+    current request and is not handed over to any other request.
+
+    Returns True if the worker was removed or False if it was still busy after `timeout` seconds
+    (then it stays in the pool).
+    """
+    with self._lock:
+      if wid in self._idle:
+        self._idle.remove(wid)
+        self._nr_workers -= 1
+        self._nr_removed += 1
+        return True
+      retired = Event()
+      self._retiring[wid] = retired
+    #endwith
+
+    retired.wait(timeout)
+
+    with self._lock:
+      del self._retiring[wid]
+      if not retired.is_set():
+        return False
+      self._nr_workers -= 1
+      self._nr_removed += 1
+    #endwith
+    return True
+
+  def acquire(self, timeout=None):
+    """
+    Returns the id of an idle worker or None if no worker became available in
+    `timeout` seconds (`timeout=None` waits indefinitely).
+    """
+    start = perf_counter()
+    with self._lock:
+      if len(self._idle) > 0 and len(self._waiters) == 0:
+        wid = self._idle.popleft()
+        self._nr_acquired += 1
+        self._wait_times.append(0)
+        self._window_waits.append(0)
+        self._window_min_idle = min(self._window_min_idle, len(self._idle))
+        return wid
+      waiter = _Waiter()
+      self._window_min_idle = 0
+      self._waiters.append(waiter)
+      self._max_queue_depth = max(self._max_queue_depth, len(self._waiters))
+    #endwith
+
+    waiter.event.wait(timeout)
+
+    with self._lock:
+      wid = waiter.wid
+      if wid is None:
+        # timeout: worker was not handed over so we leave the queue
+        self._waiters.remove(waiter)
+        self._nr_timeouts += 1
+      else:
+        self._nr_acquired += 1
+        self._nr_waited += 1
+        self._wait_times.append(perf_counter() - start)
+        self._window_waits.append(self._wait_times[-1])
+      #endif
+    #endwith
+    return wid
+
+  def release(self, wid):
+    with self._lock:
+      if wid in self._retiring:
+        self._retiring[wid].set()
+      elif len(self._waiters) > 0:
+        waiter = self._waiters.popleft()
+        waiter.wid = wid
+        waiter.event.set()
+      else:
+        self._idle.append(wid)
+      #endif
+    #endwith
+    return
+
+  @property
+  def queue_depth(self):
+    return len(self._waiters)
+
+  @property
+  def nr_idle(self):
+    return len(self._idle)
+
+  @property
+  def nr_workers(self):
+    return self._nr_workers
+
+  def get_window_stats(self):
+    """
+    Returns the wait times and the min number of idle workers since the previous call
+    """
+    with self._lock:
+      wait_times = self._window_waits
+      min_idle = self._window_min_idle
+      self._window_waits = []
+      self._window_min_idle = len(self._idle) if len(self._waiters) == 0 else 0
+      queue_depth = len(self._waiters)
+    #endwith
+    return {
+      'queue_depth' : queue_depth,
+      'min_idle'    : min_idle,
+      'requests'    : len(wait_times),
+      'wait_p90'    : float(np.percentile(wait_times, 90)) if len(wait_times) > 0 else 0,
+    }
+
+  def get_status(self):
+    with self._lock:
+      wait_times = np.array(self._wait_times)
+      dct_status = {
+        'workers'         : self._nr_workers,
+        'idle'            : len(self._idle),
+        'busy'            : self._nr_workers - len(self._idle),
+        'queue_depth'     : len(self._waiters),
+        'max_queue_depth' : self._max_queue_depth,
+        'acquired'        : self._nr_acquired,
+        'waited'          : self._nr_waited,
+        'timeouts'        : self._nr_timeouts,
+        'removed'         : self._nr_removed,
+      }
+    #endwith
+    if wait_times.shape[0] > 0:
+      dct_status['wait_mean'] = round(float(wait_times.mean()), 4)
+      dct_status['wait_p90'] = round(float(np.percentile(wait_times, 90)), 4)
+      dct_status['wait_max'] = round(float(wait_times.max()), 4)
+    return dct_status
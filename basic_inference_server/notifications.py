@@ -0,0 +1,202 @@
+"""
+Notifications of the `BaseObject` subclasses (servers, workers, gateway).
+
+A notification only captures its format string, its arguments and the time when it is created.
+The message is formatted (and truncated) when the notifications are read, so the objects that
+are never read - or dropped by the level, the sampling or the per-request switch - cost nothing
+more than a level check.
+
+The notifications are kept in a `NotificationBuffer`: a ring buffer where each notification gets a
+sequence id so that any number of readers can follow it with their own cursor.
+"""
+import reprlib
+
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from threading import Condition
+
+MAX_NOTIFICATION_LEN = 255
+
+LEVEL_DEBUG = 10
+LEVEL_LOG = 20
+LEVEL_WARNING = 30
+LEVEL_EXCEPTION = 40
+LEVEL_OFF = 100
+
+NOTIFICATION_LEVELS = {
+  'debug'     : LEVEL_DEBUG,
+  'log'       : LEVEL_LOG,
+  'info'      : LEVEL_LOG,
+  'warning'   : LEVEL_WARNING,
+  'error'     : LEVEL_EXCEPTION,
+  'exception' : LEVEL_EXCEPTION,
+  'off'       : LEVEL_OFF,
+}
+
+# containers are rendered with a bounded repr so a large request body is never fully formatted
+_short_repr = reprlib.Repr()
+_short_repr.maxlevel = 3
+_short_repr.maxdict = 16
+_short_repr.maxlist = 16
+_short_repr.maxtuple = 16
+_short_repr.maxstring = MAX_NOTIFICATION_LEN
+_short_repr.maxother = MAX_NOTIFICATION_LEN
+
+
+def get_notification_level(level):
+  """
+  Returns the numeric level of a notification type or level name (unknown types are `log`)
+  """
+  if isinstance(level, int):
+    return level
+  return NOTIFICATION_LEVELS.get(str(level).lower(), LEVEL_LOG)
+
+
+def _render_arg(arg):
+  if isinstance(arg, (dict, list, tuple, set)):
+    return _short_repr.repr(arg)
+  return arg
+
+
+def _summarize_value(value):
+  if hasattr(value, 'shape') and hasattr(value, 'dtype'):
+    return "{}(shape={}, dtype={})".format(type(value).__name__, tuple(value.shape), value.dtype)
+  if isinstance(value, (bytes, bytearray, memoryview)):
+    return "{}(len={})".format(type(value).__name__, len(value))
+  return value
+
+
+def snapshot_args(dct):
+  """
+  Returns a shallow copy of a request body to be used as a lazy notification argument: the
+  caller may change the body before the notification is read and the arrays (shape and dtype) or
+  raw bytes (length) are summarized instead of being kept alive by the buffer
+  """
+  if not isinstance(dct, dict):
+    return _summarize_value(dct)
+  return {k : _summarize_value(v) for k, v in dct.items()}
+
+
+class LazyMessage(object):
+  """
+  Message formatted with `str.format` only when it is rendered
+  """
+  __slots__ = ('fmt', 'args')
+
+  def __init__(self, fmt, args):
+    self.fmt = fmt
+    self.args = args
+    return
+
+  def __str__(self):
+    try:
+      msg = self.fmt.format(*[_render_arg(x) for x in self.args])
+    except Exception as exc:
+      msg = "{} (bad notification args: {})".format(self.fmt, exc)
+    return msg
+
+
+def render_message(msg):
+  """
+  Formats a notification message that can be a string, a `LazyMessage` or a `(call_id, message)`
+  tuple (notifications of a request)
+  """
+  if isinstance(msg, tuple):
+    return (msg[0], render_message(msg[1]))
+  return str(msg)[:MAX_NOTIFICATION_LEN]
+
+
+def render_notification(body, seq=None):
+  """
+  Returns the notification body with its message and timestamp formatted (bodies that were already
+  rendered, e.g. received from a worker process, keep their timestamp) and its sequence id
+  """
+  timestamp = body['TIMESTAMP']
+  if isinstance(timestamp, (int, float)):
+    timestamp = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")
+  result = {
+    **body,
+    'NOTIFICATION' : render_message(body['NOTIFICATION']),
+    'TIMESTAMP'    : timestamp,
+  }
+  if seq is not None:
+    result['SEQ'] = seq
+  return result
+
+
+class NotificationBuffer(object):
+  """
+  Ring buffer of notifications. Each notification gets a monotonically increasing sequence id
+  (starting with 1) and reading does not remove anything, so readers poll with the last id they
+  have seen. A notification is rendered once, by its first reader, and then its arguments are
+  released.
+  """
+  def __init__(self, maxlen=None):
+    # items are `[seq, body, rendered]`
+    self._items = deque(maxlen=maxlen)
+    self._seq = 0
+    self._cond = Condition()
+    return
+
+  @property
+  def last_seq(self):
+    return self._seq
+
+  def append(self, body):
+    with self._cond:
+      self._seq += 1
+      self._items.append([self._seq, body, None])
+      self._cond.notify_all()
+    return self._seq
+
+  def get_since(self, since=0, limit=None):
+    """
+    Parameters:
+    -----------
+    since: int, optional
+      Only the notifications with a sequence id above `since` are returned
+      The default is 0 (all the buffered notifications)
+
+    limit: int, optional
+      Max number of returned notifications (the oldest ones)
+      The default is None (no limit)
+
+    Returns:
+    --------
+    (notifications, last_seq, missed): the rendered notifications (each with its `SEQ`), the
+      cursor for the next call and how many notifications after `since` were evicted unread
+    """
+    since = max(int(since or 0), 0)
+    with self._cond:
+      if since > self._seq:
+        # cursor of a previous run of the server
+        since = 0
+      nr_items = len(self._items)
+      first_seq = self._seq - nr_items + 1
+      start = max(since - first_seq + 1, 0)
+      stop = nr_items if limit is None else min(start + limit, nr_items)
+      items = list(islice(self._items, start, stop))
+      last_seq = items[-1][0] if len(items) > 0 else since
+      missed = max(first_seq - since - 1, 0)
+    #endwith
+    lst = []
+    for item in items:
+      rendered = item[2]
+      if rendered is None:
+        # concurrent readers may both render it (same result); the body is released after the
+        # rendered notification is stored so a reader that finds no body finds the rendered one
+        body = item[1]
+        rendered = render_notification(body, seq=item[0]) if body is not None else item[2]
+        item[2] = rendered
+        item[1] = None
+      lst.append(rendered)
+    #endfor
+    return lst, last_seq, missed
+
+  def wait(self, since, timeout=None):
+    """
+    Waits until there are notifications above `since`. Returns False on timeout
+    """
+    with self._cond:
+      return self._cond.wait_for(lambda: self._seq > since, timeout=timeout)
@@ -95,3 +95,85 @@ class Logger(
       self.check_tf()
     return
 
+
+# the mixins used by the model servers and their workers (logging, timers, json, config, memory)
+_SLIM_MIXINS = (
+  _JSONSerializationMixin,
+  _MachineMixin,
+  _ProcessMixin,
+  _TimersMixin,
+  _UtilsMixin,
+)
+
+_LAZY_MIXINS = tuple(x for x in Logger.__bases__ if x is not BaseLogger and x not in _SLIM_MIXINS)
+
+
+class SlimLogger(
+  BaseLogger,
+  _JSONSerializationMixin,
+  _MachineMixin,
+  _ProcessMixin,
+  _TimersMixin,
+  _UtilsMixin
+):
+  """
+  Logger profile of the serving processes: only the mixins they use are initialized. The methods
+  of the other `Logger` mixins (dataframes, plots, downloads, TF/Keras, GPU, ...) are bound on
+  first use, when the state of their mixin is also created, so `SlimLogger` can replace `Logger`.
+  """
+
+  def __init__(self, lib_name="",
+               lib_ver="",
+               config_file="",
+               host_id="",
+               base_folder=None,
+               app_folder=None,
+               show_time=True,
+               config_file_encoding=None,
+               no_folders_no_save=False,
+               max_lines=None,
+               HTML=False,
+               DEBUG=True,
+               data_folder_additional_configs=None,
+               TF_KERAS=False):
+
+    super(SlimLogger, self).__init__(
+      lib_name=lib_name, lib_ver=lib_ver, host_id=host_id,
+      config_file=config_file,
+      base_folder=base_folder,
+      app_folder=app_folder,
+      show_time=show_time,
+      config_file_encoding=config_file_encoding,
+      no_folders_no_save=no_folders_no_save,
+      max_lines=max_lines,
+      HTML=HTML,
+      DEBUG=DEBUG,
+      data_folder_additional_configs=data_folder_additional_configs
+    )
+
+    if TF_KERAS:
+      self.check_tf()
+    return
+
+  def __init_lazy_mixin(self, mixin):
+    # the mixin `__init__` runs on an empty object and its attributes are copied
+    done = self.__dict__.setdefault('_lazy_mixins', set())
+    if mixin not in done:
+      probe = object.__new__(type('_Probe', (mixin,), {}))
+      mixin.__init__(probe)
+      for k, v in vars(probe).items():
+        self.__dict__.setdefault(k, v)
+      done.add(mixin)
+    return
+
+  def __getattr__(self, name):
+    # only called when `name` is not found in the instance or in the slim mixins
+    if not name.startswith('__'):
+      for mixin in _LAZY_MIXINS:
+        for klass in mixin.__mro__[:-1]:
+          if name in vars(klass):
+            self.__init_lazy_mixin(mixin)
+            return vars(klass)[name].__get__(self, type(self))
+        #endfor
+      #endfor
+    raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
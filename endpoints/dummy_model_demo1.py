@@ -70,7 +70,8 @@ class DummyModelDemo1Worker(FlaskWorker):
     ### abstract method implementation: "in-memory model :)" that adds and subtracts.
     self._create_notification(
       notif='log',
-      msg='Predicting on usr_input: {} using {}'.format(prep_inputs, self.config_data)
+      msg='Predicting on usr_input: {} using {}',
+      msg_args=(prep_inputs, self.config_data),
     )
     res = ''
     if isinstance(prep_inputs, float):
@@ -39,7 +39,8 @@ class DummyModelDemo2Worker(FlaskWorker):
     ### abstract method implementation: "in-memory model :)" that adds and subtracts.
     self._create_notification(
       notif='log',
-      msg='Predicting on usr_input: {} using {}'.format(prep_inputs, self.config_data)
+      msg='Predicting on usr_input: {} using {}',
+      msg_args=(prep_inputs, self.config_data),
     )
     val = int(prep_inputs)
     res = '{}*{} + {} = {} PREDICTED'.format(prep_inputs, self.cfg_weight, self.cfg_bias, val * self.cfg_weight + self.cfg_bias)
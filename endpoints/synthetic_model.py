@@ -0,0 +1,60 @@
+from time import sleep, perf_counter
+
+from basic_inference_server import FlaskWorker
+
+_CONFIG = {
+  'SLEEP_MS'     : 0,
+  'CPU_MS'       : 0,
+  'PAYLOAD_SIZE' : 0,
+}
+
+__WORKER_VER__ = '0.1.0'
+
+class SyntheticModelWorker(FlaskWorker):
+
+  """
+  Synthetic worker used by the benchmark (`run_benchmark.py`): each call sleeps `SLEEP_MS`,
+  keeps the cpu busy for `CPU_MS` and answers with a payload of `PAYLOAD_SIZE` characters.
+  The configured values can be overwritten by each request (same keys in the inputs).
+  """
+
+  def __init__(self, **kwargs):
+    super(SyntheticModelWorker, self).__init__(prefix_log='[SYNW]', **kwargs)
+    return
+
+
+  def _load_model(self):
+    ### see docstring in parent
+    ### abstract method implementation: no model to be loaded
+    return
+
+  def _pre_process(self, inputs):
+    ### see docstring in parent
+    ### abstract method implementation: the per request values overwrite the configured ones
+    return {
+      'SLEEP_MS'     : float(inputs.get('SLEEP_MS', self.cfg_sleep_ms)),
+      'CPU_MS'       : float(inputs.get('CPU_MS', self.cfg_cpu_ms)),
+      'PAYLOAD_SIZE' : int(inputs.get('PAYLOAD_SIZE', self.cfg_payload_size)),
+    }
+
+  def _predict(self, prep_inputs):
+    ### see docstring in parent
+    ### abstract method implementation: simulates a model (io wait then cpu bound work)
+    if prep_inputs['SLEEP_MS'] > 0:
+      sleep(prep_inputs['SLEEP_MS'] / 1000)
+    stop = perf_counter() + prep_inputs['CPU_MS'] / 1000
+    nr_loops = 0
+    while perf_counter() < stop:
+      nr_loops += 1
+    return nr_loops, prep_inputs
+
+  def _post_process(self, pred):
+    ### see docstring in parent
+    ### abstract method implementation: packs the endpoint answer that will be jsonified
+    nr_loops, prep_inputs = pred
+    return {
+      'synthetic_predict' : 'x' * prep_inputs['PAYLOAD_SIZE'],
+      'cpu_loops'         : nr_loops,
+      'inputs'            : prep_inputs,
+      'worker_ver'        : __WORKER_VER__,
+    }
@@ -7,7 +7,7 @@ import argparse
 from time import sleep
 
 from basic_inference_server import Logger
-from basic_inference_server import FlaskGateway, get_packages
+from basic_inference_server import FlaskGateway, AsyncGateway, get_packages
 
 from app_ver import __VER__ as APP_VER
 from basic_inference_server import LIB_VER
@@ -43,18 +43,30 @@ def main():
     '--port', type=int, default=5002
   )
 
+  parser.add_argument(
+    '--gateway', type=str, default='flask', choices=['flask', 'async'],
+    help='Gateway front end: threaded Flask server or asyncio (aiohttp) server'
+  )
+
+  parser.add_argument(
+    '--config_file', type=str, default='config_gateway.txt',
+    help='Gateway configuration file (endpoints, NR_WORKERS, etc)'
+  )
+
   args = parser.parse_args()
   base_folder = args.base_folder
   app_folder = args.app_folder
   host = args.host
   port = args.port
+  gateway = args.gateway
+  config_file = args.config_file
 
   host_id = 'h' + uuid.uuid4().hex[:4]
   ### Attention! config_file should contain the configuration for each endpoint; 'NR_WORKERS' and upstream configuration
   log = Logger(
     lib_name='APPv' + APP_VER,
     host_id=host_id,
-    config_file='config_gateway.txt',
+    config_file=config_file,
     base_folder=base_folder, app_folder=app_folder,
     TF_KERAS=False
   )
@@ -85,7 +97,15 @@ def main():
     
   sleep(3)
 
-  gtw = FlaskGateway(
+  if gateway == 'async':
+    if AsyncGateway is None:
+      raise ValueError("The async gateway requires the `aiohttp` package")
+    gateway_class = AsyncGateway
+  else:
+    gateway_class = FlaskGateway
+  log.P("Using {}".format(gateway_class.__name__))
+
+  gtw = gateway_class(
     log=log,
     host_id=host_id,
     # server_names=['get_micro_one', 'get_micro_two'],
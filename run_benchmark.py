@@ -0,0 +1,285 @@
+"""
+Benchmark of the gateway and of the servers.
+
+Starts a gateway (`run_gateway.py`) with `benchmark/config_benchmark.txt` - or uses a running one
+given with `--url` - then sends the traffic sample `benchmark/sample_requests.jsonl` (or
+synthetic calls) and saves the throughput, error rate, latency percentiles and per hop breakdown
+as json so the results of two versions can be compared with `--compare`.
+
+  python run_benchmark.py --mode closed --concurrency 16 --duration 20
+  python run_benchmark.py --mode open --rps 200 --duration 20 --synthetic --sleep_ms 20
+  python run_benchmark.py --mode replay --speed 2 --compare _cache/_benchmarks/bench_old.json
+"""
+import os
+import sys
+import json
+import signal
+import platform
+import argparse
+import subprocess
+import requests
+
+from datetime import datetime
+from time import sleep, time
+
+from basic_inference_server import Logger, LIB_VER
+from basic_inference_server.model_server.request_utils import MSCT
+from basic_inference_server.model_server import benchmark as bm
+
+from app_ver import __VER__ as APP_VER
+
+STARTUP_TIMEOUT = 120
+
+
+def start_gateway(log, args, log_file):
+  cmd = [
+    sys.executable, 'run_gateway.py',
+    '--config_file', args.config_file,
+    '--port', str(args.port),
+    '--gateway', args.gateway,
+    '-b', args.base_folder,
+    '-a', args.app_folder,
+  ]
+  log.P("Starting gateway: {}".format(' '.join(cmd)))
+  fh = open(log_file, 'wt')
+  process = subprocess.Popen(cmd, stdout=fh, stderr=subprocess.STDOUT)
+  return process, fh
+
+
+def stop_gateway(log, process):
+  log.P("Stopping gateway pid {} ...".format(process.pid))
+  # SIGTERM runs the gateway shutdown that also terminates the servers
+  process.send_signal(signal.SIGTERM)
+  try:
+    process.wait(timeout=30)
+  except subprocess.TimeoutExpired:
+    process.kill()
+  return
+
+
+def wait_servers(log, url, process=None):
+  start = time()
+  while (time() - start) < STARTUP_TIMEOUT:
+    if process is not None and process.poll() is not None:
+      raise ValueError("The gateway ended with code {}".format(process.returncode))
+    try:
+      servers = requests.get(url + MSCT.RULE_LIST, timeout=2).json()['AVAIL_SERVERS']
+      if len(servers) > 0 and all(x.get('READY') for x in servers.values()):
+        log.P("Servers ready after {:.1f}s: {}".format(time() - start, list(servers)), color='g')
+        return servers
+    except (requests.RequestException, ValueError, KeyError):
+      pass
+    sleep(1)
+  #endwhile
+  raise ValueError("The servers were not ready after {}s".format(STARTUP_TIMEOUT))
+
+
+def get_server_urls(url, servers):
+  # the servers run on the gateway host on the ports listed by the gateway
+  host = url.rsplit(':', 1)[0]
+  return {
+    name : '{}:{}'.format(host, info['PORT'])
+    for name, info in servers.items() if info.get('PORT') is not None
+  }
+
+
+def scrape_all(url, server_urls):
+  gateway_metrics = bm.scrape_metrics(url)
+  servers_metrics = {name : bm.scrape_metrics(server_url) for name, server_url in server_urls.items()}
+  return gateway_metrics, servers_metrics
+
+
+def run(args, load_gen):
+  if args.mode == bm.MODE_CLOSED:
+    return load_gen.run_closed_loop(
+      concurrency=args.concurrency, duration=args.duration if args.nr_requests is None else None,
+      nr_requests=args.nr_requests,
+    )
+  if args.mode == bm.MODE_OPEN:
+    return load_gen.run_open_loop(rps=args.rps, duration=args.duration, max_in_flight=args.max_in_flight)
+  return load_gen.run_open_loop(speed=args.speed, max_in_flight=args.max_in_flight)
+
+
+def show_results(log, result):
+  def _line(name, res):
+    lat = res['latency_ms']
+    return "  {:<22} req: {:>6}  err: {:>6.2%}  thr: {:>8.1f}/s  p50: {:>8}  p95: {:>8}  p99: {:>8} ms".format(
+      name, res['requests'], res['error_rate'], res['throughput'], lat.get('p50'), lat.get('p95'), lat.get('p99'),
+    )
+  lines = ["Results ({:.1f}s):".format(result['elapsed']), _line('ALL', result)]
+  for sig, res in result['signatures'].items():
+    lines.append(_line(sig, res))
+  for sig, hops in result.get('hops', {}).items():
+    lines.append("  Hops of '{}' (mean / p99 ms):".format(sig))
+    for hop, stats in hops.items():
+      if isinstance(stats, dict):
+        if stats.get('count', 0) > 0:
+          lines.append("    {:<24} {:>8} / {}".format(hop, stats['mean'], stats['p99']))
+      else:
+        lines.append("    {:<24} {:>8}".format(hop, stats))
+    #endfor
+  #endfor
+  log.P("\n".join(lines), color='g')
+  return
+
+
+def run_load(log, args, lst_requests, folder, stamp, startup):
+  process, fh = None, None
+  url = args.url
+  start = time()
+  if url is None:
+    url = 'http://127.0.0.1:{}'.format(args.port)
+    process, fh = start_gateway(log, args, os.path.join(folder, 'gateway_{}.log'.format(stamp)))
+  url = url.rstrip('/')
+
+  try:
+    servers = wait_servers(log, url, process)
+    if process is not None:
+      startup['servers_ready_s'] = round(time() - start, 2)
+    server_urls = get_server_urls(url, servers)
+    load_gen = bm.LoadGenerator(url, lst_requests, path=args.path, timeout=args.timeout)
+    if args.warmup > 0:
+      log.P("Warmup {}s ...".format(args.warmup))
+      load_gen.run_closed_loop(concurrency=args.concurrency, duration=args.warmup)
+
+    gateway_before, servers_before = scrape_all(url, server_urls)
+    log.P("Running {} loop benchmark ...".format(args.mode))
+    records, elapsed = run(args, load_gen)
+    gateway_after, servers_after = scrape_all(url, server_urls)
+  finally:
+    if process is not None:
+      stop_gateway(log, process)
+      fh.close()
+  #endtry
+
+  result = bm.summarize_records(records, elapsed)
+  result['hops'] = bm.get_hops(result, gateway_before, gateway_after, servers_before, servers_after)
+  show_results(log, result)
+  return result
+
+
+def show_import_report(log, report):
+  lines = ["Import of '{}': {} ms ({} ms in the package, {} modules). Slowest (cumulative ms):".format(
+    report['module'], report['total_ms'], report['own_ms'], report['nr_modules'],
+  )]
+  for name, t in report['top_cumulative']:
+    lines.append("  {:<56} {:>8}".format(name, t))
+  log.P("\n".join(lines))
+  return
+
+
+def main():
+  parser = argparse.ArgumentParser()
+
+  parser.add_argument('-b', '--base_folder', type=str, default='.', help='Local cache base folder')
+  parser.add_argument('-a', '--app_folder', type=str, default='_cache', help='Local cache app folder')
+  parser.add_argument(
+    '--url', type=str, default=None,
+    help='Url of a running gateway. If not given a gateway is started with --config_file'
+  )
+  parser.add_argument('--config_file', type=str, default='benchmark/config_benchmark.txt')
+  parser.add_argument('--gateway', type=str, default='flask', choices=['flask', 'async'])
+  parser.add_argument('--port', type=int, default=5702)
+  parser.add_argument('--path', type=str, default=MSCT.RULE_RUN, help='Execution path of the gateway')
+
+  parser.add_argument('--requests_file', type=str, default='benchmark/sample_requests.jsonl')
+  parser.add_argument(
+    '--synthetic', action='store_true',
+    help='Send synthetic calls to --signature instead of the requests file'
+  )
+  parser.add_argument('--signature', type=str, default='synthetic_model')
+  parser.add_argument('--sleep_ms', type=float, default=10)
+  parser.add_argument('--cpu_ms', type=float, default=0)
+  parser.add_argument('--payload_size', type=int, default=256)
+
+  parser.add_argument(
+    '--mode', type=str, default=bm.MODE_CLOSED, choices=[bm.MODE_CLOSED, bm.MODE_OPEN, bm.MODE_REPLAY],
+    help='closed: fixed concurrency; open: fixed request rate; replay: the `t` offsets of the requests file'
+  )
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--nr_requests', type=int, default=None, help='Closed loop: stop after this many calls')
+  parser.add_argument('--rps', type=float, default=50)
+  parser.add_argument('--speed', type=float, default=1, help='Replay: speed up factor of the `t` offsets')
+  parser.add_argument('--duration', type=float, default=20)
+  parser.add_argument('--warmup', type=float, default=2, help='Seconds of closed loop calls that are not measured')
+  parser.add_argument('--max_in_flight', type=int, default=256, help='Open loop: max calls in progress')
+  parser.add_argument('--timeout', type=float, default=30)
+
+  parser.add_argument(
+    '--startup_only', action='store_true',
+    help='Only measure the import time of the package (no gateway and no load)'
+  )
+
+  parser.add_argument('--label', type=str, default=None, help='Free text saved with the results (e.g. git commit)')
+  parser.add_argument('--output', type=str, default=None, help='Results json. Default in <base>/<app>/_benchmarks')
+  parser.add_argument('--compare', type=str, default=None, help='Results json of a previous run')
+  parser.add_argument(
+    '--max_regression', type=float, default=None,
+    help='With --compare: exit code 1 if throughput or latency percentiles got worse by more than this percent'
+  )
+
+  args = parser.parse_args()
+
+  log = Logger(
+    lib_name='BENCH',
+    base_folder=args.base_folder, app_folder=args.app_folder,
+    TF_KERAS=False
+  )
+
+  if args.synthetic:
+    lst_requests = bm.synthetic_requests(
+      signature=args.signature, sleep_ms=args.sleep_ms, cpu_ms=args.cpu_ms, payload_size=args.payload_size,
+    )
+  else:
+    lst_requests = bm.load_requests(args.requests_file)
+  log.P("Loaded {} request(s)".format(len(lst_requests)))
+
+  folder = os.path.join(args.base_folder, args.app_folder, '_benchmarks')
+  os.makedirs(folder, exist_ok=True)
+  stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+  output = args.output or os.path.join(folder, 'bench_{}.json'.format(stamp))
+
+  startup = {'import' : bm.get_import_report()}
+  show_import_report(log, startup['import'])
+  if args.startup_only:
+    result = None
+  else:
+    result = run_load(log, args, lst_requests, folder, stamp, startup)
+
+  data = {
+    'label'       : args.label,
+    'time'        : stamp,
+    'versions'    : {'lib' : LIB_VER, 'app' : APP_VER},
+    'environment' : {
+      'python'    : sys.version.split(' ')[0],
+      'platform'  : platform.platform(),
+      'cpu_count' : os.cpu_count(),
+    },
+    'params'      : {k : v for k, v in vars(args).items() if k not in ['compare', 'output']},
+    'startup'     : startup,
+    'results'     : result,
+  }
+
+  exit_code = 0
+  if args.compare is not None:
+    with open(args.compare, 'rt') as fh:
+      baseline = json.load(fh)
+    data['comparison'] = bm.compare_results(baseline, data)
+    log.P("Compared with '{}' (lib v{}): {}".format(
+      args.compare, baseline['versions']['lib'], json.dumps(data['comparison'], indent=2))
+    )
+    if args.max_regression is not None:
+      regressions = bm.get_regressions(data['comparison'], args.max_regression)
+      if len(regressions) > 0:
+        log.P("Regressions above {}%: {}".format(args.max_regression, regressions), color='r')
+        exit_code = 1
+  #endif
+
+  with open(output, 'wt') as fh:
+    json.dump(data, fh, indent=2)
+  log.P("Results saved to '{}'".format(output), color='g')
+  return exit_code
+
+
+if __name__ == '__main__':
+  sys.exit(main())